@@ -0,0 +1,139 @@
+# Runs in the background for every on-demand service of the native backend,
+# like launchd does for the launchd backend. It is handed the listening
+# sockets of the service and starts the service with them when a connection
+# arrives, a watched path changes, a queue directory is not empty, a path
+# state holds or `service start` sends it SIGUSR1
+import subprocess
+import backends
+import logging
+import signal
+import select
+import socket
+import time
+import sys
+import os
+
+
+POLL_INTERVAL = 1.0
+# like launchd, a service is not started again within this many seconds of
+# its last start unless the plist sets ThrottleInterval
+THROTTLE_INTERVAL = 10
+
+
+def path_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def queue_ready(path):
+    try:
+        return bool(os.listdir(path))
+    except OSError:
+        return False
+
+
+class Activator:
+    def __init__(self, backend, label, fds):
+        self.backend = backend
+        self.label = label
+        self.fds = fds
+        job = backend.read_job(label)
+        data, _ = backend.command(job["config"])
+        self.watch = {
+            path: path_signature(path) for path in data.get("WatchPaths", [])
+        }
+        self.queues = data.get("QueueDirectories", [])
+        keep_alive = data.get("KeepAlive")
+        self.path_state = (
+            keep_alive.get("PathState", dict()) if isinstance(keep_alive, dict) else {}
+        )
+        self.throttle = data.get("ThrottleInterval", THROTTLE_INTERVAL)
+        self.last_start = None
+        self.requests = dict(start=False, stop=False)
+
+    def triggered(self, readable):
+        changed = False
+        for path, signature in self.watch.items():
+            current = path_signature(path)
+            if current != signature:
+                self.watch[path] = current
+                changed = True
+        return (
+            changed
+            or any(fd in self.fds for fd in readable)
+            or any(queue_ready(path) for path in self.queues)
+            or any(
+                os.path.exists(path) == state for path, state in self.path_state.items()
+            )
+        )
+
+    def run(self):
+        wakeup, wakeup_writer = socket.socketpair()
+        wakeup.setblocking(False)
+        wakeup_writer.setblocking(False)
+        # signals wake up select through the socket pair
+        signal.set_wakeup_fd(wakeup_writer.fileno())
+        signal.signal(signal.SIGUSR1, lambda *_: self.requests.update(start=True))
+        signal.signal(signal.SIGTERM, lambda *_: self.requests.update(stop=True))
+        signal.signal(signal.SIGCHLD, lambda *_: None)
+
+        while not self.requests["stop"]:
+            self.backend.reap()
+            running = bool(self.backend.children)
+            now = time.monotonic()
+            throttled = (
+                self.last_start is not None and now - self.last_start < self.throttle
+            )
+            watched = [wakeup] + ([] if running or throttled else self.fds)
+            timeout = POLL_INTERVAL
+            if throttled and not running:
+                timeout = min(timeout, self.throttle - (now - self.last_start))
+            readable, _, _ = select.select(watched, [], [], timeout)
+            try:
+                while wakeup.recv(64):
+                    pass
+            except BlockingIOError:
+                pass
+            if self.requests["stop"] or running:
+                continue
+
+            job = self.backend.read_job(self.label)
+            if job is None:
+                # the service was unloaded
+                break
+            if self.requests["start"] or (not throttled and self.triggered(readable)):
+                self.requests["start"] = False
+                self.last_start = time.monotonic()
+                self.backend.spawn(self.label, job, self.fds)
+        self.stop()
+
+    def stop(self):
+        for _, child in list(self.backend.children.values()):
+            child.terminate()
+            try:
+                child.wait(backends.RESTART_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                child.kill()
+                child.wait()
+        self.backend.reap()
+
+
+def main():
+    state_dir, label = sys.argv[1:3]
+    logging.basicConfig(format="activator: %(message)s")
+    # the job is written once the backend knows the pid of the activator
+    sys.stdin.read()
+    fds = os.environ.pop("SERVICE_LISTEN_FDS", "").split(",")
+    fds = [int(fd) for fd in fds if fd]
+    backend = backends.NativeBackend(state_dir, logging.getLogger("activator"))
+    if backend.read_job(label) is None:
+        return 1
+    Activator(backend, label, fds).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,507 @@
+import subprocess
+import on_demand
+import registry
+import tracing
+import socket
+import signal
+import select
+import stat
+import json
+import time
+import sys
+import os
+
+
+BACKENDS = ("auto", "launchd", "native")
+# how long `start` waits for a running instance to exit before killing it
+RESTART_TIMEOUT = 5.0
+ACTIVATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "activator.py")
+MONITOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "monitor.py")
+RLIMITS = dict(
+    CPU="RLIMIT_CPU",
+    Core="RLIMIT_CORE",
+    Data="RLIMIT_DATA",
+    FileSize="RLIMIT_FSIZE",
+    MemoryLock="RLIMIT_MEMLOCK",
+    NumberOfFiles="RLIMIT_NOFILE",
+    NumberOfProcesses="RLIMIT_NPROC",
+    ResidentSetSize="RLIMIT_RSS",
+    Stack="RLIMIT_STACK",
+)
+
+
+class BackendError(Exception):
+    pass
+
+
+def parse_launchctl_list(output):
+    snapshot = dict()
+    for line in output.strip().split("\n"):
+        parts = line.split("\t")
+        if len(parts) != 3 or parts[2] == "Label":
+            continue
+        pid, retcode, label = parts
+        snapshot[label] = (
+            None if pid == "-" else int(pid),
+            None if retcode == "-" else int(retcode),
+        )
+    return snapshot
+
+
+class LaunchdBackend:
+    def __init__(self, domain, logger):
+        self.domain = domain
+        self.logger = logger
+
+    def launchctl(self, *args, capture=False):
+        # every launchctl call goes through here so that it can be traced
+        with tracing.span(f"launchctl {args[0]}", argv=" ".join(args)) as span:
+            c = subprocess.run(
+                ["launchctl", *args],
+                stdout=subprocess.PIPE if capture else None,
+                text=True,
+            )
+            span["returncode"] = c.returncode
+        return c
+
+    def target(self, label):
+        return f"{self.domain}/{label}"
+
+    def snapshot(self):
+        c = self.launchctl("list", capture=True)
+        if c.returncode != 0:
+            raise BackendError(f"launchctl list exited with status {c.returncode}")
+        return parse_launchctl_list(c.stdout)
+
+    def load(self, label, config):
+        c = self.launchctl("enable", self.target(label))
+        if c.returncode != 0:
+            self.logger.debug("error while enabling the service")
+            return c.returncode
+        self.logger.debug("Enabled the service")
+        return self.launchctl("bootstrap", self.domain, config).returncode
+
+    def unload(self, label, config):
+        c = self.launchctl("disable", self.target(label))
+        if c.returncode != 0:
+            self.logger.info("error while disabling the service")
+        else:
+            self.logger.debug("Disabled the service")
+        return self.launchctl("bootout", self.domain, config).returncode
+
+    def start(self, label):
+        return self.launchctl("kickstart", "-k", self.target(label)).returncode
+
+    def stop(self, label):
+        return self.launchctl("stop", label).returncode
+
+    def kill(self, label, signum=signal.SIGKILL):
+        return self.launchctl("kill", str(int(signum)), self.target(label)).returncode
+
+    def reap(self):
+        pass
+
+
+def process_start_time(pid):
+    # identifies a process together with its pid, so that a recycled pid is
+    # not mistaken for the service
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    fields = data[data.rfind(b")") + 2 :].split()
+    if fields[0] == b"Z":
+        return None
+    return int(fields[19])
+
+
+def process_setup(data):
+    # applies the Nice and resource limit keys of a plist in the child, like
+    # launchd does. Like launchd, a value that can not be applied is skipped
+    nice = data.get("Nice")
+    soft = data.get("SoftResourceLimits", dict())
+    hard = data.get("HardResourceLimits", dict())
+    if nice is None and not soft and not hard:
+        return None
+
+    def setup():
+        import resource
+
+        if nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, nice)
+            except OSError:
+                pass
+        for key in set(soft) | set(hard):
+            if not hasattr(resource, RLIMITS.get(key, "")):
+                continue
+            limit = getattr(resource, RLIMITS[key])
+            current_soft, current_hard = resource.getrlimit(limit)
+            new_hard = hard.get(key, current_hard)
+            new_soft = soft.get(key, current_soft)
+            if new_hard != resource.RLIM_INFINITY and (
+                new_soft == resource.RLIM_INFINITY or new_soft > new_hard
+            ):
+                new_soft = new_hard
+            try:
+                resource.setrlimit(limit, (new_soft, new_hard))
+            except (ValueError, OSError):
+                pass
+
+    return setup
+
+
+def open_listeners(data):
+    # binds the sockets of an on-demand plist, so that an address that is in
+    # use is reported when the service is loaded
+    specs = []
+    for value in data.get("Sockets", dict()).values():
+        specs += value if isinstance(value, list) else [value]
+    listeners = []
+    try:
+        for spec in specs:
+            if "SockPathName" in spec:
+                path = spec["SockPathName"]
+                # a socket left behind by an earlier run is replaced
+                try:
+                    if stat.S_ISSOCK(os.stat(path).st_mode):
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                listeners.append(sock)
+                sock.bind(path)
+            else:
+                family, kind, proto, _, address = socket.getaddrinfo(
+                    spec.get("SockNodeName"),
+                    int(spec["SockServiceName"]),
+                    type=socket.SOCK_STREAM,
+                    flags=socket.AI_PASSIVE,
+                )[0]
+                sock = socket.socket(family, kind, proto)
+                listeners.append(sock)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(address)
+            sock.listen(socket.SOMAXCONN)
+    except OSError:
+        for sock in listeners:
+            sock.close()
+        raise
+    return listeners
+
+
+def open_pidfd(pid):
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except ProcessLookupError:
+        raise
+    except OSError:
+        return None
+
+
+class NativeBackend:
+    # runs services as child processes instead of handing them to a service
+    # manager. Every loaded job is a json file in `state_dir` recording its
+    # plist and the process it runs as, so status is read without spawning
+    # anything. Every service runs under a monitor.py process that waits for
+    # it and records its exit code, so the exit code is known whichever
+    # command started the service
+    def __init__(self, state_dir, logger):
+        self.state_dir = state_dir
+        self.logger = logger
+        self.children = dict()
+        self.monitors = []
+        os.makedirs(state_dir, exist_ok=True)
+
+    def job_path(self, label):
+        return os.path.join(self.state_dir, f"{label}.json")
+
+    def read_job(self, label):
+        try:
+            with open(self.job_path(label), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_job(self, label, job):
+        path = self.job_path(label)
+        with tracing.span("job write", path=path):
+            registry.atomic_write(path, json.dumps(job))
+
+    def is_running(self, job):
+        pid = job["pid"]
+        if pid is None:
+            return False
+        try:
+            pidfd = open_pidfd(pid)
+        except ProcessLookupError:
+            return False
+        if pidfd is not None:
+            os.close(pidfd)
+        elif not os.path.isdir("/proc"):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                pass
+            return True
+        return process_start_time(pid) == job["started"]
+
+    def reap(self):
+        # monitors started by this process only need to be waited for
+        self.monitors = [
+            monitor for monitor in self.monitors if monitor.poll() is None
+        ]
+        for pid, (label, child) in list(self.children.items()):
+            retcode = child.poll()
+            if retcode is None:
+                continue
+            del self.children[pid]
+            job = self.read_job(label)
+            # a snapshot may have cleared the pid of the exited process already
+            if job is not None and job["pid"] in (pid, None):
+                job["pid"] = None
+                job["started"] = None
+                job["retcode"] = retcode
+                self.write_job(label, job)
+
+    def snapshot(self):
+        self.reap()
+        snapshot = dict()
+        for entry in os.listdir(self.state_dir):
+            if not entry.endswith(".json"):
+                continue
+            label = entry[: -len(".json")]
+            job = self.read_job(label)
+            if job is None:
+                continue
+            if job["pid"] is not None and not self.is_running(job):
+                job["pid"] = None
+                job["started"] = None
+                self.write_job(label, job)
+            snapshot[label] = (job["pid"], job["retcode"])
+        return snapshot
+
+    def command(self, config):
+        import plistlib
+
+        with open(config, "rb") as f:
+            data = plistlib.load(f)
+        arguments = list(data.get("ProgramArguments", []))
+        if "Program" in data:
+            arguments = [data["Program"], *arguments[1:]]
+        # the generated plists run a python launcher whose shebang points at
+        # a macOS framework build
+        if arguments[0].endswith(".py"):
+            arguments.insert(0, sys.executable)
+        return data, arguments
+
+    def output_paths(self, data, job):
+        workdir = data.get("WorkingDirectory", os.path.dirname(job["config"]))
+        outpath = os.path.join(workdir, data.get("StandardOutPath", "/dev/null"))
+        errpath = os.path.join(workdir, data.get("StandardErrorPath", outpath))
+        os.makedirs(os.path.dirname(outpath), exist_ok=True)
+        os.makedirs(os.path.dirname(errpath), exist_ok=True)
+        return workdir, outpath, errpath
+
+    def spawn(self, label, job, fds=()):
+        data, arguments = self.command(job["config"])
+        workdir, outpath, errpath = self.output_paths(data, job)
+        env = dict(os.environ, **data.get("EnvironmentVariables", {}))
+        if fds:
+            # service_launcher.py moves the sockets to where LISTEN_FDS
+            # expects them
+            env["SERVICE_LISTEN_FDS"] = ",".join(str(fd) for fd in fds)
+
+        with open(outpath, "ab") as stdout, open(errpath, "ab") as stderr:
+            child = subprocess.Popen(
+                arguments,
+                cwd=workdir,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=stdout,
+                stderr=stderr,
+                start_new_session=True,
+                pass_fds=fds,
+                preexec_fn=process_setup(data),
+            )
+        self.children[child.pid] = (label, child)
+        job["pid"] = child.pid
+        job["started"] = process_start_time(child.pid)
+        self.write_job(label, job)
+        return 0
+
+    def launch(self, label):
+        # starts the service under a monitor and waits until it runs
+        monitor = subprocess.Popen(
+            [sys.executable, MONITOR, self.state_dir, label],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            start_new_session=True,
+        )
+        with monitor.stdout:
+            line = monitor.stdout.readline().decode().strip()
+        self.monitors.append(monitor)
+        if not line.isdigit():
+            monitor.wait()
+            self.logger.error(line or f"Could not start {label}")
+            return 1
+        return 0
+
+    def has_activator(self, job):
+        pid = job.get("activator")
+        return pid is not None and process_start_time(pid) == job["activator_started"]
+
+    def activate(self, label, job, data):
+        # on-demand services are started by an activator process that holds
+        # their sockets and watches their paths, see activator.py
+        try:
+            listeners = open_listeners(data)
+        except OSError as e:
+            self.logger.error(f"Could not listen on the sockets of {label}: {e}")
+            return 1
+        _, _, errpath = self.output_paths(data, job)
+        fds = [sock.fileno() for sock in listeners]
+        try:
+            with open(errpath, "ab") as stderr:
+                activator = subprocess.Popen(
+                    [sys.executable, ACTIVATOR, self.state_dir, label],
+                    env=dict(os.environ, SERVICE_LISTEN_FDS=",".join(map(str, fds))),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr,
+                    start_new_session=True,
+                    pass_fds=fds,
+                )
+        finally:
+            for sock in listeners:
+                sock.close()
+        job["activator"] = activator.pid
+        job["activator_started"] = process_start_time(activator.pid)
+        self.write_job(label, job)
+        # the activator waits for its job to be written before it starts
+        activator.stdin.close()
+        return 0
+
+    def load(self, label, config):
+        job = self.read_job(label)
+        if job is not None:
+            self.logger.debug(f"{label} is already loaded")
+            return 5
+        job = dict(config=config, pid=None, started=None, retcode=None)
+        self.write_job(label, job)
+        data = self.command(config)[0]
+        if on_demand.is_on_demand(data):
+            code = self.activate(label, job, data)
+            if code != 0:
+                os.remove(self.job_path(label))
+            return code
+        if data.get("RunAtLoad", False):
+            return self.launch(label)
+        return 0
+
+    def unload(self, label, config):
+        job = self.read_job(label)
+        if job is None:
+            return 3
+        # removed first, so that the exit of the service is not recorded in
+        # a job that was unloaded
+        os.remove(self.job_path(label))
+        if self.has_activator(job):
+            # the activator stops the service before it exits
+            self.signal_pid(job["activator"], signal.SIGTERM)
+        elif self.is_running(job):
+            self.send_signal(job, signal.SIGTERM)
+        return 0
+
+    def send_signal(self, job, signum):
+        return self.signal_pid(job["pid"], signum)
+
+    def signal_pid(self, pid, signum):
+        try:
+            pidfd = open_pidfd(pid)
+        except ProcessLookupError:
+            return 3
+        try:
+            if pidfd is not None:
+                signal.pidfd_send_signal(pidfd, signum)
+            else:
+                os.kill(pid, signum)
+        except ProcessLookupError:
+            return 3
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+        return 0
+
+    def wait_exit(self, job, timeout):
+        pid = job["pid"]
+        if pid in self.children:
+            try:
+                self.children[pid][1].wait(timeout)
+            except subprocess.TimeoutExpired:
+                return False
+            self.reap()
+            return True
+        try:
+            pidfd = open_pidfd(pid)
+        except ProcessLookupError:
+            return True
+        if pidfd is not None:
+            # a pidfd becomes readable once the process has exited
+            try:
+                readable, _, _ = select.select([pidfd], [], [], timeout)
+            finally:
+                os.close(pidfd)
+            return bool(readable) or not self.is_running(job)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.is_running(job):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def start(self, label):
+        job = self.read_job(label)
+        if job is None:
+            return 113
+        if self.is_running(job):
+            self.send_signal(job, signal.SIGTERM)
+            if not self.wait_exit(job, RESTART_TIMEOUT):
+                self.send_signal(job, signal.SIGKILL)
+                self.wait_exit(job, RESTART_TIMEOUT)
+            job = self.read_job(label)
+        if self.has_activator(job):
+            # the activator starts the service with its sockets
+            return self.signal_pid(job["activator"], signal.SIGUSR1)
+        return self.launch(label)
+
+    def stop(self, label):
+        job = self.read_job(label)
+        if job is None:
+            return 113
+        if not self.is_running(job):
+            return 0
+        return self.send_signal(job, signal.SIGTERM)
+
+    def kill(self, label, signum=signal.SIGKILL):
+        job = self.read_job(label)
+        if job is None:
+            return 113
+        if not self.is_running(job):
+            return 3
+        return self.send_signal(job, signum)
+
+
+def open_backend(name, domain, state_dir, logger):
+    if name == "auto":
+        name = "launchd" if sys.platform == "darwin" else "native"
+    if name == "launchd":
+        return LaunchdBackend(domain, logger)
+    elif name == "native":
+        return NativeBackend(state_dir, logger)
+    raise BackendError(f"Unknown service backend {name}")
@@ -0,0 +1,173 @@
+# A stand-in for launchctl that keeps its jobs in $FAKE_LAUNCHCTL_DIR so
+# the service manager can be benchmarked on machines without launchd. Every
+# job is one file holding its pid and last exit status, and every call is
+# appended to the `calls` file
+import sys
+import os
+import re
+
+
+STATE_DIR = os.environ.get("FAKE_LAUNCHCTL_DIR", "/tmp/fake-launchctl")
+JOBS_DIR = os.path.join(STATE_DIR, "jobs")
+LABEL = re.compile(r"<key>Label</key>\s*<string>([^<]*)</string>")
+
+
+def job_path(label):
+    return os.path.join(JOBS_DIR, label)
+
+
+def read_job(label):
+    try:
+        with open(job_path(label), "r") as f:
+            pid, status = f.read().split()
+    except FileNotFoundError:
+        return None
+    return (None if pid == "-" else int(pid)), int(status)
+
+
+def write_job(label, pid, status):
+    tmp = f"{job_path(label)}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(f"{'-' if pid is None else pid} {status}")
+    os.replace(tmp, job_path(label))
+
+
+def next_pid():
+    # pids only need to be unique, the offset keeps them out of the way of
+    # real processes that a caller might look up
+    return 100000 + os.getpid()
+
+
+def target_label(target):
+    return target.split("/", 2)[-1]
+
+
+def plist_label(path):
+    with open(path, "r") as f:
+        match = LABEL.search(f.read())
+    return match.group(1) if match else None
+
+
+def list_jobs(args):
+    if args:
+        job = read_job(args[0])
+        if job is None:
+            print(f'Could not find service "{args[0]}" in domain for port')
+            return 113
+        pid, status = job
+        print("{")
+        print(f'\t"LastExitStatus" = {status};')
+        if pid is not None:
+            print(f'\t"PID" = {pid};')
+        print(f'\t"Label" = "{args[0]}";')
+        print("};")
+        return 0
+
+    lines = ["PID\tStatus\tLabel"]
+    for label in sorted(os.listdir(JOBS_DIR)):
+        if label.endswith(".tmp"):
+            continue
+        job = read_job(label)
+        if job is None:
+            continue
+        pid, status = job
+        lines.append(f"{'-' if pid is None else pid}\t{status}\t{label}")
+    print("\n".join(lines))
+    return 0
+
+
+def bootstrap(args):
+    label = plist_label(args[1])
+    if label is None:
+        return 5
+    if read_job(label) is not None:
+        print("Bootstrap failed: 5: Input/output error", file=sys.stderr)
+        return 5
+    write_job(label, next_pid(), 0)
+    return 0
+
+
+def bootout(args):
+    label = plist_label(args[1]) if len(args) > 1 else target_label(args[0])
+    if label is None or read_job(label) is None:
+        print("Boot-out failed: 3: No such process", file=sys.stderr)
+        return 3
+    os.remove(job_path(label))
+    return 0
+
+
+def kickstart(args):
+    label = target_label(args[-1])
+    job = read_job(label)
+    if job is None:
+        return 113
+    if job[0] is None or "-k" in args:
+        write_job(label, next_pid(), job[1])
+    return 0
+
+
+def kill(args):
+    label = target_label(args[-1])
+    job = read_job(label)
+    if job is None:
+        return 113
+    if job[0] is None:
+        return 3
+    signal = args[0].lstrip("SIG")
+    write_job(label, None, -int(signal) if signal.isdigit() else -9)
+    return 0
+
+
+def stop(args):
+    job = read_job(args[0])
+    if job is None:
+        return 113
+    write_job(args[0], None, -15 if job[0] is not None else job[1])
+    return 0
+
+
+def print_job(args):
+    label = target_label(args[0])
+    job = read_job(label)
+    if job is None:
+        print(f"Could not find service \"{label}\" in domain", file=sys.stderr)
+        return 113
+    pid, status = job
+    print(f"{args[0]} = {{")
+    print(f"\tstate = {'running' if pid is not None else 'not running'}")
+    if pid is not None:
+        print(f"\tpid = {pid}")
+    print(f"\tlast exit code = {status}")
+    print("}")
+    return 0
+
+
+COMMANDS = dict(
+    list=list_jobs,
+    bootstrap=bootstrap,
+    bootout=bootout,
+    enable=lambda args: 0,
+    disable=lambda args: 0,
+    kickstart=kickstart,
+    kill=kill,
+    stop=stop,
+    print=print_job,
+)
+
+
+def main():
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    fd = os.open(
+        os.path.join(STATE_DIR, "calls"), os.O_WRONLY | os.O_APPEND | os.O_CREAT
+    )
+    os.write(fd, (" ".join(sys.argv[1:]) + "\n").encode())
+    os.close(fd)
+
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"Unrecognized subcommand: {' '.join(sys.argv[1:2])}", file=sys.stderr)
+        return 64
+    return COMMANDS[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Runs the service manager against fleets of synthetic services with a fake
+# launchctl on PATH and reports the wall time, launchctl calls, spawned
+# processes and peak RSS of every command
+import subprocess
+import tempfile
+import argparse
+import shutil
+import json
+import time
+import glob
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_LAUNCHCTL = os.path.join(ROOT, "benchmarks", "fake_launchctl.py")
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+# installed as sitecustomize for the benchmarked commands, it appends a line
+# to $FLEET_SPAWN_LOG for every process a python process of the fleet spawns
+SPAWN_HOOK = """\
+import sys
+import os
+
+SPAWN_EVENTS = ("subprocess.Popen", "os.posix_spawn", "os.fork", "os.system")
+
+
+def count_spawn(event, args):
+    if event in SPAWN_EVENTS and "FLEET_SPAWN_LOG" in os.environ:
+        with open(os.environ["FLEET_SPAWN_LOG"], "a") as f:
+            f.write(event + "\\n")
+
+
+sys.addaudithook(count_spawn)
+"""
+# commands run in this order against every fleet, services are not loaded
+# into the fake launchctl until `start all`
+COMMANDS = dict(
+    status=["status"],
+    start_all=["start", "all"],
+    status_running=["status"],
+    status_json=["status", "--json"],
+    status_stopped=["status", "--filter", "status=stopped", "--format", "ndjson"],
+    info_json=["info", "service0", "--json"],
+    stop_all=["stop", "all"],
+    load=["load", "{apps}/extra/main.py", "-name", "extra"],
+)
+
+
+def create_fleet(workdir, size, backend):
+    for path in glob.glob(os.path.join(ROOT, "*.py")) + [
+        os.path.join(ROOT, "services.plist")
+    ]:
+        shutil.copy(path, workdir)
+    for directory in (".services", ".output", "apps", "bin", "launchctl", "hook"):
+        os.makedirs(os.path.join(workdir, directory))
+    with open(os.path.join(workdir, "hook", "sitecustomize.py"), "w") as f:
+        f.write(SPAWN_HOOK)
+
+    services = dict()
+    for name in [f"service{i}" for i in range(size)] + ["extra"]:
+        app = os.path.join(workdir, "apps", name)
+        os.makedirs(os.path.join(app, ".output"))
+        with open(os.path.join(app, "main.py"), "w") as f:
+            f.write("import time\ntime.sleep(3600)\n")
+        services[name] = dict(mainfile=os.path.join(app, "main.py"), startup=True)
+    services.pop("extra")
+    with open(os.path.join(workdir, "services.json"), "w") as f:
+        json.dump(services, f, indent=4)
+    with open(os.path.join(workdir, "settings.json"), "w") as f:
+        json.dump(dict(backend=backend), f, indent=4)
+
+    launchctl = os.path.join(workdir, "bin", "launchctl")
+    with open(launchctl, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" -S "{FAKE_LAUNCHCTL}" "$@"\n')
+    os.chmod(launchctl, 0o755)
+
+    path = f"{os.path.join(workdir, 'bin')}{os.pathsep}{os.environ['PATH']}"
+    with open(os.path.join(workdir, "env.txt"), "w") as f:
+        f.write(path)
+    return dict(
+        os.environ,
+        PATH=path,
+        PYTHONPATH=os.pathsep.join(
+            filter(None, [os.path.join(workdir, "hook"), os.environ.get("PYTHONPATH")])
+        ),
+        FAKE_LAUNCHCTL_DIR=os.path.join(workdir, "launchctl"),
+        FLEET_SPAWN_LOG=os.path.join(workdir, "spawned"),
+        SERVICE_NO_DAEMON="1",
+    )
+
+
+def count_lines(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read().count(b"\n")
+    except FileNotFoundError:
+        return 0
+
+
+def count_calls(workdir):
+    return count_lines(os.path.join(workdir, "launchctl", "calls"))
+
+
+def count_spawned(workdir):
+    return count_lines(os.path.join(workdir, "spawned"))
+
+
+def run_command(workdir, env, args):
+    args = [arg.format(apps=os.path.join(workdir, "apps")) for arg in args]
+    calls = count_calls(workdir)
+    spawned = count_spawned(workdir)
+    # stderr goes to a file, a pipe could fill up while the command runs
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(workdir, "main.py"), *args],
+            cwd=workdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+        )
+        # wait4 gives the resource usage of this one child only
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        stderr.seek(0)
+        output = stderr.read().decode(errors="replace")
+    return dict(
+        code=os.waitstatus_to_exitcode(status),
+        wall=wall,
+        launchctl_calls=count_calls(workdir) - calls,
+        spawned=count_spawned(workdir) - spawned,
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss=usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+        stderr=output,
+    )
+
+
+def benchmark(size, commands, backend, keep=False):
+    workdir = tempfile.mkdtemp(prefix=f"service-bench-{size}-")
+    try:
+        env = create_fleet(workdir, size, backend)
+        results = dict()
+        for name in commands:
+            results[name] = run_command(workdir, env, COMMANDS[name])
+        return results
+    finally:
+        if keep:
+            print(f"Kept the fleet of {size} services in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_table(size, results):
+    print(f"{size} services")
+    print(
+        f"  {'command':<16}{'wall':>10}{'launchctl':>11}{'spawned':>9}{'peak rss':>11}"
+    )
+    for name, result in results.items():
+        failed = "" if result["code"] == 0 else f"  exit {result['code']}"
+        print(
+            f"  {name:<16}{result['wall']:>9.3f}s{result['launchctl_calls']:>11}"
+            f"{result['spawned']:>9}{result['peak_rss'] / 1024 / 1024:>10.1f}M{failed}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks service commands against synthetic fleets"
+    )
+    parser.add_argument(
+        "--sizes",
+        help="Comma separated fleet sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_SIZES,
+    )
+    parser.add_argument(
+        "--commands",
+        help="Comma separated commands to run, in order",
+        type=lambda value: value.split(","),
+        default=list(COMMANDS),
+    )
+    parser.add_argument(
+        "--backend",
+        help="The service backend to benchmark, native starts real processes",
+        choices=["launchd", "native"],
+        default="launchd",
+    )
+    parser.add_argument(
+        "--json", help="Print the results as json", action="store_true"
+    )
+    parser.add_argument(
+        "--keep", help="Keep the generated fleets", action="store_true"
+    )
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_args()
+    unknown = [name for name in opts.commands if name not in COMMANDS]
+    if unknown:
+        print(f"Unknown commands: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    if os.getuid() == 0:
+        print("The service manager refuses to run as root", file=sys.stderr)
+        return 2
+
+    code = 0
+    report = dict()
+    for size in opts.sizes:
+        results = benchmark(size, opts.commands, opts.backend, opts.keep)
+        report[size] = results
+        for name, result in results.items():
+            if result["code"] != 0:
+                code = 1
+                print(f"{name} failed for {size} services:", file=sys.stderr)
+                print(result["stderr"], file=sys.stderr, end="")
+        if not opts.json:
+            print_table(size, results)
+    if opts.json:
+        for results in report.values():
+            for result in results.values():
+                result.pop("stderr")
+        print(json.dumps(report, indent=4))
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
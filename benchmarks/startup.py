@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Startup budget for the CLI. Measures how long `service status --json`
+# takes from process start to exit and how long importing main.py takes,
+# and exits non-zero when either is over its budget
+import statistics
+import subprocess
+import argparse
+import time
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUS_BUDGET = 0.25
+IMPORT_BUDGET = 0.08
+
+
+def time_status(env):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "main.py"), "status", "--json"],
+        stdout=subprocess.DEVNULL,
+        env=env,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def import_profile(env):
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        env=env,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    ).stderr
+
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.append((int(cumulative) / 1e6, name.rstrip()))
+    total = next(seconds for seconds, name in modules if name.strip() == "main")
+    return total, sorted(modules, reverse=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Checks the CLI startup budget")
+    parser.add_argument("--runs", help="Number of timed runs", type=int, default=10)
+    parser.add_argument(
+        "--status-budget",
+        help="Budget in seconds for the median `status --json` run",
+        type=float,
+        default=STATUS_BUDGET,
+    )
+    parser.add_argument(
+        "--import-budget",
+        help="Budget in seconds for importing main.py",
+        type=float,
+        default=IMPORT_BUDGET,
+    )
+    parser.add_argument(
+        "--top", help="How many of the slowest imports to show", type=int, default=10
+    )
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_args()
+    # measure the direct path, not a round trip to a running daemon
+    env = dict(os.environ, SERVICE_NO_DAEMON="1")
+
+    time_status(env)
+    runs = [time_status(env) for _ in range(opts.runs)]
+    median = statistics.median(runs)
+    imported, modules = import_profile(env)
+
+    print(f"status --json: median {median:.3f}s best {min(runs):.3f}s")
+    print(f"import main: {imported:.3f}s")
+    for seconds, name in modules[: opts.top]:
+        print(f"  {seconds:.3f}s {name}")
+
+    code = 0
+    if median > opts.status_budget:
+        print(f"status --json is over its budget of {opts.status_budget}s")
+        code = 1
+    if imported > opts.import_budget:
+        print(f"import main is over its budget of {opts.import_budget}s")
+        code = 1
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
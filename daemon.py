@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import daemon_client
+import socketserver
+import traceback
+import threading
+import logging
+import struct
+import signal
+import socket
+import json
+import time
+import sys
+import os
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        code = self.server.run(request, self.request)
+        daemon_client.send_frame(
+            self.request, daemon_client.EXIT, struct.pack("!i", code)
+        )
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, lib):
+        self.lib = lib
+        # commands share the process wide stdout, logger, working directory
+        # and environment, so they run one at a time
+        self.lock = threading.Lock()
+        super().__init__(path, RequestHandler)
+        os.chmod(path, 0o600)
+
+    def run(self, request, sock):
+        lib = self.lib
+        stdout = daemon_client.frame_stream(sock, daemon_client.STDOUT)
+        stderr = daemon_client.frame_stream(sock, daemon_client.STDERR)
+        with self.lock:
+            saved_streams = sys.stdout, sys.stderr
+            saved_handlers = lib.logger.handlers
+            saved_level = lib.logger.level
+            handler = logging.StreamHandler(stderr)
+            if saved_handlers:
+                handler.setFormatter(saved_handlers[0].formatter)
+            lib.logger.handlers = [handler]
+            sys.stdout, sys.stderr = stdout, stderr
+            cwd = os.getcwd()
+            saved_env = dict(os.environ)
+            opts = None
+            try:
+                os.chdir(request["cwd"])
+                os.environ.clear()
+                os.environ.update(request["env"])
+                opts, parser = lib.parse_args(request["argv"])
+                if daemon_client.runs_in_client(opts):
+                    # it would hold the lock until it is interrupted
+                    parser.error("This command has to run without the daemon")
+                code = lib.commands[opts.command](opts, parser)
+            except SystemExit as e:
+                code = e.code
+                if isinstance(code, str):
+                    stderr.write(f"{code}\n")
+                    code = 1
+            except Exception:
+                traceback.print_exc(file=stderr)
+                code = 1
+            finally:
+                if opts is not None:
+                    lib.finish_trace(opts)
+                stdout.flush()
+                stderr.flush()
+                sys.stdout, sys.stderr = saved_streams
+                lib.logger.handlers = saved_handlers
+                lib.logger.setLevel(saved_level)
+                os.chdir(cwd)
+                os.environ.clear()
+                os.environ.update(saved_env)
+                lib.get_index().save()
+        return code or 0
+
+
+def supervise(server):
+    # restart policies are applied by the daemon while it is running
+    lib = server.lib
+    interval = lib.get_setting("restart_check_interval")
+    while True:
+        time.sleep(interval)
+        with server.lock:
+            try:
+                lib.supervise_services()
+            except Exception:
+                lib.logger.exception("Failed to supervise services")
+
+
+def remove_stale_socket(path):
+    if not os.path.exists(path):
+        return True
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        os.remove(path)
+        return True
+    finally:
+        sock.close()
+    return False
+
+
+def main():
+    import main as lib
+
+    path = daemon_client.socket_path()
+    if not remove_stale_socket(path):
+        lib.logger.error("The service daemon is already running")
+        return 1
+
+    server = Daemon(path, lib)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    threading.Thread(target=supervise, args=(server,), daemon=True).start()
+    lib.logger.info(f"Listening on {path}")
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
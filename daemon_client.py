@@ -0,0 +1,103 @@
+import struct
+import socket
+import json
+import sys
+import io
+import os
+
+
+SOCKET_NAME = ".daemon.sock"
+# commands that keep following, refreshing or waiting until interrupted run
+# in the client, decided from the parsed arguments so that abbreviated and
+# attached forms like --wat or -w2 are caught too
+DIRECT_COMMANDS = ("top", "supervise", "export", "wait")
+DIRECT_OPTIONS = ("watch", "changes_only", "wait")
+FRAME = struct.Struct("!BI")
+EXIT = 0
+STDOUT = 1
+STDERR = 2
+
+
+def get_file(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+def socket_path():
+    return get_file(SOCKET_NAME)
+
+
+def send_frame(sock, channel, data):
+    sock.sendall(FRAME.pack(channel, len(data)) + data)
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class FrameWriter(io.RawIOBase):
+    def __init__(self, sock, channel):
+        self.sock = sock
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        send_frame(self.sock, self.channel, bytes(data))
+        return len(data)
+
+
+def frame_stream(sock, channel):
+    return io.TextIOWrapper(
+        io.BufferedWriter(FrameWriter(sock, channel)),
+        encoding="utf-8",
+        line_buffering=True,
+    )
+
+
+def runs_in_client(opts):
+    if opts.command in DIRECT_COMMANDS:
+        return True
+    return any(
+        getattr(opts, name, None) not in (None, False) for name in DIRECT_OPTIONS
+    )
+
+
+def should_forward(opts):
+    if os.environ.get("SERVICE_NO_DAEMON"):
+        return False
+    return not runs_in_client(opts)
+
+
+def forward(argv):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        # the command runs in the working directory and environment of the
+        # client, so settings like SERVICE_TRACE apply as they do without
+        # the daemon
+        request = dict(argv=argv, cwd=os.getcwd(), env=dict(os.environ))
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        while True:
+            header = recv_exact(sock, FRAME.size)
+            if header is None:
+                sys.stderr.write("The service daemon closed the connection\n")
+                return 1
+            channel, size = FRAME.unpack(header)
+            data = recv_exact(sock, size) or b""
+            if channel == EXIT:
+                return struct.unpack("!i", data)[0]
+            stream = sys.stdout if channel == STDOUT else sys.stderr
+            stream.buffer.write(data)
+            stream.flush()
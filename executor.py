@@ -0,0 +1,161 @@
+import concurrent.futures
+import threading
+import logging
+import time
+
+
+# Holds back the records a worker thread logs while it runs a task and
+# writes them as one block when the task finishes, so output from
+# different services never interleaves
+class ThreadBufferHandler(logging.Handler):
+    def __init__(self, handlers):
+        super().__init__(logging.NOTSET)
+        self.handlers = handlers
+        self.local = threading.local()
+        self.flush_lock = threading.Lock()
+
+    def emit(self, record):
+        records = getattr(self.local, "records", None)
+        if records is None:
+            self.forward([record])
+        else:
+            records.append(record)
+
+    def forward(self, records):
+        with self.flush_lock:
+            for record in records:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+    def begin(self, name):
+        self.local.name = name
+        self.local.records = []
+
+    def end(self):
+        records, self.local.records = self.local.records, None
+        for record in records:
+            record.msg = f"{self.local.name}: {record.getMessage()}"
+            record.args = None
+        self.forward(records)
+
+
+class Result:
+    def __init__(self, name, code, duration=0.0, error=None, started=None):
+        self.name = name
+        self.code = code
+        self.duration = duration
+        self.error = error
+        self.started = started
+
+    @property
+    def state(self):
+        if self.error is not None or self.code not in (0, None):
+            return "failed"
+        return "ok" if self.code == 0 else "skipped"
+
+
+def run_task(func, name, handler, logger):
+    handler.begin(name)
+    start = time.monotonic()
+    try:
+        return Result(name, func(name), time.monotonic() - start)
+    except Exception as e:
+        logger.error(str(e))
+        return Result(name, 1, time.monotonic() - start, error=e)
+    finally:
+        handler.end()
+
+
+def run_concurrently(func, names, jobs, logger):
+    handler = ThreadBufferHandler(logger.handlers)
+    saved_handlers = logger.handlers
+    logger.handlers = [handler]
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as pool:
+            return list(
+                pool.map(lambda name: run_task(func, name, handler, logger), names)
+            )
+    finally:
+        logger.handlers = saved_handlers
+
+
+def run_graph(func, names, after, requires, jobs, logger, stagger=0.0):
+    # Every name is started as soon as everything it comes after has finished,
+    # so independent branches of the graph run side by side. A name whose
+    # required dependency failed is not run and fails too. Launches are
+    # spaced at least `stagger` seconds apart
+    handler = ThreadBufferHandler(logger.handlers)
+    saved_handlers = logger.handlers
+    logger.handlers = [handler]
+
+    waiting = dict()
+    dependents = {name: [] for name in names}
+    for name in names:
+        deps = set(after.get(name, ())) | set(requires.get(name, ()))
+        waiting[name] = {dep for dep in deps if dep in dependents and dep != name}
+        for dep in waiting[name]:
+            dependents[dep].append(name)
+
+    boot_start = time.monotonic()
+    gate = dict(next=boot_start)
+    gate_lock = threading.Lock()
+
+    def task(name):
+        with gate_lock:
+            slot = max(gate["next"], time.monotonic())
+            gate["next"] = slot + stagger
+        time.sleep(max(0.0, slot - time.monotonic()))
+        started = time.monotonic() - boot_start
+        result = run_task(func, name, handler, logger)
+        result.started = started
+        return result
+
+    results = dict()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as pool:
+            futures = {
+                pool.submit(task, name): name for name in names if not waiting[name]
+            }
+            while futures:
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                finished = []
+                for future in done:
+                    del futures[future]
+                    finished.append(future.result())
+                while finished:
+                    result = finished.pop()
+                    results[result.name] = result
+                    for name in dependents[result.name]:
+                        waiting[name].discard(result.name)
+                        if waiting[name] or name in results:
+                            continue
+                        failed = [
+                            dep
+                            for dep in requires.get(name, ())
+                            if dep in results and results[dep].state == "failed"
+                        ]
+                        if failed:
+                            error = f"required service {failed[0]} failed"
+                            logger.error(f"{name}: not started, {error}")
+                            finished.append(Result(name, 1, error=error))
+                        else:
+                            futures[pool.submit(task, name)] = name
+    finally:
+        logger.handlers = saved_handlers
+
+    for name in names:
+        if name not in results:
+            logger.error(f"{name}: not started, dependency cycle")
+            results[name] = Result(name, 1, error="dependency cycle")
+    return [results[name] for name in names]
+
+
+def in_order(results, skipped, names):
+    results = {result.name: result for result in results}
+    for name in skipped:
+        results[name] = Result(name, None)
+    return [results[name] for name in names if name in results]
@@ -0,0 +1,128 @@
+import http.server
+import threading
+import registry
+import socket
+import json
+import time
+
+
+CONTENT_TYPES = dict(
+    openmetrics="application/openmetrics-text; version=1.0.0; charset=utf-8",
+    prometheus="text/plain; version=0.0.4; charset=utf-8",
+)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(families, openmetrics=True):
+    # families are (name, type, help, samples) with samples being
+    # (labels, value) pairs. OpenMetrics names a counter family without
+    # the _total suffix of its samples, the Prometheus text format with it
+    lines = []
+    for name, kind, help_text, samples in families:
+        family = name
+        if openmetrics and kind == "counter" and name.endswith("_total"):
+            family = name[: -len("_total")]
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(
+                f'{key}="{escape(label)}"' for key, label in labels.items()
+            )
+            lines.append(f"{name}{{{label_text}}} {value}")
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, text):
+    # the textfile collector may read the file at any time, so it is
+    # replaced in one rename
+    registry.atomic_write(path, text)
+
+
+def load_state(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def save_state(path, state):
+    registry.atomic_write_json(path, state)
+
+
+class Collector:
+    # scrapes that arrive within `interval` of each other share one
+    # collection and so one status snapshot
+    def __init__(self, collect, interval):
+        self.collect = collect
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.families = None
+        self.time = 0.0
+
+    def get(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.families is None or now - self.time >= self.interval:
+                self.families = self.collect()
+                self.time = now
+            return self.families
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        try:
+            body = render(self.server.collector.get(), openmetrics).encode()
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            CONTENT_TYPES["openmetrics" if openmetrics else "prometheus"],
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer6(MetricsServer):
+    address_family = socket.AF_INET6
+
+
+def create_server(collector, host, port):
+    server_class = MetricsServer6 if ":" in host else MetricsServer
+    server = server_class((host, port), MetricsHandler)
+    server.collector = collector
+    return server
+
+
+def parse_address(value):
+    # [HOST:]PORT, an IPv6 host is written in brackets as in [::1]:9100
+    host, _, port = value.rpartition(":")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    elif ":" in host:
+        raise ValueError(f"Invalid address {value}, write IPv6 hosts as [HOST]:PORT")
+    return host or "127.0.0.1", int(port)
+
+
+def format_url(host, port):
+    host = f"[{host}]" if ":" in host else host
+    return f"http://{host}:{port}/metrics"
@@ -1,6 +1,10 @@
 import zono.colorlogger as cl
 import main as lib
+import argparse
+import backends
+import plistlib
 import json
+import sys
 import os
 
 
@@ -11,7 +15,51 @@ def get_file(filename):
 logger = cl.create_logger("installer", 10)
 
 
-def main():
+def agent_config(label, program_arguments, **options):
+    workdir = os.path.dirname(os.path.abspath(__file__))
+    return plistlib.dumps(
+        dict(
+            Label=label,
+            ProgramArguments=program_arguments,
+            RunAtLoad=True,
+            WorkingDirectory=workdir,
+            StandardOutPath=os.path.join(workdir, ".output", label.split(".")[-1]),
+            StandardErrorPath=os.path.join(workdir, ".output", label.split(".")[-1]),
+            **options,
+        )
+    )
+
+
+def install_agent(label, config):
+    path = os.path.expanduser(f"~/Library/LaunchAgents/{label}.plist")
+    with open(path, "wb") as f:
+        f.write(config)
+    logger.debug(f"Added {label} to ~/Library/LaunchAgents")
+
+
+def install_daemon():
+    install_agent(
+        "com.kareem.services.daemon",
+        agent_config(
+            "com.kareem.services.daemon",
+            [sys.executable, get_file("daemon.py")],
+            KeepAlive=True,
+        ),
+    )
+
+
+def install_supervisor():
+    install_agent(
+        "com.kareem.services.supervise",
+        agent_config(
+            "com.kareem.services.supervise",
+            [sys.executable, get_file("main.py"), "supervise"],
+            KeepAlive=True,
+        ),
+    )
+
+
+def main(daemon=False, supervise=False):
     logger.important_log("Installing service because this is the first run")
     outfile = "com.kareem.services.startup.plist"
 
@@ -22,6 +70,13 @@ def main():
     os.system(f'chmod +x {get_file("service_launcher.py")}')
     if not os.path.exists(get_file(".services")):
         os.mkdir(get_file(".services"))
+    os.makedirs(get_file(".output"), exist_ok=True)
+
+    if not isinstance(lib.get_backend(), backends.LaunchdBackend):
+        # there are no launch agents without launchd, so startup.py and the
+        # daemon have to be started by the init system instead
+        logger.important_log("Installed successfully")
+        return
 
     config = lib.create_service_config("startup.py", "startup", "com.kareem.services")
     logger.debug("Created startup service file")
@@ -33,8 +88,34 @@ def main():
     ) as f:
         f.write(config)
     logger.debug("Added startup service file to ~/Library/LaunchAgents")
+
+    install_agent(
+        "com.kareem.services.rotate",
+        agent_config(
+            "com.kareem.services.rotate",
+            [sys.executable, get_file("main.py"), "rotate", "all"],
+            StartInterval=lib.get_setting("log_rotate_interval"),
+        ),
+    )
+    if daemon:
+        install_daemon()
+    if supervise:
+        install_supervisor()
     logger.important_log("Installed successfully")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Installs the service manager")
+    parser.add_argument(
+        "--daemon",
+        help="Also install the resident service daemon as a launch agent",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--supervise",
+        help="Also install a launch agent that applies restart policies, this is "
+        "not needed when the daemon is installed",
+        action="store_true",
+    )
+    opts = parser.parse_args()
+    main(opts.daemon, opts.supervise)
@@ -0,0 +1,126 @@
+# Per service launchd keys, set in the registry as a "launch" entry, for
+# example "launch": {"process_type": "Background", "nice": 10,
+# "soft_limits": {"open_files": 1024, "resident_set": "512M"}}
+KEYS = dict(
+    process_type="ProcessType",
+    low_priority_io="LowPriorityIO",
+    nice="Nice",
+    throttle_interval="ThrottleInterval",
+    soft_limits="SoftResourceLimits",
+    hard_limits="HardResourceLimits",
+)
+PROCESS_TYPES = ("Background", "Standard", "Adaptive", "Interactive")
+LIMITS = dict(
+    cpu="CPU",
+    core="Core",
+    data="Data",
+    file_size="FileSize",
+    memory_lock="MemoryLock",
+    open_files="NumberOfFiles",
+    processes="NumberOfProcesses",
+    resident_set="ResidentSetSize",
+    stack="Stack",
+)
+# limits in bytes, which also accept sizes like "512M"
+SIZE_LIMITS = ("core", "data", "file_size", "memory_lock", "resident_set", "stack")
+UNITS = dict(K=1024, M=1024**2, G=1024**3, T=1024**4)
+
+
+def parse_size(value):
+    if isinstance(value, str):
+        text = value.strip().upper().removesuffix("B")
+        if text and text[-1] in UNITS:
+            return int(float(text[:-1]) * UNITS[text[-1]])
+        return int(text)
+    return value
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_limits(name, limits):
+    if not isinstance(limits, dict):
+        raise ValueError(f"{name} has to be a mapping of limits")
+    validated = dict()
+    for limit, value in limits.items():
+        if limit not in LIMITS:
+            raise ValueError(
+                f"Unknown resource limit {limit}, expected one of {', '.join(LIMITS)}"
+            )
+        try:
+            value = parse_size(value) if limit in SIZE_LIMITS else value
+        except ValueError:
+            raise ValueError(f"Invalid size {value} for {limit}") from None
+        if not is_int(value) or value < 0:
+            raise ValueError(f"{limit} has to be a positive integer")
+        validated[limit] = value
+    return validated
+
+
+def validate(options):
+    # sizes like "512M" come back in bytes, a soft limit above its hard limit
+    # is an error too
+    if not isinstance(options, dict):
+        raise ValueError("launch options have to be a mapping")
+    validated = dict()
+    for name, value in options.items():
+        if name not in KEYS:
+            raise ValueError(
+                f"Unknown launch option {name}, expected one of {', '.join(KEYS)}"
+            )
+        if name == "process_type" and value not in PROCESS_TYPES:
+            raise ValueError(
+                f"Invalid process_type {value}, expected one of "
+                f"{', '.join(PROCESS_TYPES)}"
+            )
+        elif name == "low_priority_io" and not isinstance(value, bool):
+            raise ValueError("low_priority_io has to be true or false")
+        elif name == "nice" and (not is_int(value) or not -20 <= value <= 20):
+            raise ValueError("nice has to be an integer from -20 to 20")
+        elif name == "throttle_interval" and (not is_int(value) or value < 0):
+            raise ValueError("throttle_interval has to be a positive integer")
+        elif name in ("soft_limits", "hard_limits"):
+            value = validate_limits(name, value)
+        validated[name] = value
+
+    soft = validated.get("soft_limits", dict())
+    hard = validated.get("hard_limits", dict())
+    for limit in set(soft) & set(hard):
+        if soft[limit] > hard[limit]:
+            raise ValueError(f"The soft {limit} limit is above the hard limit")
+    return validated
+
+
+def plist_keys(options):
+    keys = dict()
+    for name, value in options.items():
+        if name in ("soft_limits", "hard_limits"):
+            value = {LIMITS[limit]: amount for limit, amount in value.items()}
+        keys[KEYS[name]] = value
+    return keys
+
+
+def apply(data, options):
+    # sets the keys of `options` in the plist `data` and removes the keys of
+    # options that are not set, returns whether the plist changed
+    keys = plist_keys(options)
+    changed = False
+    for key in KEYS.values():
+        if key in keys and data.get(key) != keys[key]:
+            data[key] = keys[key]
+            changed = True
+        elif key not in keys and key in data:
+            del data[key]
+            changed = True
+    return changed
+
+
+def describe(options):
+    rows = []
+    for name, value in options.items():
+        if isinstance(value, dict):
+            rows += [(f"{name}.{limit}", amount) for limit, amount in value.items()]
+        else:
+            rows.append((name, value))
+    return rows
@@ -0,0 +1,402 @@
+import collections
+import ctypes.util
+import itertools
+import ctypes
+import select
+import shutil
+import gzip
+import json
+import time
+import sys
+import io
+import os
+import re
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_LINES = 10
+POLL_INTERVAL = 0.5
+# event based watchers still wake up this often to re-check the file in
+# case an event was missed
+IDLE_TIMEOUT = 5.0
+
+# rotated segments are named <log>.<YYYYmmdd-HHMMSS>[-n][.gz|.zst]
+ARCHIVE_PATTERN = r"\.(?P<stamp>\d{8}-\d{6})(-(?P<count>\d+))?(\.gz|\.zst)?$"
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+
+class PollWatcher:
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.interval = interval
+
+    def watch(self, f):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    # watches the directory rather than the file so that a rotated or
+    # recreated log file is noticed as well as writes to the current one
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = (
+            IN_MODIFY
+            | IN_ATTRIB
+            | IN_CLOSE_WRITE
+            | IN_MOVED_FROM
+            | IN_MOVED_TO
+            | IN_CREATE
+            | IN_DELETE
+        )
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def watch(self, f):
+        pass
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class KqueueWatcher:
+    def __init__(self, path):
+        self.kq = select.kqueue()
+        self.dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        self.changes = []
+
+    def event(self, fd, flags):
+        return select.kevent(
+            fd,
+            filter=select.KQ_FILTER_VNODE,
+            flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+            fflags=flags,
+        )
+
+    def watch(self, f):
+        self.kq.close()
+        self.kq = select.kqueue()
+        self.changes = [
+            self.event(
+                f.fileno(),
+                select.KQ_NOTE_WRITE
+                | select.KQ_NOTE_EXTEND
+                | select.KQ_NOTE_ATTRIB
+                | select.KQ_NOTE_DELETE
+                | select.KQ_NOTE_RENAME,
+            ),
+            self.event(self.dir_fd, select.KQ_NOTE_WRITE),
+        ]
+
+    def wait(self, timeout):
+        self.kq.control(self.changes, 4, timeout)
+        self.changes = []
+
+    def close(self):
+        self.kq.close()
+        os.close(self.dir_fd)
+
+
+def create_watcher(path):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError):
+            pass
+    if hasattr(select, "kqueue"):
+        try:
+            return KqueueWatcher(path)
+        except OSError:
+            pass
+    return PollWatcher(path)
+
+
+def tail_offset(f, lines, size=None):
+    if size is None:
+        size = os.fstat(f.fileno()).st_size
+    if lines <= 0 or size == 0:
+        return size
+
+    f.seek(size - 1)
+    pos = size - 1 if f.read(1) == b"\n" else size
+    count = 0
+    while pos > 0:
+        step = min(CHUNK_SIZE, pos)
+        pos -= step
+        f.seek(pos)
+        block = f.read(step)
+        index = len(block)
+        while True:
+            index = block.rfind(b"\n", 0, index)
+            if index == -1:
+                break
+            count += 1
+            if count == lines:
+                return pos + index + 1
+    return 0
+
+
+def head_offset(f, lines):
+    f.seek(0)
+    pos = 0
+    count = 0
+    while count < lines:
+        block = f.read(CHUNK_SIZE)
+        if not block:
+            break
+        index = -1
+        while count < lines:
+            index = block.find(b"\n", index + 1)
+            if index == -1:
+                break
+            count += 1
+        pos += len(block) if index == -1 else index + 1
+    return pos
+
+
+def start_offset(f, lines=None, since_bytes=None):
+    size = os.fstat(f.fileno()).st_size
+    if since_bytes is not None:
+        return max(0, size - since_bytes)
+    if lines is None:
+        return size
+    return tail_offset(f, lines, size)
+
+
+def copy_range(f, out, start=0, end=None):
+    if end is None:
+        end = os.fstat(f.fileno()).st_size
+    pos = start
+    out.flush()
+    try:
+        out_fd = out.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        out_fd = None
+
+    if out_fd is not None and hasattr(os, "sendfile"):
+        try:
+            while pos < end:
+                sent = os.sendfile(out_fd, f.fileno(), pos, end - pos)
+                if sent == 0:
+                    break
+                pos += sent
+            return
+        except BrokenPipeError:
+            raise
+        except OSError:
+            # sendfile only writes to sockets on macOS
+            pass
+
+    f.seek(pos)
+    while pos < end:
+        chunk = f.read(min(CHUNK_SIZE, end - pos))
+        if not chunk:
+            break
+        out.write(chunk)
+        pos += len(chunk)
+    out.flush()
+
+
+def iter_lines(f, start=0, end=None):
+    f.seek(start)
+    pos = start
+    for line in f:
+        if end is not None and pos >= end:
+            break
+        pos += len(line)
+        yield line
+
+
+def write_ndjson(lines, out, batch=4096):
+    records = []
+    for line in lines:
+        records.append(json.dumps(line.rstrip(b"\n").decode("utf-8", errors="replace")))
+        if len(records) >= batch:
+            out.write(("\n".join(records) + "\n").encode())
+            records = []
+    if records:
+        out.write(("\n".join(records) + "\n").encode())
+    out.flush()
+
+
+def list_archives(path):
+    directory, name = os.path.split(path)
+    pattern = re.compile(re.escape(name) + ARCHIVE_PATTERN)
+    try:
+        entries = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    # oldest first, by time and then by the number of archives that were
+    # rotated within the same second
+    archives = []
+    for entry in entries:
+        match = pattern.match(entry)
+        if match:
+            archives.append((match["stamp"], int(match["count"] or 0), entry))
+    return [os.path.join(directory, entry) for _, _, entry in sorted(archives)]
+
+
+def open_log(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    elif path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        )
+    return open(path, "rb")
+
+
+def iter_archive_lines(archives):
+    for archive in archives:
+        with open_log(archive) as f:
+            yield from f
+
+
+def tail_archives(archives, lines):
+    # archives are compressed so they can only be read front to back, at
+    # most `lines` lines are kept in memory while doing so
+    tail = collections.deque()
+    for archive in reversed(archives):
+        if lines <= 0:
+            break
+        with open_log(archive) as f:
+            segment = collections.deque(f, maxlen=lines)
+        lines -= len(segment)
+        tail.extendleft(reversed(segment))
+    return tail
+
+
+def count_lines(f, end):
+    f.seek(0)
+    count = 0
+    pos = 0
+    last = b"\n"
+    while pos < end:
+        block = f.read(min(CHUNK_SIZE, end - pos))
+        if not block:
+            break
+        count += block.count(b"\n")
+        pos += len(block)
+        last = block[-1:]
+    return count if last == b"\n" else count + 1
+
+
+def write_log(path, out, head=None, tail=None, as_json=False, archives=()):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if head is not None and not archives:
+            end = head_offset(f, head)
+            if as_json:
+                return write_ndjson(iter_lines(f, 0, end), out)
+            return copy_range(f, out, 0, end)
+        elif head is not None:
+            lines = itertools.islice(
+                itertools.chain(iter_archive_lines(archives), iter_lines(f, 0, size)),
+                head,
+            )
+            if as_json:
+                return write_ndjson(lines, out)
+            out.writelines(lines)
+            return out.flush()
+
+        prefix = archives
+        start = 0
+        if tail is not None:
+            start = tail_offset(f, tail, size)
+            prefix = []
+            if start == 0 and archives:
+                prefix = tail_archives(archives, tail - count_lines(f, size))
+
+        if as_json:
+            if tail is None:
+                prefix = iter_archive_lines(prefix)
+            lines = itertools.chain(prefix, iter_lines(f, start, size))
+            return write_ndjson(lines, out)
+
+        if tail is None:
+            for archive in prefix:
+                with open_log(archive) as segment:
+                    shutil.copyfileobj(segment, out, CHUNK_SIZE)
+        else:
+            out.writelines(prefix)
+        copy_range(f, out, start, size)
+
+
+def copy_available(f, out):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        out.write(chunk)
+    out.flush()
+
+
+def follow(path, lines=DEFAULT_LINES, since_bytes=None, out=None, logger=None):
+    out = out or sys.stdout.buffer
+    watcher = create_watcher(path)
+    f = open(path, "rb")
+    try:
+        f.seek(start_offset(f, lines, since_bytes))
+        watcher.watch(f)
+        while True:
+            copy_available(f, out)
+
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(f.fileno())
+            if current is not None and (current.st_ino, current.st_dev) != (
+                opened.st_ino,
+                opened.st_dev,
+            ):
+                copy_available(f, out)
+                if logger is not None:
+                    logger.info("Log file was replaced, following the new file")
+                f.close()
+                f = open(path, "rb")
+                watcher.watch(f)
+                continue
+            if opened.st_size < f.tell():
+                if logger is not None:
+                    logger.info("Log file was truncated")
+                f.seek(0)
+                continue
+
+            watcher.wait(IDLE_TIMEOUT)
+    finally:
+        f.close()
+        watcher.close()
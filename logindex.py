@@ -0,0 +1,194 @@
+import datetime
+import registry
+import logfile
+import hashlib
+import bisect
+import json
+import time
+import re
+import os
+
+
+INDEX_VERSION = 1
+# one index entry is kept per this many bytes of log
+INDEX_STRIDE = 64 * 1024
+SIGNATURE_SIZE = 256
+# timestamps are only looked for this far into a line
+TIMESTAMP_SEARCH = 64
+TIMESTAMP = re.compile(
+    rb"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})"
+    rb"(?:[.,](\d{1,6})\d*)?\s?(Z|[+-]\d{2}:?\d{2})?"
+)
+RELATIVE_TIME = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+UNITS = dict(s=1, m=60, h=3600, d=86400, w=604800)
+
+
+def line_timestamp(line):
+    match = TIMESTAMP.search(line, 0, TIMESTAMP_SEARCH)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    try:
+        moment = datetime.datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            int(fraction.ljust(6, b"0")) if fraction else 0,
+        )
+    except ValueError:
+        return None
+    if zone is not None:
+        if zone == b"Z":
+            offset = datetime.timedelta(0)
+        else:
+            sign = -1 if zone[:1] == b"-" else 1
+            digits = zone[1:].replace(b":", b"")
+            offset = sign * datetime.timedelta(
+                hours=int(digits[:2]), minutes=int(digits[2:])
+            )
+        moment = moment.replace(tzinfo=datetime.timezone(offset))
+    return moment.timestamp()
+
+
+def parse_time(value, now=None):
+    match = RELATIVE_TIME.match(value)
+    if match is not None:
+        return (now or time.time()) - float(match.group(1)) * UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def file_signature(f, size):
+    f.seek(0)
+    return hashlib.sha1(f.read(size)).hexdigest()
+
+
+class LogIndex:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.reset()
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self.__dict__.update(data["index"])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+    def reset(self):
+        self.ino = None
+        self.signature = None
+        self.signature_size = 0
+        self.end = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.entries = []
+
+    def save(self):
+        data = dict(
+            version=INDEX_VERSION,
+            index=dict(
+                ino=self.ino,
+                signature=self.signature,
+                signature_size=self.signature_size,
+                end=self.end,
+                first_ts=self.first_ts,
+                last_ts=self.last_ts,
+                entries=self.entries,
+            ),
+        )
+        try:
+            registry.atomic_write(self.index_path, json.dumps(data))
+        except OSError:
+            pass
+
+    def update(self):
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            # a log that was truncated and has grown past the indexed size
+            # again is caught by its first bytes changing
+            if (
+                st.st_size < self.end
+                or st.st_ino != self.ino
+                or file_signature(f, self.signature_size) != self.signature
+            ):
+                self.reset()
+
+            if st.st_size == self.end:
+                return
+            self.ino = st.st_ino
+            self.scan(f, st.st_size)
+            self.signature_size = min(self.end, SIGNATURE_SIZE)
+            self.signature = file_signature(f, self.signature_size)
+        self.save()
+
+    def scan(self, f, stop):
+        pos = self.end
+        next_mark = self.entries[-1][0] + INDEX_STRIDE if self.entries else pos
+        for line in logfile.iter_lines(f, pos, stop):
+            # a partial last line is indexed once it has been completed
+            if not line.endswith(b"\n"):
+                break
+            if pos >= next_mark:
+                self.entries.append([pos, self.last_ts])
+                next_mark = pos + INDEX_STRIDE
+            ts = line_timestamp(line)
+            if ts is not None:
+                self.last_ts = ts
+                if self.first_ts is None:
+                    self.first_ts = ts
+            pos += len(line)
+        self.end = pos
+
+    def window(self, since=None, until=None):
+        # entries record the timestamp in effect at their offset, so every
+        # line between two entries is at least as new as the first of them
+        keys = [float("-inf") if ts is None else ts for _, ts in self.entries]
+        start, start_ts, end = 0, None, None
+        if since is not None:
+            i = bisect.bisect_left(keys, since) - 1
+            if i >= 0:
+                start, start_ts = self.entries[i]
+        if until is not None:
+            j = bisect.bisect_right(keys, until)
+            if j < len(self.entries):
+                end = self.entries[j][0]
+        return start, start_ts, end
+
+
+def filter_lines(lines, pattern=None, since=None, until=None, current_ts=None):
+    for line in lines:
+        ts = line_timestamp(line)
+        if ts is not None:
+            current_ts = ts
+        if since is not None and (current_ts is None or current_ts < since):
+            continue
+        if until is not None and (current_ts is None or current_ts > until):
+            continue
+        if pattern is not None and pattern.search(line) is None:
+            continue
+        yield line
+
+
+def search(path, pattern=None, since=None, until=None, archives=()):
+    index = LogIndex(path)
+    index.update()
+
+    before_current = index.first_ts is None or since is None or since < index.first_ts
+    if archives and before_current:
+        yield from filter_lines(
+            logfile.iter_archive_lines(archives), pattern, since, until
+        )
+
+    start, start_ts, end = index.window(since, until)
+    with open(path, "rb") as f:
+        yield from filter_lines(
+            logfile.iter_lines(f, start, end), pattern, since, until, start_ts
+        )
@@ -0,0 +1,98 @@
+import logfile
+import time
+import gzip
+import os
+
+
+COMPRESSIONS = ("gzip", "zstd", "none")
+SUFFIXES = dict(gzip=".gz", zstd=".zst", none="")
+
+
+def state_path(path):
+    # the mtime of this file records when the log was last rotated
+    return f"{path}.rotated"
+
+
+def last_rotation(path):
+    try:
+        return os.stat(state_path(path)).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def mark_rotated(path):
+    with open(state_path(path), "w"):
+        pass
+
+
+def should_rotate(path, max_bytes=None, max_age=None, now=None):
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return False
+    if size == 0:
+        return False
+    if max_bytes and size >= max_bytes:
+        return True
+    if max_age:
+        last = last_rotation(path)
+        if last is None:
+            # the age of a log that was never rotated starts at its first check
+            mark_rotated(path)
+            return False
+        return (now or time.time()) - last >= max_age
+    return False
+
+
+def open_archive(path, compress):
+    if compress == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    elif compress == "zstd":
+        return logfile.zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+    return open(path, "wb")
+
+
+def archive_path(path, compress, now=None):
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now or time.time()))
+    suffix = SUFFIXES[compress]
+    archive = f"{path}.{stamp}{suffix}"
+    count = 1
+    while os.path.exists(archive):
+        archive = f"{path}.{stamp}-{count}{suffix}"
+        count += 1
+    return archive
+
+
+def rotate(path, compress="gzip", keep=5):
+    # copy-truncate: the service keeps its file descriptor, so the log is
+    # copied into the archive and then truncated in place. Whatever was
+    # appended while copying is drained right before truncating to keep
+    # the window where writes can be lost as small as possible. An empty log
+    # is not rotated and None is returned
+    try:
+        if os.path.getsize(path) == 0:
+            return None
+    except FileNotFoundError:
+        return None
+    if compress == "zstd" and logfile.zstandard is None:
+        compress = "gzip"
+    archive = archive_path(path, compress)
+    tmp = f"{archive}.tmp"
+    with open(path, "rb") as src, open_archive(tmp, compress) as dst:
+        while True:
+            chunk = src.read(logfile.CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+        os.truncate(path, 0)
+    os.replace(tmp, archive)
+
+    mark_rotated(path)
+    prune(path, keep)
+    return archive
+
+
+def prune(path, keep):
+    archives = logfile.list_archives(path)
+    for archive in archives[: max(0, len(archives) - keep)]:
+        os.remove(archive)
@@ -1,15 +1,15 @@
 #!/usr/bin/env python3
 import zono.colorlogger
-import zono.settings
+import service_index
 import parser_util
-import subprocess
+import threading
 import argparse
-import plistlib
-import colorama
-import tabulate
+import registry
+import tracing
 import logging
-import shutil
+import atexit
 import json
+import time
 import sys
 import os
 
@@ -21,30 +21,142 @@ def get_file(filename):
     return os.path.join(os.path.dirname(__file__), filename)
 
 
-settings = zono.settings.Settings(
-    get_file("settings.json"), {"domain": (str, None, "com.kareem.services")}
+SETTINGS = {
+    "domain": (str, None, "com.kareem.services"),
+    "registry": (str, None, "json"),
+    "boot_jobs": (int, None, 8),
+    "boot_stagger": (float, None, 0.1),
+    "log_max_bytes": (int, None, 50 * 1024 * 1024),
+    "log_max_age": (int, None, 0),
+    "log_keep": (int, None, 5),
+    "log_compress": (str, None, "gzip"),
+    "log_rotate_interval": (int, None, 3600),
+    "restart_policy": (str, None, "never"),
+    "restart_backoff": (float, None, 1.0),
+    "restart_max_backoff": (float, None, 300.0),
+    "restart_jitter": (float, None, 0.2),
+    "restart_max_failures": (int, None, 5),
+    "restart_window": (float, None, 600.0),
+    "restart_max_rate": (int, None, 6),
+    "restart_check_interval": (float, None, 5.0),
+    "export_interval": (float, None, 15.0),
+    "backend": (str, None, "auto"),
+    "stop_grace_period": (float, None, 10.0),
+}
+_settings = dict(data=None)
+
+
+def get_setting(key):
+    if _settings["data"] is None:
+        import zono.settings
+
+        _settings["data"] = zono.settings.Settings(get_file("settings.json"), SETTINGS)
+    return _settings["data"].get_value(key)
+
+
+SNAPSHOT_TTL = 2.0
+DEFAULT_JOBS = 8
+# cpu usage for `status --metrics` and `info --metrics` is measured over
+# this many seconds
+METRICS_INTERVAL = 0.5
+WATCH_INTERVAL = 2.0
+# how long `stop --wait` waits for a killed service to go away
+KILL_TIMEOUT = 5.0
+METRIC_HEADERS = ["CPU%", "RSS", "Threads", "FDs", "Procs", "Uptime"]
+TOP_SORT_KEYS = ["cpu", "rss", "threads", "fds", "uptime", "name"]
+STATUS_NAMES = {True: "running", False: "stopped", None: "missing"}
+STATUS_FILTERS = dict(
+    status=[*STATUS_NAMES.values(), "idle"], startup=["true", "false"], name=None
 )
+STATUS_FIELDS = [
+    "name",
+    "status",
+    "pid",
+    "return_code",
+    "job_label",
+    "domain",
+    "service_target",
+    "config_file",
+    "output_file",
+    "startup",
+    "mainfile",
+    "on_demand",
+    "metrics",
+]
+# fields that need the plist and log path of the service
+METADATA_FIELDS = {"job_label", "service_target", "config_file", "output_file"}
+RESTART_POLICIES = ["never", "on-failure", "always"]
+RESTART_STATE = ".services/restart_state.json"
+IDLE_STATE = ".services/idle_state.json"
+WATCHDOG_STATE = ".services/watchdog_state.json"
+WATCHDOG_AUDIT = ".services/watchdog.log"
+# audit records `service info` shows per service
+WATCHDOG_AUDIT_ENTRIES = 10
+# cpu seconds an on-demand service may use between two checks and still count
+# as idle
+IDLE_CPU_SECONDS = 0.05
+EXPORTER_STATE = ".services/exporter_state.json"
+_snapshot = dict(data=None, time=0.0)
+_snapshot_lock = threading.Lock()
+
+
+def get_status_snapshot(max_age=SNAPSHOT_TTL):
+    import backends
+
+    with _snapshot_lock:
+        now = time.monotonic()
+        if _snapshot["data"] is not None and now - _snapshot["time"] < max_age:
+            return _snapshot["data"]
+        try:
+            data = get_backend().snapshot()
+        except backends.BackendError as e:
+            logger.error(f"Error getting the service status: {e}")
+            data = dict()
+
+        _snapshot["data"] = data
+        _snapshot["time"] = now
+        return data
+
+
+def invalidate_snapshot():
+    _snapshot["data"] = None
+
+
+def get_service_entry(job_label, snapshot=None):
+    if snapshot is None:
+        snapshot = get_status_snapshot()
+    return snapshot.get(job_label, None)
+
+
+_backend = dict(data=None)
+
+
+def get_backend():
+    if _backend["data"] is None:
+        import backends
+
+        _backend["data"] = backends.open_backend(
+            get_setting("backend"), get_domain(), get_file(".services/native"), logger
+        )
+    return _backend["data"]
 
 
-def get_service_line(job_label):
-    try:
-        launchctl_output = subprocess.check_output(["launchctl", "list"], text=True)
+_registry = dict(data=None)
 
-        lines = launchctl_output.strip().split("\n")
-        for line in lines:
-            if job_label in line:
-                return line
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error running launchctl list: {e}")
-        return None
+def get_registry():
+    if _registry["data"] is None:
+        _registry["data"] = registry.open_registry(
+            get_setting("registry"),
+            get_file("services.json"),
+            get_file("services.db"),
+        )
+    return _registry["data"]
 
 
 def get_service(opts, parser):
-    with open(get_file("services.json"), "r") as f:
-        services = json.load(f)
-
-    service = services.get(opts.service, None)
+    services = get_registry()
+    service = services.get(opts.service)
     if service is None:
         return parser.error(f"Service {opts.service} does not exist")
 
@@ -65,41 +177,75 @@ def get_plist_data(plist_path):
         "WorkingDirectory",
     ]
 
-    with open(plist_path, "rb") as plist_file:
-        plist_data = plistlib.load(plist_file)
+    import plistlib
+
+    with tracing.span("plist read", path=plist_path):
+        with open(plist_path, "rb") as plist_file:
+            plist_data = plistlib.load(plist_file)
+
+    for key in required_keys:
+        if key not in plist_data:
+            return [key]
 
-        for key in required_keys:
-            if key not in plist_data:
-                return [key]
+    return plist_data
 
-        return plist_data
+
+_index = dict(data=None)
+
+
+def get_index():
+    if _index["data"] is None:
+        _index["data"] = service_index.ServiceIndex(get_file(".services/index"))
+        atexit.register(_index["data"].save)
+    return _index["data"]
+
+
+def get_service_metadata(service_name, mainfile=None):
+    return get_index().lookup(
+        service_name,
+        get_file(os.path.join(".services", f"{service_name}.plist")),
+        get_setting("domain"),
+        get_domain(),
+        mainfile,
+    )
 
 
 def get_service_target(service):
-    return f"{get_domain()}/{get_job_label(service)}"
+    return get_service_metadata(service)["target"]
 
 
 def get_job_label(service_name):
-    file = get_file(os.path.join(".services", f"{service_name}.plist"))
-    if not os.path.exists(file):
-        return f'{settings.get_value("domain")}.{service_name}'
-    with open(file, "rb") as f:
-        return plistlib.load(f).get("Label", None)
+    return get_service_metadata(service_name)["label"]
 
 
-def service_status(service):
-    job_label = get_job_label(service)
-    status = get_service_line(job_label)
-    if status is None:
+def service_status(service, snapshot=None):
+    entry = get_service_entry(get_job_label(service), snapshot)
+    if entry is None:
         return None, None, None
-    pid, retcode, name = status.split("\t")
-    if pid == "-":
-        return False, None, int(retcode)
+    pid, retcode = entry
+    if pid is None:
+        return False, None, retcode
+
+    return True, pid, retcode
+
+
+def is_on_demand(service_info):
+    import on_demand
+
+    options = service_info.get("on_demand")
+    return isinstance(options, dict) and on_demand.enabled(options)
+
+
+def status_name(stat, service_info):
+    # a stopped on-demand service is idle, it starts when it is needed
+    if stat is False and is_on_demand(service_info):
+        return "idle"
+    return STATUS_NAMES[stat]
 
-    return True, int(pid), int(retcode)
 
+def str_stat(status, idle=False):
+    import colorama
 
-def str_stat(status):
     status = list(status)
     status[1] = str(status[1])
     status[2] = str(status[2])
@@ -112,6 +258,13 @@ def str_stat(status):
             status[2],
         )
 
+    elif status[0] is False and idle:
+        return (
+            f"{colorama.Fore.YELLOW}Idle (on-demand){colorama.Fore.RESET}",
+            status[1],
+            status[2],
+        )
+
     elif status[0] is False:
         return (
             f"{colorama.Fore.RED}Stopped{colorama.Fore.RESET}",
@@ -123,28 +276,129 @@ def str_stat(status):
         raise Exception("Invalid service status")
 
 
-def create_service_config(entry_point, service_name, domain):
-    with open(get_file("services.plist"), "r") as f:
-        return (
-            f.read()
-            .replace("{SERVICE_NAME}", service_name)
-            .replace("{PATH_TO_PROGRAM}", entry_point)
-            .replace("{WORKING_DIR}", os.path.dirname(entry_point))
-            .replace("{DOMAIN}", domain)
-            .replace("{LAUNCHER_PATH}", get_file("service_launcher.py"))
+_template = dict(data=None, key=None)
+
+
+def get_plist_template():
+    # services.plist is parsed once and kept until it changes on disk
+    st = os.stat(get_file("services.plist"))
+    key = (st.st_mtime_ns, st.st_size)
+    if _template["key"] != key:
+        import plistlib
+
+        with open(get_file("services.plist"), "rb") as f:
+            _template["data"] = plistlib.load(f)
+        _template["key"] = key
+    return _template["data"]
+
+
+def fill_template(value, fields):
+    if isinstance(value, str):
+        import re
+
+        return re.sub(
+            r"\{([A-Z_]+)\}", lambda m: fields.get(m.group(1), m.group(0)), value
         )
+    elif isinstance(value, dict):
+        return {key: fill_template(item, fields) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [fill_template(item, fields) for item in value]
+    return value
+
+
+def create_service_config(
+    entry_point, service_name, domain, launch=None, activation=None
+):
+    import plistlib
+
+    fields = dict(
+        SERVICE_NAME=service_name,
+        PATH_TO_PROGRAM=entry_point,
+        WORKING_DIR=os.path.dirname(entry_point),
+        DOMAIN=domain,
+        LAUNCHER_PATH=get_file("service_launcher.py"),
+    )
+    data = fill_template(get_plist_template(), fields)
+    if launch:
+        import launch_options
+
+        launch_options.apply(data, launch)
+    if activation is not None:
+        import on_demand
+
+        on_demand.apply(data, activation)
+    # plistlib escapes the values, so paths containing & or < stay valid
+    return plistlib.dumps(data).decode()
+
+
+def get_launch_options(service_info):
+    # None leaves the launch keys of a hand written plist alone
+    if "launch" not in service_info:
+        return None
+    import launch_options
+
+    return launch_options.validate(service_info["launch"])
+
+
+def get_on_demand(service_info):
+    # an empty entry is not None, it turns the service back into one that
+    # runs at load
+    if "on_demand" not in service_info:
+        return None
+    import on_demand
+
+    return on_demand.validate(service_info["on_demand"])
+
+
+def sync_plist(service, launch=None, activation=None):
+    # writes the launch and on-demand options into the plist of the service,
+    # options that are None are left as they are, returns whether it changed
+    import launch_options
+    import on_demand
+    import plistlib
+
+    config_path = get_file(f".services/{service}.plist")
+    try:
+        with tracing.span("plist read", path=config_path):
+            with open(config_path, "rb") as f:
+                data = plistlib.load(f)
+    except FileNotFoundError:
+        return False
+    changed = False
+    if launch is not None:
+        changed = launch_options.apply(data, launch)
+    if activation is not None:
+        changed = on_demand.apply(data, activation) or changed
+    if not changed:
+        return False
+    with tracing.span("plist write", path=config_path):
+        registry.atomic_write(config_path, plistlib.dumps(data))
+    return True
+
+
+def reload_service(service):
+    # launchd only reads a plist when it is loaded, so a changed plist is
+    # applied by unloading and loading that one service
+    config_path = get_file(f".services/{service}.plist")
+    backend = get_backend()
+    code = backend.unload(get_job_label(service), config_path)
+    invalidate_snapshot()
+    if code != 0:
+        logger.error("Failed to unload the service")
+        return 1
+    code = backend.load(get_job_label(service), config_path)
+    invalidate_snapshot()
+    if code != 0:
+        logger.error("Failed to load the service")
+        return 1
+    logger.info("Service reloaded successfully")
+    return 0
 
 
 def kickstart_service(service):
-    c = subprocess.run(
-        [
-            "launchctl",
-            "kickstart",
-            "-k",
-            get_service_target(service),
-        ]
-    )
-    if c.returncode == 0:
+    code = get_backend().start(get_job_label(service))
+    invalidate_snapshot()
+    if code == 0:
         logger.info("Service successfully started")
         return 0
     else:
@@ -153,18 +407,13 @@ def kickstart_service(service):
 
 
 def create_service(service, config):
-    logger.debug("Service not found registering with launchctl")
-    c = subprocess.run(["launchctl", "enable", get_service_target(service)])
-    if c.returncode != 0:
-        logger.error("Failed to launch service")
-        logger.debug("error while enabling the service")
-        return 1
-    logger.debug("Enabled the service")
-    c = subprocess.run(["launchctl", "bootstrap", get_domain(), config])
+    logger.debug("Service not found registering it")
+    code = get_backend().load(get_job_label(service), config)
+    invalidate_snapshot()
 
-    if c.returncode != 0:
+    if code != 0:
         logger.error("Failed to launch service")
-        logger.debug("error while enabling the service")
+        logger.debug("error while loading the service")
         return 1
     logger.debug("Added service")
     logger.info("Service started successfully")
@@ -172,8 +421,9 @@ def create_service(service, config):
 
 
 def kill_service(service):
-    c = subprocess.run(["launchctl", "kill", "9", get_service_target(service)])
-    if c.returncode != 0:
+    code = get_backend().kill(get_job_label(service))
+    invalidate_snapshot()
+    if code != 0:
         logger.error("An error occurred while stopping the service")
         return 1
     logger.info("Service stopped successfully")
@@ -181,37 +431,331 @@ def kill_service(service):
 
 
 def terminate_service(service):
-    c = subprocess.run(["launchctl", "stop", get_job_label(service)])
-    if c.returncode != 0:
+    code = get_backend().stop(get_job_label(service))
+    invalidate_snapshot()
+    if code != 0:
         logger.error("An error occurred while stopping the service")
         return 1
     logger.info("Service stopped successfully")
     return 0
 
 
-def stop_service(service, kill=False):
-    stat, *_ = service_status(service)
+def get_restart_policy(service_info):
+    policy = dict(
+        policy=get_setting("restart_policy"),
+        backoff=get_setting("restart_backoff"),
+        max_backoff=get_setting("restart_max_backoff"),
+        jitter=get_setting("restart_jitter"),
+        max_failures=get_setting("restart_max_failures"),
+        window=get_setting("restart_window"),
+        max_rate=get_setting("restart_max_rate"),
+    )
+    policy.update(service_info.get("restart", {}))
+    return policy
+
+
+def hold_restarts(service, held):
+    # a service that was stopped by hand is not restarted by its restart
+    # policy until it is started again, which also resets its backoff
+    service_info = get_registry().get(service)
+    if service_info is None or get_restart_policy(service_info)["policy"] == "never":
+        return
+    import supervisor
+
+    with supervisor.transaction(get_file(RESTART_STATE)) as states:
+        state = states.get(service, supervisor.new_state())
+        if not held:
+            state = supervisor.new_state()
+        state["held"] = held
+        states[service] = state
+
+
+def stop_idle_services(services):
+    # stops on-demand services whose process tree used next to no cpu for
+    # their idle timeout, they are started again when they are needed
+    import supervisor
+    import procstats
+
+    timeouts = dict()
+    for service, service_info in services.items():
+        try:
+            options = get_on_demand(service_info)
+        except ValueError:
+            # start reports invalid options
+            continue
+        if options and options.get("idle_timeout"):
+            timeouts[service] = options["idle_timeout"]
+    if not timeouts and not os.path.exists(get_file(IDLE_STATE)):
+        return 0
+
+    code = 0
+    with supervisor.transaction(get_file(IDLE_STATE)) as states:
+        for service in set(states) - set(timeouts):
+            del states[service]
+        if not timeouts:
+            return 0
+        snapshot = get_status_snapshot(0)
+        statuses = {service: service_status(service, snapshot) for service in timeouts}
+        totals = procstats.read_totals(
+            [pid for stat, pid, _ in statuses.values() if stat is True]
+        )
+        now = time.time()
+        for service, timeout in timeouts.items():
+            stat, pid, _ = statuses[service]
+            if stat is not True or pid not in totals:
+                states.pop(service, None)
+                continue
+            cpu = totals[pid]["cpu"]
+            state = states.get(service)
+            if (
+                state is None
+                or state["pid"] != pid
+                or cpu - state["cpu"] > IDLE_CPU_SECONDS
+            ):
+                states[service] = dict(pid=pid, cpu=cpu, active=now)
+            elif now - state["active"] >= timeout:
+                logger.info(f"Stopping {service}, it was idle for {timeout:g}s")
+                code = terminate_service(service) or code
+                del states[service]
+    return code
+
+
+def get_watchdog(service_info):
+    # returns the validated watchdog rules of a service, or None when it has
+    # none
+    if not service_info.get("watchdog"):
+        return None
+    import watchdog
+
+    return watchdog.validate(service_info["watchdog"])
+
+
+def enforce_watchdogs(services):
+    # samples every watched service in one read of the process table and
+    # acts on the ones that went over a limit
+    import supervisor
+    import procstats
+    import watchdog
+
+    rules = dict()
+    for service, service_info in services.items():
+        try:
+            options = get_watchdog(service_info)
+        except ValueError as e:
+            logger.error(f"Invalid watchdog for {service}: {e}")
+            continue
+        if options:
+            rules[service] = options
+    if not rules and not os.path.exists(get_file(WATCHDOG_STATE)):
+        return 0
+
+    code = 0
+    with supervisor.transaction(get_file(WATCHDOG_STATE)) as states:
+        for service in set(states) - set(rules):
+            del states[service]
+        if not rules:
+            return 0
+        snapshot = get_status_snapshot(0)
+        statuses = {service: service_status(service, snapshot) for service in rules}
+        totals = procstats.read_totals(
+            [pid for stat, pid, _ in statuses.values() if stat is True],
+            fds=any("max_open_files" in options for options in rules.values()),
+        )
+        now = time.time()
+        for service, options in rules.items():
+            _, pid, _ = statuses[service]
+            if pid not in totals:
+                states.pop(service, None)
+                continue
+            state = states.get(service)
+            if state is None or state["pid"] != pid:
+                state = states[service] = watchdog.new_state(pid)
+            for limit, value in watchdog.check(options, state, totals[pid], now):
+                action = options["action"]
+                logger.warning(
+                    f"{service} is over its {limit} of "
+                    f"{watchdog.format_value(limit, options[limit])} with "
+                    f"{watchdog.format_value(limit, value)}, action: {action}"
+                )
+                result = 0
+                if action == "restart":
+                    result = kickstart_service(service)
+                elif action == "stop":
+                    # like `service stop`, the restart policy leaves it stopped
+                    hold_restarts(service, True)
+                    result = terminate_service(service)
+                watchdog.audit(
+                    get_file(WATCHDOG_AUDIT),
+                    dict(
+                        time=round(now, 3),
+                        service=service,
+                        pid=pid,
+                        limit=limit,
+                        value=round(value, 1),
+                        max=options[limit],
+                        action=action,
+                        result="ok" if result == 0 else "failed",
+                    ),
+                )
+                code = result or code
+                if action != "warn":
+                    # the process that went over the limit is gone
+                    states.pop(service, None)
+                    break
+    return code
+
+
+def supervise_services():
+    import supervisor
+
+    # services started by this process are reaped here
+    get_backend().reap()
+    services = get_registry().all()
+    code = stop_idle_services(services)
+    code = enforce_watchdogs(services) or code
+    # on-demand services are started by launchd or their activator when they
+    # are needed, never by a restart policy
+    policies = {
+        service: get_restart_policy(service_info)
+        for service, service_info in services.items()
+        if not is_on_demand(service_info)
+    }
+    policies = {
+        service: policy
+        for service, policy in policies.items()
+        if policy["policy"] != "never"
+    }
+    if not policies:
+        return code
+
+    # the snapshot is taken and services are restarted while holding the
+    # state lock so that two supervisors never count the same exit twice
+    with supervisor.transaction(get_file(RESTART_STATE)) as states:
+        snapshot = get_status_snapshot(0)
+        now = time.time()
+        for service, policy in policies.items():
+            if policy["policy"] not in supervisor.POLICIES:
+                logger.error(f"Unknown restart policy {policy['policy']} for {service}")
+                code = 1
+                continue
+            state = states.setdefault(service, supervisor.new_state())
+            stat, _, retcode = service_status(service, snapshot)
+            action = supervisor.plan(policy, state, stat, retcode, now)
+            if action == "park":
+                logger.error(
+                    f"{service} failed {len(state['failures'])} times within "
+                    f"{policy['window']:g}s, it will not be restarted until it "
+                    "is started again"
+                )
+            elif action == "restart":
+                logger.info(f"Restarting {service} (attempt {state['attempts']})")
+                code = kickstart_service(service) or code
+    return code
+
+
+def wait_for_services(services, condition, timeout=None):
+    # returns the services that were not `condition` before the timeout
+    import waiter
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = waiter.POLL_MIN
+    initial = None
+    exits = waiter.ExitWaiter()
+    try:
+        while True:
+            snapshot = get_status_snapshot(0)
+            statuses = {
+                service: service_status(service, snapshot) for service in services
+            }
+            if initial is None:
+                initial = {service: pid for service, (_, pid, _) in statuses.items()}
+            pending = [
+                service
+                for service in services
+                if not waiter.reached(
+                    condition, statuses[service], initial[service], exits.exited
+                )
+            ]
+            if not pending:
+                return []
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return pending
+
+            # waiting for processes to exit blocks on kernel events, anything
+            # else is polled with a growing interval
+            pids = [
+                initial[service] if condition == "exited" else statuses[service][1]
+                for service in pending
+            ]
+            if condition != "running" and all([exits.add(pid) for pid in pids]):
+                exits.wait(remaining)
+            else:
+                exits.wait(interval if remaining is None else min(interval, remaining))
+                interval = min(interval * 2, waiter.POLL_MAX)
+    finally:
+        exits.close()
+
+
+def stop_service(service, kill=False, snapshot=None, grace=None):
+    hold_restarts(service, True)
+    stat, *_ = service_status(service, snapshot)
     if stat is not True:
         logger.error(f"Service {service} is already stopped")
         return 1
     if kill:
-        return kill_service(service)
+        code = kill_service(service)
     else:
-        return terminate_service(service)
+        code = terminate_service(service)
+    if code != 0 or grace is None:
+        return code
+
+    # with a grace period, wait for the service to exit and kill it when it
+    # does not exit in time
+    if not wait_for_services([service], "stopped", grace):
+        return 0
+    if not kill:
+        logger.info(f"Service {service} did not stop within {grace:g}s, killing it")
+        code = kill_service(service)
+        if code != 0:
+            return code
+        if not wait_for_services([service], "stopped", KILL_TIMEOUT):
+            return 0
+    logger.error(f"Service {service} is still running after being killed")
+    return 1
 
 
-def start_service(service, opts):
+def start_service(service, opts, snapshot=None):
+    hold_restarts(service["name"], False)
+    try:
+        launch = get_launch_options(service)
+    except ValueError as e:
+        logger.error(f"Invalid launch options: {e}")
+        return 1
+    try:
+        activation = get_on_demand(service)
+    except ValueError as e:
+        logger.error(f"Invalid on-demand options: {e}")
+        return 1
     config_path = get_file(f'.services/{service["name"]}.plist')
     if not os.path.exists(config_path):
         logger.debug("Service config file not found creating a new one")
-        with open(config_path, "w") as f:
+        with tracing.span("plist write", path=config_path), open(config_path, "w") as f:
             f.write(
                 create_service_config(
-                    service["mainfile"], service["name"], settings.get_value("domain")
+                    service["mainfile"],
+                    service["name"],
+                    get_setting("domain"),
+                    launch,
+                    activation,
                 )
             )
 
-    status = service_status(service["name"])[0]
+    status = service_status(service["name"], snapshot)[0]
+    if status is None:
+        # the plist is read when the service is loaded, so this is the time
+        # to bring it in line with the registry
+        sync_plist(service["name"], launch, activation)
     if status is True:
         if opts.force:
             logger.info("Restarting the service")
@@ -234,59 +778,148 @@ def remove_service(service):
         return 1
 
     config = get_file(f".services/{service}.plist")
-    c = subprocess.run(["launchctl", "disable", get_service_target(service)])
-    if c.returncode != 0:
-        logger.info("error while disabling the service")
-    else:
-        logger.debug("Disabled the service")
-    c = subprocess.run(["launchctl", "bootout", get_domain(), config])
+    code = get_backend().unload(get_job_label(service), config)
+    invalidate_snapshot()
 
-    if c.returncode != 0:
+    if code != 0:
         logger.info("Failed to remove the service")
-        logger.debug("error while booting out the service")
+        logger.debug("error while unloading the service")
         return 1
 
     logger.info("Service removed successfully")
     return 0
 
 
-def get_service_info(service, service_info):
-    outpath = os.path.join(os.path.dirname(service_info["mainfile"]), ".output/stdout")
-    outpath = outpath if os.path.exists(outpath) else None
-    config_file = (
-        get_file(f".services/{service}.plist")
-        if os.path.exists(get_file(f".services/{service}.plist"))
-        else None
-    )
-
-    stat, pid, retcode = service_status(service)
-    return dict(
+def get_service_info(service, service_info, snapshot=None, fields=None):
+    stat, pid, retcode = service_status(service, snapshot)
+    info = dict(
         status=stat,
         pid=pid,
         return_code=retcode,
-        job_label=get_job_label(service),
+        job_label=None,
         domain=get_domain(),
-        service_target=get_service_target(service),
-        config_file=config_file,
-        output_file=outpath,
+        service_target=None,
+        config_file=None,
+        output_file=None,
         startup=service_info.get("startup", False),
         mainfile=service_info.get("mainfile"),
+        on_demand=service_info.get("on_demand") or None,
     )
+    # the metadata lookup is skipped when none of its fields are wanted
+    if fields is None or not METADATA_FIELDS.isdisjoint(fields):
+        metadata = get_service_metadata(service, service_info["mainfile"])
+        outpath = metadata["output_file"]
+        info.update(
+            job_label=metadata["label"],
+            service_target=metadata["target"],
+            config_file=metadata["config_file"],
+            output_file=outpath if os.path.exists(outpath) else None,
+        )
+    return info
 
 
-def start(opts, parser):
-    with open(get_file("services.json"), "r") as f:
-        services = json.load(f)
+def get_metrics(statuses, interval=METRICS_INTERVAL):
+    import procstats
 
+    pids = [pid for _, pid, _ in statuses.values() if pid is not None]
+    sampled = procstats.sample(pids, interval)
+    return {
+        service: sampled.get(pid) if pid is not None else None
+        for service, (_, pid, _) in statuses.items()
+    }
+
+
+def get_restart_info(service, service_info):
+    import supervisor
+
+    policy = get_restart_policy(service_info)
+    states = supervisor.load_states(get_file(RESTART_STATE))
+    state = states.get(service, supervisor.new_state())
+    now = time.time()
+    next_restart = state["next_restart"]
+    failures = [
+        failure for failure in state["failures"] if now - failure < policy["window"]
+    ]
+    return dict(
+        restart_policy=policy["policy"],
+        restart_attempts=state["attempts"],
+        restarts_total=state.get("restarts_total", 0),
+        recent_failures=len(failures),
+        next_restart_in=None if next_restart is None else round(next_restart - now, 1),
+        parked=state["parked"],
+        held=state["held"],
+    )
+
+
+def get_watchdog_info(service, service_info):
+    import watchdog
+
+    try:
+        rules = get_watchdog(service_info) or dict()
+    except ValueError as e:
+        rules = f"Invalid: {e}"
+    return dict(
+        watchdog=rules,
+        watchdog_audit=watchdog.read_audit(
+            get_file(WATCHDOG_AUDIT), service, WATCHDOG_AUDIT_ENTRIES
+        ),
+    )
+
+
+def print_results(results):
+    import colorama
+    import tabulate
+
+    colors = dict(
+        ok=colorama.Fore.GREEN, failed=colorama.Fore.RED, skipped=colorama.Fore.YELLOW
+    )
+    data = [
+        [
+            result.name,
+            f"{colors[result.state]}{result.state.capitalize()}{colorama.Fore.RESET}",
+            str(result.code),
+            f"{result.duration:.2f}s",
+        ]
+        for result in results
+    ]
+    with tracing.span("render table"):
+        print(
+            tabulate.tabulate(
+                data,
+                headers=["Name", "Result", "Return Code", "Time"],
+                tablefmt="simple_grid",
+            )
+        )
+    return 1 if any(result.state == "failed" for result in results) else 0
+
+
+def start(opts, parser):
     if opts.service == "all":
-        for service, info in services.items():
+        import executor
+
+        snapshot = get_status_snapshot()
+        services = get_registry().all()
+        skipped = []
+        if not opts.force:
+            skipped = [
+                service
+                for service in services
+                if service_status(service, snapshot)[0] is True
+            ]
+
+        def start_one(service):
+            info = services[service]
             info["name"] = service
-            start_service(info, opts)
+            return start_service(info, opts, snapshot)
 
-        return 0
-    service = services.get(opts.service, None)
-    if service is None:
-        return parser.error(f"Service {opts.service} does not exist")
+        results = executor.run_concurrently(
+            start_one,
+            [service for service in services if service not in skipped],
+            opts.jobs,
+            logger,
+        )
+        return print_results(executor.in_order(results, skipped, services))
+    service, _ = get_service(opts, parser)
     service["name"] = opts.service
     code = start_service(service, opts)
     if code != 0:
@@ -297,29 +930,336 @@ def start(opts, parser):
         if os.path.exists(outpath) is not True:
             logger.error("Output file for the service does not exist")
             return 1
-        os.system(f"tail -f {outpath}")
+        return follow_logs(outpath)
+
+
+def join_choices(choices):
+    # "a, b or c"
+    return " or ".join(filter(None, [", ".join(choices[:-1]), choices[-1]]))
+
+
+def parse_status_filters(opts, parser):
+    filters = []
+    for item in opts.filter:
+        key, sep, value = item.partition("=")
+        if not sep or key not in STATUS_FILTERS:
+            return parser.error(
+                f"Invalid filter {item}, expected one of "
+                f"{', '.join(f'{key}=' for key in STATUS_FILTERS)}"
+            )
+        values = [value for value in value.replace(",", "|").split("|") if value]
+        choices = STATUS_FILTERS[key]
+        for value in values:
+            if choices is not None and value not in choices:
+                return parser.error(
+                    f"Invalid value {value} for {key}, expected one of "
+                    f"{', '.join(choices)}"
+                )
+        filters.append((key, values))
+    if opts.services:
+        filters.append(("name", opts.services))
+    return filters
+
+
+def split_filters(filters):
+    # name and startup filters only need the registry, so they run before the
+    # job label of a service is looked up in its plist, status filters after
+    return (
+        [item for item in filters if item[0] != "status"],
+        [item for item in filters if item[0] == "status"],
+    )
+
+
+def service_matches(service, service_info, stat, filters):
+    import fnmatch
+
+    for key, values in filters:
+        if key == "status":
+            matched = status_name(stat, service_info) in values
+        elif key == "startup":
+            matched = str(bool(service_info.get("startup", False))).lower() in values
+        else:
+            matched = any(fnmatch.fnmatchcase(service, value) for value in values)
+        if not matched:
+            return False
+    return True
+
+
+def print_status_json(records):
+    # streams the same document json.dumps(..., indent=4) would produce
+    print("{", end="")
+    separator = "\n"
+    for service, record in records:
+        text = json.dumps(record, indent=4).replace("\n", "\n    ")
+        print(f"{separator}    {json.dumps(service)}: {text}", end="")
+        separator = ",\n"
+    print("\n}" if separator != "\n" else "}")
+
+
+def watch_status(opts, filters):
+    import colorama
+    import tabulate
+    import watcher
+
+    registry_filters, _ = split_filters(filters)
+    screen = watcher.Screen(sys.stdout) if sys.stdout.isatty() else None
+    previous = None
+    last_change = dict()
+    iteration = 0
+    try:
+        while True:
+            services = {
+                service: service_info
+                for service, service_info in get_registry().all().items()
+                if service_matches(service, service_info, None, registry_filters)
+            }
+            # one snapshot per refresh, however many services there are
+            snapshot = get_status_snapshot(0)
+            now = time.time()
+            current = {
+                service: service_status(service, snapshot) for service in services
+            }
+            events = [] if previous is None else watcher.diff(previous, current)
+            # a transition is shown when the service matches the filters
+            # before or after it
+            events = [
+                (service, event)
+                for service, event in events
+                if any(
+                    status is not None
+                    and service_matches(
+                        service, services.get(service, dict()), status[0], filters
+                    )
+                    for status in (previous.get(service), current.get(service))
+                )
+            ]
+            services = {
+                service: service_info
+                for service, service_info in services.items()
+                if service_matches(service, service_info, current[service][0], filters)
+            }
+
+            if opts.changes_only:
+                for service, event in events:
+                    record = watcher.event_record(
+                        service, event, previous.get(service), current.get(service), now
+                    )
+                    print(json.dumps(record), flush=True)
+            elif previous is None or events or screen is not None:
+                changed = {service for service, _ in events}
+                for service, event in events:
+                    last_change[service] = f"{event} {time.strftime('%H:%M:%S')}"
+                data = []
+                for service, service_info in services.items():
+                    name = service
+                    # services that changed since the last refresh stand out
+                    # until the next one
+                    if service in changed:
+                        name = f"{colorama.Style.BRIGHT}{name}{colorama.Style.NORMAL}"
+                    stat = str_stat(current[service], is_on_demand(service_info))
+                    data.append([name, *stat, last_change.get(service)])
+                with tracing.span("render table"):
+                    table = tabulate.tabulate(
+                        data,
+                        headers=["Name", "Status", "PID", "Return Code", "Last Change"],
+                        tablefmt="simple_grid",
+                    )
+                title = f"Every {opts.watch:g}s: service status"
+                lines = [f"{title}    {time.strftime('%Y-%m-%d %H:%M:%S')}", ""]
+                lines += table.split("\n")
+                if screen is not None:
+                    screen.draw(lines)
+                else:
+                    print("\n".join(lines), flush=True)
+
+            previous = current
+            iteration += 1
+            if opts.iterations and iteration >= opts.iterations:
+                return 0
+            time.sleep(opts.watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if screen is not None:
+            screen.close()
+    return 0
 
 
 def status(opts, parser):
-    with open(get_file("services.json"), "r") as f:
-        services = json.load(f)
+    filters = parse_status_filters(opts, parser)
+    fields = None
+    if opts.fields is not None:
+        fields = [field for field in opts.fields.split(",") if field]
+        for field in fields:
+            if field not in STATUS_FIELDS:
+                return parser.error(
+                    f"Unknown field {field}, expected one of {', '.join(STATUS_FIELDS)}"
+                )
+        if opts.format == "table":
+            return parser.error("--fields can only be used with json or ndjson")
+        opts.metrics = opts.metrics or "metrics" in fields
+
+    if opts.changes_only and opts.watch is None:
+        opts.watch = WATCH_INTERVAL
+    if opts.watch is not None:
+        if opts.watch <= 0:
+            return parser.error("The watch interval has to be positive")
+        if opts.format != "table":
+            return parser.error(
+                "--format can not be used with --watch, use --changes-only instead"
+            )
+        if opts.metrics:
+            return parser.error(
+                "--metrics can not be used with --watch, use service top instead"
+            )
+        return watch_status(opts, filters)
+
+    registry_filters, status_filters = split_filters(filters)
+    services = get_registry().all()
+    snapshot = get_status_snapshot()
+    statuses = dict()
+    for service, service_info in services.items():
+        if not service_matches(service, service_info, None, registry_filters):
+            continue
+        stat = service_status(service, snapshot)
+        if service_matches(service, service_info, stat[0], status_filters):
+            statuses[service] = stat
+    services = {service: services[service] for service in statuses}
+    metrics = get_metrics(statuses) if opts.metrics else dict()
 
     headers = ["Name", "Status", "PID", "Return Code"]
-    if opts.json is True:
-        services_status = dict()
-        for service, service_info in services.items():
-            services_status[service] = get_service_info(service, service_info)
-        print(json.dumps(services_status, indent=4))
+    if opts.format != "table":
+
+        def records():
+            for service, service_info in services.items():
+                info = get_service_info(service, service_info, snapshot, fields)
+                if opts.metrics:
+                    info["metrics"] = metrics[service]
+                if fields is not None:
+                    info = dict(name=service, **info)
+                    info = {field: info[field] for field in fields}
+                yield service, info
+
+        with tracing.span("render json"):
+            if opts.format == "ndjson":
+                # one line per service, written as soon as it is ready
+                for service, info in records():
+                    if fields is None:
+                        info = dict(name=service, **info)
+                    print(json.dumps(info), flush=True)
+            else:
+                print_status_json(records())
     else:
+        import tabulate
+
         data = [
-            [service, *str_stat(service_status(service))] for service in services.keys()
+            [service, *str_stat(statuses[service], is_on_demand(service_info))]
+            for service, service_info in services.items()
         ]
-        print(tabulate.tabulate(data, headers=headers, tablefmt="simple_grid"))
+        if opts.metrics:
+            import procstats
+
+            headers += METRIC_HEADERS
+            for row in data:
+                row += procstats.format_metrics(metrics[row[0]])
+        with tracing.span("render table"):
+            print(tabulate.tabulate(data, headers=headers, tablefmt="simple_grid"))
+    return 0
+
+
+def top_rows(services, metrics, statuses, sort):
+    rows = [
+        dict(name=service, pid=statuses[service][1], metrics=metrics[service])
+        for service in services
+    ]
+    if sort == "name":
+        return sorted(rows, key=lambda row: row["name"])
+
+    field = "cpu_percent" if sort == "cpu" else sort
+
+    def key(row):
+        value = (row["metrics"] or dict()).get(field)
+        return (value is None, -(value or 0), row["name"])
+
+    return sorted(rows, key=key)
+
+
+def top(opts, parser):
+    import procstats
+    import tabulate
+
+    sampler = procstats.Sampler()
+    iteration = 0
+    try:
+        while True:
+            services = get_registry().all()
+            snapshot = get_status_snapshot(min(SNAPSHOT_TTL, opts.interval))
+            statuses = {
+                service: service_status(service, snapshot) for service in services
+            }
+            sampled = sampler.sample(
+                [pid for _, pid, _ in statuses.values() if pid is not None]
+            )
+            # cpu usage needs two samples, so the first one is not shown
+            if iteration > 0:
+                metrics = {
+                    service: sampled.get(pid) if pid is not None else None
+                    for service, (_, pid, _) in statuses.items()
+                }
+                rows = top_rows(services, metrics, statuses, opts.sort)
+                if opts.json:
+                    record = dict(
+                        time=time.time(),
+                        services={
+                            row["name"]: dict(pid=row["pid"], metrics=row["metrics"])
+                            for row in rows
+                        },
+                    )
+                    print(json.dumps(record), flush=True)
+                else:
+                    data = [
+                        [
+                            row["name"],
+                            str(row["pid"]),
+                            *procstats.format_metrics(row["metrics"]),
+                        ]
+                        for row in rows
+                    ]
+                    if sys.stdout.isatty():
+                        print("\033[H\033[J", end="")
+                    print(
+                        tabulate.tabulate(
+                            data,
+                            headers=["Name", "PID", *METRIC_HEADERS],
+                            tablefmt="simple_grid",
+                        ),
+                        flush=True,
+                    )
+                if opts.iterations and iteration >= opts.iterations:
+                    return 0
+            iteration += 1
+            time.sleep(opts.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def follow_logs(outpath, lines=None, since_bytes=None):
+    import logfile
+
+    if lines is None:
+        lines = logfile.DEFAULT_LINES
+    try:
+        logfile.follow(outpath, lines, since_bytes, logger=logger)
+    except KeyboardInterrupt:
+        pass
     return 0
 
 
 def logs(opts, parser):
     service, _ = get_service(opts, parser)
+    if opts.head is not None and opts.lines is not None:
+        return parser.error("--head and --tail can not be used together")
 
     outpath = os.path.join(os.path.dirname(service["mainfile"]), ".output/stdout")
     if os.path.exists(outpath) is not True:
@@ -327,8 +1267,7 @@ def logs(opts, parser):
         return 1
     if opts.watch is True:
         if service_status(opts.service)[0] is True:
-            os.system(f"tail -f {outpath}")
-            return 0
+            return follow_logs(outpath, opts.lines, opts.since_bytes)
         logger.info("Service is not running displaying previous logs")
     elif opts.file is True:
         print(outpath)
@@ -339,95 +1278,503 @@ def logs(opts, parser):
             f.write("")
         logger.info("Cleared log file successfully")
         return 0
-    with open(outpath, "r") as f:
-        if opts.json:
-            print(json.dumps(f.readlines(), indent=4))
-        else:
-            g = f.read()
-            if g:
-                print(g)
+
+    import logfile
+
+    if opts.grep is None and opts.since is None and opts.until is None:
+        logfile.write_log(
+            outpath,
+            sys.stdout.buffer,
+            head=opts.head,
+            tail=opts.lines,
+            as_json=opts.json,
+            archives=logfile.list_archives(outpath),
+        )
+        return 0
+
+    import collections
+    import itertools
+    import logindex
+    import re
+
+    try:
+        pattern = None if opts.grep is None else re.compile(opts.grep.encode())
+        since = None if opts.since is None else logindex.parse_time(opts.since)
+        until = None if opts.until is None else logindex.parse_time(opts.until)
+    except (re.error, ValueError) as e:
+        return parser.error(str(e))
+
+    lines = logindex.search(
+        outpath, pattern, since, until, logfile.list_archives(outpath)
+    )
+    if opts.head is not None:
+        lines = itertools.islice(lines, opts.head)
+    elif opts.lines is not None:
+        lines = collections.deque(lines, maxlen=opts.lines)
+    if opts.json:
+        logfile.write_ndjson(lines, sys.stdout.buffer)
+    else:
+        sys.stdout.buffer.writelines(lines)
     return 0
 
 
-def stop(opts, parser):
-    with open(get_file("services.json"), "r") as f:
-        services = json.load(f)
+def get_rotate_policy(service_info):
+    policy = dict(
+        max_bytes=get_setting("log_max_bytes"),
+        max_age=get_setting("log_max_age"),
+        keep=get_setting("log_keep"),
+        compress=get_setting("log_compress"),
+    )
+    policy.update(service_info.get("log_rotate", {}))
+    return policy
+
+
+def rotate_service_log(service, service_info, force=False):
+    import logrotate
 
+    outpath = get_service_metadata(service, service_info["mainfile"])["output_file"]
+    policy = get_rotate_policy(service_info)
+    if policy["compress"] not in logrotate.COMPRESSIONS:
+        logger.error(f"Unknown log compression {policy['compress']} for {service}")
+        return 1
+    if not force and not logrotate.should_rotate(
+        outpath, policy["max_bytes"], policy["max_age"]
+    ):
+        logger.debug(f"Log for {service} does not need to be rotated")
+        return 0
+
+    archive = logrotate.rotate(outpath, policy["compress"], policy["keep"])
+    if archive is None:
+        logger.debug(f"Log for {service} is empty")
+        return 0
+    logger.info(f"Rotated log for {service} into {archive}")
+    return 0
+
+
+def rotate(opts, parser):
+    if opts.service == "all":
+        services = get_registry().all()
+    else:
+        service, _ = get_service(opts, parser)
+        services = {opts.service: service}
+
+    code = 0
+    for service, service_info in services.items():
+        code = rotate_service_log(service, service_info, opts.force) or code
+    return code
+
+
+def stop(opts, parser):
+    grace = None
+    if opts.wait:
+        if opts.remove:
+            return parser.error("--wait can not be used with --remove")
+        grace = opts.grace
+        if grace is None:
+            grace = get_setting("stop_grace_period")
     if opts.service == "all":
+        import executor
+
+        snapshot = get_status_snapshot()
+        services = get_registry().all()
+        running = []
+        skipped = []
         for service in services:
-            stop_service(service, kill=opts.kill)
-        return 0
-    service = services.get(opts.service, None)
-    if service is None:
-        return parser.error(f"Service {opts.service} does not exist")
+            if service_status(service, snapshot)[0] is True:
+                running.append(service)
+            else:
+                skipped.append(service)
+
+        results = executor.run_concurrently(
+            lambda service: stop_service(service, opts.kill, snapshot, grace),
+            running,
+            opts.jobs,
+            logger,
+        )
+        return print_results(executor.in_order(results, skipped, services))
+    get_service(opts, parser)
     if opts.remove:
         return remove_service(
             opts.service,
         )
-    return stop_service(opts.service, kill=opts.kill)
+    return stop_service(opts.service, kill=opts.kill, grace=grace)
+
+
+def wait(opts, parser):
+    import waiter
+
+    services = get_registry().all()
+    names = list(services) if opts.services == ["all"] else opts.services
+    for name in names:
+        if name not in services:
+            return parser.error(f"Service {name} does not exist")
+    if opts.timeout is not None and opts.timeout < 0:
+        return parser.error("The timeout can not be negative")
+    if not waiter.ExitWaiter().supported():
+        logger.debug("No process events on this platform, polling the status")
+
+    pending = wait_for_services(names, opts.until, opts.timeout)
+    if pending:
+        logger.error(
+            f"Timed out after {opts.timeout:g}s waiting for {', '.join(pending)} "
+            f"to be {opts.until}"
+        )
+        return 1
+    return 0
 
 
 def unload(opts, parser):
     _, services = get_service(opts, parser)
 
     remove_service(opts.service)
-    services.pop(opts.service)
-    with open(get_file("services.json"), "w") as f:
-        json.dump(services, f, indent=4)
+    services.delete(opts.service)
 
     os.remove(get_file(f".services/{opts.service}.plist"))
+    get_index().discard(opts.service)
+    if os.path.exists(get_file(RESTART_STATE)):
+        import supervisor
+
+        with supervisor.transaction(get_file(RESTART_STATE)) as states:
+            states.pop(opts.service, None)
+
+
+def configure(opts, parser):
+    import launch_options
+    import on_demand
+
+    get_service(opts, parser)
+    with get_registry().transaction() as services:
+        service_info = services[opts.service]
+        options = dict() if opts.reset else dict(service_info.get("launch", dict()))
+        activation = dict()
+        if not opts.reset and "on_demand" not in opts.unset:
+            activation = dict(service_info.get("on_demand", dict()))
+        for name in opts.unset:
+            options.pop(name, None)
+            activation.pop(name, None)
+        try:
+            options = get_launch_args(opts, options)
+            launch_options.validate(options)
+            activation = on_demand.validate(get_on_demand_args(opts, activation))
+        except ValueError as e:
+            return parser.error(str(e))
+        # an entry that was never set leaves the keys of the plist alone
+        if options or opts.reset or "launch" in service_info:
+            service_info["launch"] = options
+        if activation or opts.reset or "on_demand" in {*opts.unset, *service_info}:
+            service_info["on_demand"] = activation
+        launch = get_launch_options(service_info)
+        activation = get_on_demand(service_info)
+
+    if not os.path.exists(get_file(f".services/{opts.service}.plist")):
+        logger.info("The options are applied when the service starts")
+        return 0
+    if not sync_plist(opts.service, launch, activation):
+        logger.info("The plist of the service is already up to date")
+        return 0
+    if service_status(opts.service, get_status_snapshot(0))[0] is None:
+        logger.info("Updated the plist, it is used when the service starts")
+        return 0
+    # only this service is reloaded, the others keep running untouched
+    return reload_service(opts.service)
 
 
 def info(opts, parser):
     service, _ = get_service(opts, parser)
 
     service_info = get_service_info(opts.service, service)
+    service_info.update(get_restart_info(opts.service, service))
+    try:
+        service_info["launch"] = get_launch_options(service) or dict()
+    except ValueError as e:
+        service_info["launch"] = f"Invalid: {e}"
+    try:
+        service_info["on_demand"] = get_on_demand(service) or dict()
+    except ValueError as e:
+        service_info["on_demand"] = f"Invalid: {e}"
+    service_info.update(get_watchdog_info(opts.service, service))
+    if opts.metrics:
+        service_info["metrics"] = get_metrics(
+            {
+                opts.service: (
+                    service_info["status"],
+                    service_info["pid"],
+                    service_info["return_code"],
+                )
+            }
+        )[opts.service]
     if opts.json:
-        print(json.dumps(service_info, indent=4))
+        with tracing.span("render json"):
+            print(json.dumps(service_info, indent=4))
         return 0
 
     stat, pid, retcode = str_stat(
-        (service_info["status"], service_info["pid"], service_info["return_code"])
+        (service_info["status"], service_info["pid"], service_info["return_code"]),
+        is_on_demand(service),
     )
     service_info["status"] = stat
     service_info["pid"] = pid
     service_info["return_code"] = retcode
     service_info["config_file"] = service_info["config_file"] or "None"
     service_info["output_file"] = service_info["output_file"] or "None"
+    metrics = service_info.pop("metrics", False)
+    launch = service_info.pop("launch")
+    activation = service_info.pop("on_demand")
+    rules = service_info.pop("watchdog")
+    audit = service_info.pop("watchdog_audit")
     table_data = [[key, value] for key, value in service_info.items()]
+    if isinstance(launch, dict):
+        import launch_options
 
-    print(
-        tabulate.tabulate(table_data, headers=["Key", "Value"], tablefmt="simple_grid")
-    )
+        table_data += [
+            [f"launch.{key}", value] for key, value in launch_options.describe(launch)
+        ]
+    else:
+        table_data.append(["launch", launch])
+    if isinstance(activation, dict):
+        import on_demand
+
+        table_data += [
+            [f"on_demand.{key}", value]
+            for key, value in on_demand.describe(activation)
+        ]
+    else:
+        table_data.append(["on_demand", activation])
+    if isinstance(rules, dict):
+        import watchdog
+
+        table_data += [
+            [f"watchdog.{key}", value] for key, value in watchdog.describe(rules)
+        ]
+        table_data += [
+            ["watchdog_audit", watchdog.describe_record(record)] for record in audit
+        ]
+    else:
+        table_data.append(["watchdog", rules])
+    if metrics is not False:
+        import procstats
+
+        table_data += [
+            [key, value]
+            for key, value in zip(procstats.FIELDS, procstats.format_metrics(metrics))
+        ]
+
+    import tabulate
+
+    with tracing.span("render table"):
+        print(
+            tabulate.tabulate(
+                table_data, headers=["Key", "Value"], tablefmt="simple_grid"
+            )
+        )
+
+
+def expand_targets(target):
+    # a directory, glob or json manifest stands for many files, returns the
+    # entries to process or None when `target` is a single file
+    import glob
+
+    if os.path.isdir(target):
+        paths = sorted(glob.glob(os.path.join(target, "*.plist")))
+        paths += sorted(glob.glob(os.path.join(target, "*", "main.py")))
+        return [dict(path=path) for path in paths]
+    elif os.path.isfile(target) and target.endswith(".json"):
+        with open(target, "r") as f:
+            manifest = json.load(f)
+        base = os.path.dirname(os.path.abspath(target))
+        if isinstance(manifest, list):
+            return [manifest_entry(item, base) for item in manifest]
+        elif isinstance(manifest, dict):
+            return [manifest_entry(item, base, name) for name, item in manifest.items()]
+        return [dict(path=target, error="A manifest has to be a list or a mapping")]
+    elif not os.path.exists(target) and any(char in target for char in "*?["):
+        return [dict(path=path) for path in sorted(glob.glob(target))]
+    return None
+
+
+def manifest_entry(item, base, name=None):
+    # an item is a file or an object with a file (or path) and its options,
+    # a broken item gets an error instead of failing the whole manifest
+    entry = dict(item) if isinstance(item, dict) else dict(path=item)
+    if name is not None:
+        entry["name"] = name
+    path = entry.pop("file", entry.get("path"))
+    if not isinstance(path, str) or not path:
+        entry["path"] = json.dumps(item)
+        entry["error"] = "A manifest entry needs a file"
+        return entry
+    entry["path"] = os.path.join(base, path)
+    return entry
+
+
+def default_service_name(path):
+    # apps/<name>/main.py is named after its directory, other scripts after
+    # the file
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem == "main":
+        return os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return stem
+
+
+def print_batch_results(results):
+    import colorama
+    import tabulate
+
+    data = [
+        [
+            name,
+            path,
+            f"{colorama.Fore.GREEN}Ok{colorama.Fore.RESET}"
+            if error is None
+            else f"{colorama.Fore.RED}Failed{colorama.Fore.RESET}",
+            error or "",
+        ]
+        for name, path, error in results
+    ]
+    with tracing.span("render table"):
+        print(
+            tabulate.tabulate(
+                data,
+                headers=["Name", "File", "Result", "Error"],
+                tablefmt="simple_grid",
+            )
+        )
+    return 1 if any(error is not None for _, _, error in results) else 0
+
+
+def get_launch_args(opts, options=None):
+    # merges the launch option flags in to `options`, a limit without a
+    # value removes it
+    options = dict(options or dict())
+    for name in ("process_type", "low_priority_io", "nice", "throttle_interval"):
+        if getattr(opts, name) is not None:
+            options[name] = getattr(opts, name)
+    limit_args = dict(soft_limits=opts.soft_limit, hard_limits=opts.hard_limit)
+    for name, items in limit_args.items():
+        if not items:
+            continue
+        limits = dict(options.get(name, dict()))
+        for item in items:
+            limit, sep, value = item.partition("=")
+            if not sep:
+                raise ValueError(f"Invalid limit {item}, expected NAME=VALUE")
+            if value:
+                limits[limit] = int(value) if value.isdigit() else value
+            else:
+                limits.pop(limit, None)
+        options[name] = limits
+        if not limits:
+            del options[name]
+    return options
+
+
+def get_on_demand_args(opts, options=None):
+    # merges the on-demand flags in to `options`, each trigger flag replaces
+    # the triggers of its kind
+    options = dict(options or dict())
+    if opts.socket:
+        options["sockets"] = list(opts.socket)
+    if opts.watch_path:
+        options["watch_paths"] = [os.path.abspath(path) for path in opts.watch_path]
+    if opts.queue_directory:
+        options["queue_directories"] = [
+            os.path.abspath(path) for path in opts.queue_directory
+        ]
+    if opts.path_state:
+        path_state = dict()
+        for item in opts.path_state:
+            path, sep, value = item.rpartition("=")
+            if not sep or value not in ("true", "false"):
+                raise ValueError(f"Invalid path state {item}, expected PATH=true|false")
+            path_state[os.path.abspath(path)] = value == "true"
+        options["path_state"] = path_state
+    idle_timeout = getattr(opts, "idle_timeout", None)
+    if idle_timeout is not None:
+        options["idle_timeout"] = idle_timeout
+        # a timeout of 0 keeps the service running once it started
+        if not idle_timeout:
+            del options["idle_timeout"]
+    return options
 
 
 def create_plist(opts, parser):
+    import launch_options
+    import on_demand
+
+    domain = opts.domain or get_setting("domain")
+    try:
+        launch = launch_options.validate(get_launch_args(opts))
+        activation = on_demand.validate(get_on_demand_args(opts)) or None
+    except ValueError as e:
+        return parser.error(str(e))
+    if opts.batch:
+        entries = expand_targets(opts.input_file)
+        if entries is None:
+            entries = [dict(path=opts.input_file)]
+        outdir = opts.output or os.getcwd()
+        os.makedirs(outdir, exist_ok=True)
+
+        results = []
+        for entry in entries:
+            if "error" in entry:
+                results.append([entry.get("name", ""), entry["path"], entry["error"]])
+                continue
+            path = os.path.abspath(entry["path"])
+            name = entry.get("name") or default_service_name(path)
+            if path.endswith(".plist"):
+                results.append([name, path, "Already a plist"])
+                continue
+            if not os.path.exists(path):
+                results.append([name, path, "File does not exist"])
+                continue
+            output = os.path.join(outdir, f"{name}.plist")
+            try:
+                # options in a manifest entry are overridden by flags
+                options = launch_options.validate(
+                    dict(entry.get("launch", dict()), **launch)
+                )
+                triggers = activation
+                if triggers is None and entry.get("on_demand") is not None:
+                    triggers = on_demand.validate(entry["on_demand"])
+                config = create_service_config(path, name, domain, options, triggers)
+                with tracing.span("plist write", path=output):
+                    with open(output, "w") as f:
+                        f.write(config)
+            except (ValueError, OSError) as e:
+                results.append([name, path, str(e)])
+                continue
+            results.append([name, path, None])
+        return print_batch_results(results)
+
+    if opts.service_name is None:
+        return parser.error("Missing name for the service")
     opts.input_file = os.path.abspath(opts.input_file)
     if not os.path.exists(opts.input_file):
         return parser.error(f"File {opts.input_file} does not exist")
 
-    config = create_service_config(opts.input_file, opts.service_name, opts.domain)
+    config = create_service_config(
+        opts.input_file, opts.service_name, domain, launch, activation
+    )
     if opts.output:
         with open(opts.output, "w") as f:
             f.write(config)
     else:
-        print(config)
+        print(config, end="")
 
     return 0
 
 
-def load(opts, parser):
-    opts.inputfile = opts.file
-    opts.file = os.path.abspath(opts.file)
-    if not os.path.exists(opts.file):
-        return parser.error(f"File {opts.inputfile} does not exist")
+def plan_load(path, name=None, restart=None, startup=False):
+    # works out the registry entry for one plist or script, returns the
+    # service name, its entry and the plist to copy into .services
+    if not os.path.exists(path):
+        raise ValueError(f"File {path} does not exist")
+    path = os.path.abspath(path)
 
-    if os.path.splitext(opts.file)[1] == ".plist":
-        data = get_plist_data(opts.file)
+    if os.path.splitext(path)[1] == ".plist":
+        data = get_plist_data(path)
         if isinstance(data, list):
-            return parser.error(
-                f"Invalid plist file missing required attribute {data[0]}"
-            )
+            raise ValueError(f"Invalid plist file missing required attribute {data[0]}")
 
         workdir = data["WorkingDirectory"]
         mainfile = os.path.join(workdir, data["Label"])
@@ -435,33 +1782,225 @@ def load(opts, parser):
         service_domain = data["Label"].split(".")
         service_name = service_domain.pop()
         service_domain = ".".join(service_domain)
-        if settings.get_value("domain") != service_domain:
+        if get_setting("domain") != service_domain:
             service_name = data["Label"]
+        name = name or service_name
+        plist = path
+    else:
+        if name is None:
+            raise ValueError("Missing name for the service specify name using -name")
+        mainfile = path
+        plist = None
+
+    service_info = dict(mainfile=mainfile, startup=startup)
+    if restart is not None:
+        if restart not in RESTART_POLICIES:
+            raise ValueError(
+                f"Invalid restart policy {restart}, expected one of "
+                f"{', '.join(RESTART_POLICIES)}"
+            )
+        service_info["restart"] = dict(policy=restart)
+    return name, service_info, plist
+
+
+def install_plist(path, service_name):
+    if os.path.dirname(path) == get_file(".services"):
+        return
+    import shutil
+
+    shutil.copy(path, os.path.join(get_file(".services"), f"{service_name}.plist"))
+
+
+def load_batch(entries, restart=None):
+    results = []
+    plists = []
+    # every service is added in a single registry transaction
+    with get_registry().transaction() as services:
+        for entry in entries:
+            if "error" in entry:
+                results.append([entry.get("name", ""), entry["path"], entry["error"]])
+                continue
+            path = os.path.abspath(entry["path"])
+            name = entry.get("name")
+            if name is None and not path.endswith(".plist"):
+                name = default_service_name(path)
+            try:
+                name, service_info, plist = plan_load(
+                    path,
+                    name,
+                    entry.get("restart", restart),
+                    entry.get("startup", False),
+                )
+                if name in services:
+                    raise ValueError("Service already exists")
+            except (ValueError, OSError) as e:
+                results.append([name or os.path.basename(path), path, str(e)])
+                continue
+            services[name] = service_info
+            if plist is not None:
+                plists.append((plist, name))
+            results.append([name, path, None])
+
+    for plist, name in plists:
+        install_plist(plist, name)
+    return print_batch_results(results)
+
+
+def load(opts, parser):
+    entries = expand_targets(opts.file)
+    if entries is not None:
+        if opts.name is not None:
+            return parser.error("-name can only be used when loading a single file")
+        return load_batch(entries, opts.restart)
 
-        service_name = opts.name or service_name
+    try:
+        name, service_info, plist = plan_load(opts.file, opts.name, opts.restart)
+    except ValueError as e:
+        return parser.error(str(e))
 
-        with open(get_file("services.json")) as f:
-            services = json.load(f)
-        if service_name in services:
+    with get_registry().transaction() as services:
+        if plist is not None and name in services:
             return parser.error("Service already exists")
-        services[service_name] = dict(mainfile=mainfile, startup=False)
-        with open(get_file("services.json"), "w") as f:
-            json.dump(services, f, indent=4)
-        if os.path.dirname(opts.file) != get_file(".services"):
-            shutil.copy(opts.file, get_file(".services"))
-            new_path = os.path.join(get_file(".services"), f"{service_name}.plist")
-            os.rename(
-                os.path.join(get_file(".services"), os.path.basename(opts.file)),
-                new_path,
+        services[name] = service_info
+    if plist is not None:
+        install_plist(plist, name)
+    return 0
+
+
+def supervise(opts, parser):
+    if opts.once:
+        return supervise_services()
+    interval = opts.interval or get_setting("restart_check_interval")
+    try:
+        while True:
+            supervise_services()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def collect_metrics(state):
+    import supervisor
+
+    services = get_registry().all()
+    snapshot = get_status_snapshot(0)
+    restart_states = supervisor.load_states(get_file(RESTART_STATE))
+    now = time.time()
+
+    up, pids, exit_codes, restarts, parked, changed, changes = ([] for _ in range(7))
+    for service in services:
+        stat, pid, retcode = service_status(service, snapshot)
+        labels = dict(service=service)
+        up.append((labels, 1 if stat is True else 0))
+        if pid is not None:
+            pids.append((labels, pid))
+        if retcode is not None:
+            exit_codes.append((labels, retcode))
+        restart_state = restart_states.get(service, supervisor.new_state())
+        restarts.append((labels, restart_state.get("restarts_total", 0)))
+        parked.append((labels, 1 if restart_state["parked"] else 0))
+
+        # a state change is anything that changes whether the service is
+        # loaded or running or which process it runs as
+        observed = [stat, pid]
+        previous = state.get(service)
+        if previous is None:
+            state[service] = dict(observed=observed, changed=now, changes=0)
+        elif previous["observed"] != observed:
+            state[service] = dict(
+                observed=observed, changed=now, changes=previous["changes"] + 1
             )
-    else:
-        if opts.name is None:
-            return parser.error("Missing name for the service specify name using -name")
-        with open(get_file("services.json")) as f:
-            services = json.load(f)
-        services[opts.name] = dict(mainfile=opts.file, startup=False)
-        with open(get_file("services.json"), "w") as f:
-            json.dump(services, f, indent=4)
+        changed.append((labels, round(state[service]["changed"], 3)))
+        changes.append((labels, state[service]["changes"]))
+    for service in set(state) - set(services):
+        del state[service]
+
+    return [
+        ("service_up", "gauge", "Whether the service is running", up),
+        ("service_pid", "gauge", "Process id of the running service", pids),
+        (
+            "service_last_exit_code",
+            "gauge",
+            "Exit status of the last run of the service",
+            exit_codes,
+        ),
+        (
+            "service_restarts_total",
+            "counter",
+            "Restarts made by the restart policy of the service",
+            restarts,
+        ),
+        (
+            "service_parked",
+            "gauge",
+            "Whether the restart policy gave up on the service",
+            parked,
+        ),
+        (
+            "service_state_changes_total",
+            "counter",
+            "Times the service was seen starting, stopping or changing pid",
+            changes,
+        ),
+        (
+            "service_state_change_timestamp_seconds",
+            "gauge",
+            "When the service was last seen changing state",
+            changed,
+        ),
+    ]
+
+
+def export(opts, parser):
+    import exporter
+
+    if opts.once and opts.listen is not None and opts.textfile is None:
+        return parser.error("--once only writes the textfile, it needs --textfile")
+    address = None
+    if opts.listen is not None:
+        try:
+            address = exporter.parse_address(opts.listen)
+        except ValueError as e:
+            return parser.error(str(e))
+
+    state_path = get_file(EXPORTER_STATE)
+    state = exporter.load_state(state_path)
+
+    def collect():
+        before = json.dumps(state, sort_keys=True)
+        families = collect_metrics(state)
+        if json.dumps(state, sort_keys=True) != before:
+            exporter.save_state(state_path, state)
+        return families
+
+    interval = opts.interval or get_setting("export_interval")
+    collector = exporter.Collector(collect, interval)
+    if opts.textfile is None and opts.listen is None:
+        print(exporter.render(collector.get()), end="")
+        return 0
+
+    server = None
+    if address is not None:
+        server = exporter.create_server(collector, *address)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on {exporter.format_url(*address)}")
+
+    try:
+        while True:
+            if opts.textfile is not None:
+                exporter.write_textfile(
+                    opts.textfile, exporter.render(collector.get(), openmetrics=False)
+                )
+            if opts.once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
     return 0
 
 
@@ -479,6 +2018,12 @@ commands = dict(
     unload=unload,
     info=info,
     create_plist=create_plist,
+    rotate=rotate,
+    top=top,
+    supervise=supervise,
+    export=export,
+    wait=wait,
+    configure=configure,
     help=help,
 )
 
@@ -498,6 +2043,13 @@ def create_start_parser(subparser):
         help="Prints live logs from the specified service after it is started",
         action="store_true",
     )
+    start_parser.add_argument(
+        "--jobs",
+        "-j",
+        help="How many services to start at once when starting all services",
+        type=int,
+        default=DEFAULT_JOBS,
+    )
 
 
 def create_status_parser(subparser):
@@ -505,7 +2057,103 @@ def create_status_parser(subparser):
         "status", help="View the status of all services"
     )
     status_parser.add_argument(
-        "--json", help="Outputs service status as json", action="store_true"
+        "services",
+        help="Only show services whose name matches one of these globs",
+        nargs="*",
+        metavar="service",
+    )
+    status_parser.add_argument(
+        "--format",
+        "-f",
+        help="Output format, ndjson prints one json object per service",
+        choices=["table", "json", "ndjson"],
+        default="table",
+    )
+    status_parser.add_argument(
+        "--json",
+        help="Outputs service status as json, the same as --format json",
+        action="store_const",
+        dest="format",
+        const="json",
+    )
+    keys = [
+        f"{key} ({join_choices(choices) if choices else 'a glob'})"
+        for key, choices in STATUS_FILTERS.items()
+    ]
+    status_parser.add_argument(
+        "--filter",
+        help="Only show services matching KEY=VALUE, where KEY is "
+        f"{join_choices(keys)}. Values can be separated by | and the option repeated",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+    )
+    status_parser.add_argument(
+        "--fields",
+        help="Comma separated fields to include in json and ndjson output",
+        default=None,
+    )
+    status_parser.add_argument(
+        "--metrics",
+        help="Include cpu, memory, thread and file descriptor usage",
+        action="store_true",
+    )
+    status_parser.add_argument(
+        "--watch",
+        "-w",
+        help="Keep refreshing the status every INTERVAL seconds "
+        f"(default: {WATCH_INTERVAL:g}), redrawing only the rows that changed",
+        metavar="INTERVAL",
+        nargs="?",
+        type=float,
+        const=WATCH_INTERVAL,
+        default=None,
+    )
+    status_parser.add_argument(
+        "--changes-only",
+        help="With --watch, print one json object per state change instead of "
+        "the table",
+        action="store_true",
+    )
+    status_parser.add_argument(
+        "--iterations",
+        "-n",
+        help="With --watch, exit after this many refreshes, 0 to run until "
+        "interrupted",
+        type=int,
+        default=0,
+    )
+
+
+def create_top_parser(subparser):
+    top_parser = subparser.add_parser(
+        "top", help="Display live resource usage of all services"
+    )
+    top_parser.add_argument(
+        "--interval",
+        "-i",
+        help="Seconds between two refreshes",
+        type=float,
+        default=2.0,
+    )
+    top_parser.add_argument(
+        "--sort",
+        "-s",
+        help="Column to sort services by",
+        choices=TOP_SORT_KEYS,
+        default="cpu",
+    )
+    top_parser.add_argument(
+        "--iterations",
+        "-n",
+        help="Exit after this many refreshes, 0 to run until interrupted",
+        type=int,
+        default=0,
+    )
+    top_parser.add_argument(
+        "--json",
+        help="Print one json object per refresh instead of a table",
+        action="store_true",
     )
 
 
@@ -521,6 +2169,53 @@ def create_stop_parser(subparser):
     stop_group.add_argument(
         "--kill", help="Force kill the service", action="store_true"
     )
+    stop_parser.add_argument(
+        "--jobs",
+        "-j",
+        help="How many services to stop at once when stopping all services",
+        type=int,
+        default=DEFAULT_JOBS,
+    )
+    stop_parser.add_argument(
+        "--wait",
+        help="Wait until the service has exited, killing it when it is still "
+        "running after the grace period",
+        action="store_true",
+    )
+    stop_parser.add_argument(
+        "--grace",
+        help="Seconds --wait gives the service to exit before killing it "
+        "(default: stop_grace_period setting)",
+        type=float,
+        default=None,
+    )
+
+
+def create_wait_parser(subparser):
+    wait_parser = subparser.add_parser(
+        "wait", help="Wait until services are running, stopped or exited"
+    )
+    wait_parser.add_argument(
+        "services",
+        help="The services to wait for, or all",
+        nargs="+",
+        metavar="service",
+    )
+    wait_parser.add_argument(
+        "--until",
+        "-u",
+        help="running, stopped, or exited to wait for the processes running now "
+        "to exit even if they are restarted (default: running)",
+        choices=["running", "stopped", "exited"],
+        default="running",
+    )
+    wait_parser.add_argument(
+        "--timeout",
+        "-t",
+        help="Give up and exit with 1 after this many seconds (default: no limit)",
+        type=float,
+        default=None,
+    )
 
 
 def create_log_parser(subparser):
@@ -546,17 +2241,114 @@ def create_log_parser(subparser):
         help="Clear the log file",
         action="store_true",
     )
-    logs_parser.add_argument("--json", help="Outputs logs as json", action="store_true")
+    logs_parser.add_argument(
+        "--json", help="Outputs logs as json, one line per record", action="store_true"
+    )
+    logs_parser.add_argument(
+        "-n",
+        "--tail",
+        "--lines",
+        dest="lines",
+        help="Only show the last N lines, or start watching N lines from the end",
+        type=int,
+        default=None,
+    )
+    logs_parser.add_argument(
+        "--head",
+        help="Only show the first N lines",
+        type=int,
+        default=None,
+    )
+    logs_parser.add_argument(
+        "--grep",
+        help="Only show lines matching this regular expression",
+        default=None,
+    )
+    logs_parser.add_argument(
+        "--since",
+        help="Only show lines logged at or after this time, "
+        "as an ISO date, a unix timestamp or an age such as 15m, 2h or 1d",
+        default=None,
+    )
+    logs_parser.add_argument(
+        "--until",
+        help="Only show lines logged at or before this time",
+        default=None,
+    )
+    logs_parser.add_argument(
+        "--since-bytes",
+        help="Start watching this many bytes before the end of the log",
+        type=int,
+        default=None,
+    )
 
 
 def create_load_parser(subparser):
     load_parser = subparser.add_parser(
         "load", help="Load a .plist or script in to the service manager as service"
     )
-    load_parser.add_argument("file", help="The file you would like to load")
+    load_parser.add_argument(
+        "file",
+        help="The file you would like to load, or a directory, glob or json "
+        "manifest of files to load at once",
+    )
     load_parser.add_argument(
         "-name", help="The name of the service you would like to load", default=None
     )
+    load_parser.add_argument(
+        "--restart",
+        help="Restart the service when it exits (default: restart_policy setting)",
+        choices=RESTART_POLICIES,
+        default=None,
+    )
+
+
+def create_export_parser(subparser):
+    export_parser = subparser.add_parser(
+        "export",
+        help="Export the state of all services as OpenMetrics",
+    )
+    export_parser.add_argument(
+        "--textfile",
+        help="Write the metrics to this file for a textfile collector",
+        default=None,
+    )
+    export_parser.add_argument(
+        "--listen",
+        help="Serve the metrics over HTTP on [HOST:]PORT, with IPv6 hosts in "
+        "brackets as in [::1]:9100",
+        default=None,
+    )
+    export_parser.add_argument(
+        "--interval",
+        "-i",
+        help="Seconds between two collections (default: export_interval setting)",
+        type=float,
+        default=None,
+    )
+    export_parser.add_argument(
+        "--once",
+        help="Write the textfile once and exit",
+        action="store_true",
+    )
+
+
+def create_supervise_parser(subparser):
+    supervise_parser = subparser.add_parser(
+        "supervise", help="Restart services that exited according to their policy"
+    )
+    supervise_parser.add_argument(
+        "--once",
+        help="Check the services once instead of until interrupted",
+        action="store_true",
+    )
+    supervise_parser.add_argument(
+        "--interval",
+        "-i",
+        help="Seconds between two checks (default: restart_check_interval setting)",
+        type=float,
+        default=None,
+    )
 
 
 def create_unload_parser(subparser):
@@ -575,6 +2367,11 @@ def create_info_parser(subparser):
     info_parser.add_argument(
         "--json", help="Displays the service info as json", action="store_true"
     )
+    info_parser.add_argument(
+        "--metrics",
+        help="Include cpu, memory, thread and file descriptor usage",
+        action="store_true",
+    )
     info_parser.add_argument("service", help="Name of the service you want to view")
 
 
@@ -586,25 +2383,170 @@ def create_plist_parser(subparser):
     create_plist_parser.add_argument(
         "input_file", help="The file the service should run"
     )
-    create_plist_parser.add_argument("service_name", help="The name of the service")
+    create_plist_parser.add_argument(
+        "service_name", help="The name of the service", nargs="?", default=None
+    )
+    create_plist_parser.add_argument(
+        "--batch",
+        help="Treat input_file as a directory, glob or json manifest of scripts "
+        "and write one plist per script in to the --output directory",
+        action="store_true",
+    )
     create_plist_parser.add_argument(
         "--domain",
         help="Manually set the domain that the service uses",
-        default=settings.get_value("domain"),
+        default=None,
     )
     create_plist_parser.add_argument(
         "--output",
         "-o",
-        help="The file you would like to output the plist in to",
+        help="The file you would like to output the plist in to, or the "
+        "directory for --batch (default: current directory)",
+        default=None,
+    )
+    add_launch_arguments(create_plist_parser)
+    add_on_demand_arguments(create_plist_parser)
+
+
+def add_launch_arguments(parser):
+    parser.add_argument(
+        "--process-type",
+        help="How launchd schedules the service, Background for batch work",
+        choices=["Background", "Standard", "Adaptive", "Interactive"],
+        default=None,
+    )
+    parser.add_argument(
+        "--low-priority-io",
+        help="Give the disk I/O of the service a low priority",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+    )
+    parser.add_argument(
+        "--nice", help="Scheduling priority, from -20 to 20", type=int, default=None
+    )
+    parser.add_argument(
+        "--throttle-interval",
+        help="Minimum seconds between two launches of the service",
+        type=int,
         default=None,
     )
+    parser.add_argument(
+        "--soft-limit",
+        help="Soft resource limit NAME=VALUE, where NAME is one of cpu, core, data, "
+        "file_size, memory_lock, open_files, processes, resident_set or stack and "
+        "sizes take K, M and G suffixes, can be repeated",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+    )
+    parser.add_argument(
+        "--hard-limit",
+        help="Hard resource limit NAME=VALUE, like --soft-limit",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+    )
+
+
+def add_on_demand_arguments(parser):
+    parser.add_argument(
+        "--socket",
+        help="Start the service on demand when a connection arrives on HOST:PORT, "
+        "PORT or the path of a unix socket, can be repeated",
+        action="append",
+        default=[],
+        metavar="ADDRESS",
+    )
+    parser.add_argument(
+        "--watch-path",
+        help="Start the service on demand when this path changes, can be repeated",
+        action="append",
+        default=[],
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--queue-directory",
+        help="Start the service on demand while this directory is not empty, can "
+        "be repeated",
+        action="append",
+        default=[],
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--path-state",
+        help="Start the service on demand while PATH exists (true) or does not "
+        "exist (false), can be repeated",
+        action="append",
+        default=[],
+        metavar="PATH=true|false",
+    )
+
+
+def create_configure_parser(subparser):
+    configure_parser = subparser.add_parser(
+        "configure",
+        help="Change the launch and on-demand options of a service and reload it "
+        "to apply them",
+    )
+    configure_parser.add_argument(
+        "service", help="The name of the service you want to configure"
+    )
+    add_launch_arguments(configure_parser)
+    add_on_demand_arguments(configure_parser)
+    configure_parser.add_argument(
+        "--idle-timeout",
+        help="Stop an on-demand service once it was idle for this many seconds, "
+        "0 keeps it running",
+        type=float,
+        default=None,
+    )
+    configure_parser.add_argument(
+        "--unset",
+        help="Remove an option, on_demand removes every on-demand option, can be "
+        "repeated",
+        choices=[
+            "process_type",
+            "low_priority_io",
+            "nice",
+            "throttle_interval",
+            "soft_limits",
+            "hard_limits",
+            "on_demand",
+            "sockets",
+            "watch_paths",
+            "queue_directories",
+            "path_state",
+            "idle_timeout",
+        ],
+        action="append",
+        default=[],
+    )
+    configure_parser.add_argument(
+        "--reset",
+        help="Remove every option before applying the other options",
+        action="store_true",
+    )
+
+
+def create_rotate_parser(subparser):
+    rotate_parser = subparser.add_parser(
+        "rotate", help="Rotate and compress the log of a service"
+    )
+    rotate_parser.add_argument(
+        "service", help="The name of the service whose log to rotate, or all"
+    )
+    rotate_parser.add_argument(
+        "--force",
+        help="Rotate the log even if it is below the size and age limits",
+        action="store_true",
+    )
 
 
 def create_help_parser(subparser):
     subparser.add_parser("help", help="Display command help")
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         prog="service",
         description="A simple service manager",
@@ -617,6 +2559,17 @@ def parse_args():
         default=0,
         help="Increase verbosity level (up to 2 times)",
     )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=bool(os.environ.get("SERVICE_TRACE")),
+        help="Print how long backend calls, file I/O and rendering took",
+    )
+    parser.add_argument(
+        "--trace-file",
+        default=os.environ.get("SERVICE_TRACE_FILE"),
+        help="Also write the trace to this file in the Chrome trace format",
+    )
 
     subparser = parser.add_subparsers(title="Commands", dest="command", required=True)
     create_start_parser(subparser)
@@ -627,9 +2580,15 @@ def parse_args():
     create_unload_parser(subparser)
     create_info_parser(subparser)
     create_status_parser(subparser)
+    create_rotate_parser(subparser)
+    create_top_parser(subparser)
+    create_supervise_parser(subparser)
+    create_export_parser(subparser)
+    create_wait_parser(subparser)
+    create_configure_parser(subparser)
     create_help_parser(subparser)
 
-    opts = parser.parse_args()
+    opts = parser.parse_args(argv)
     verbosity = min(2, opts.verbose)
     log_levels = [
         logging.ERROR,
@@ -638,12 +2597,38 @@ def parse_args():
     ]
     log_level = log_levels[verbosity]
     logger.setLevel(log_level)
+    if opts.trace or opts.trace_file:
+        tracing.enable()
 
     chosen_parser = subparser.choices[opts.command]
     chosen_parser.main_parser = parser
     return (opts, chosen_parser)
 
 
+def finish_trace(opts):
+    if not tracing.enabled():
+        return
+    # the index is normally saved at exit, save it now so it is traced
+    get_index().save()
+    spans = tracing.disable()
+    tracing.write_summary(spans, sys.stderr)
+    if opts.trace_file:
+        tracing.write_chrome_trace(spans, opts.trace_file)
+
+
+def write_env():
+    # service_launcher.py reads the PATH of the last shell the CLI ran in
+    path = os.environ.get("PATH")
+    try:
+        with open(get_file("env.txt"), "r") as f:
+            if f.read() == path:
+                return
+    except FileNotFoundError:
+        pass
+    with open(get_file("env.txt"), "w") as f:
+        f.write(path)
+
+
 def main():
     opts, parser = parse_args()
     if not os.path.exists(get_file("env.txt")):
@@ -652,15 +2637,23 @@ def main():
         install.logger.setLevel(logger.getEffectiveLevel())
         install.main()
 
-    with open(get_file("env.txt"), "w") as f:
-        f.write(os.environ.get("PATH"))
+    write_env()
     if os.getuid() == 0:
         parser.error(
             "To manage user services the command needs to be run as a non-root"
         )
 
+    import daemon_client
+
+    if daemon_client.should_forward(opts):
+        code = daemon_client.forward(sys.argv[1:])
+        if code is not None:
+            sys.exit(code)
+
     cmd = commands.get(opts.command)
-    sys.exit(cmd(opts, parser))
+    code = cmd(opts, parser)
+    finish_trace(opts)
+    sys.exit(code)
 
 
 if __name__ == "__main__":
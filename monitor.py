@@ -0,0 +1,32 @@
+# Runs a service of the native backend as its parent, like launchd does for
+# the launchd backend, so that its exit code is recorded in its job whichever
+# command started it. The pid of the service, or why it could not be
+# started, is written to stdout as soon as it is known
+import backends
+import logging
+import sys
+
+
+def main():
+    state_dir, label = sys.argv[1:3]
+    logging.basicConfig(format="monitor: %(message)s")
+    backend = backends.NativeBackend(state_dir, logging.getLogger("monitor"))
+    job = backend.read_job(label)
+    if job is None:
+        print(f"{label} is not loaded", flush=True)
+        return 1
+    try:
+        backend.spawn(label, job)
+    except OSError as e:
+        print(f"Could not start {label}: {e}", flush=True)
+        return 1
+    print(job["pid"], flush=True)
+    sys.stdout.close()
+    for _, child in list(backend.children.values()):
+        child.wait()
+    backend.reap()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# On-demand services are not started when they are loaded but when a
+# connection arrives on one of their sockets or one of their paths changes,
+# by launchd or by the activator of the native backend. They are set in the
+# registry as an "on_demand" entry, for example "on_demand": {"sockets":
+# ["127.0.0.1:8080"], "idle_timeout": 300}, and an empty entry turns a
+# service back into one that runs at load
+TRIGGERS = ("sockets", "watch_paths", "queue_directories", "path_state")
+KEYS = (*TRIGGERS, "idle_timeout")
+# the name the sockets are registered under in the plist, which
+# service_launcher.py asks launchd for
+SOCKETS_NAME = "Listeners"
+PLIST_KEYS = ("Sockets", "WatchPaths", "QueueDirectories", "KeepAlive", "RunAtLoad")
+
+
+def parse_socket(spec):
+    # "host:port", "port" or the absolute path of a unix socket
+    spec = str(spec)
+    if spec.startswith("/"):
+        return dict(SockPathName=spec)
+    host, _, port = spec.rpartition(":")
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(
+            f"Invalid socket {spec}, expected host:port, port or the path of a "
+            "unix socket"
+        )
+    socket = dict(SockServiceName=port, SockType="stream")
+    if host:
+        socket["SockNodeName"] = host.strip("[]")
+    return socket
+
+
+def validate_paths(name, paths):
+    if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+        raise ValueError(f"{name} has to be a list of paths")
+    for path in paths:
+        if not path.startswith("/"):
+            raise ValueError(f"{name} has to contain absolute paths, not {path}")
+    return paths
+
+
+def validate(options):
+    # a non-empty entry needs at least one trigger
+    if not isinstance(options, dict):
+        raise ValueError("on_demand has to be a mapping")
+    for name, value in options.items():
+        if name not in KEYS:
+            raise ValueError(
+                f"Unknown on_demand option {name}, expected one of {', '.join(KEYS)}"
+            )
+        if name == "sockets":
+            if not isinstance(value, list):
+                raise ValueError("sockets has to be a list")
+            for spec in value:
+                parse_socket(spec)
+        elif name in ("watch_paths", "queue_directories"):
+            validate_paths(name, value)
+        elif name == "path_state":
+            if not isinstance(value, dict) or not all(
+                isinstance(state, bool) for state in value.values()
+            ):
+                raise ValueError("path_state has to map paths to true or false")
+            validate_paths(name, list(value))
+        elif name == "idle_timeout":
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError("idle_timeout has to be a number of seconds")
+            if value < 0:
+                raise ValueError("idle_timeout can not be negative")
+    if options and not enabled(options):
+        raise ValueError(
+            "on_demand needs sockets, watch_paths, queue_directories or path_state"
+        )
+    return dict(options)
+
+
+def enabled(options):
+    return any(options.get(name) for name in TRIGGERS)
+
+
+def plist_keys(options):
+    keys = dict()
+    if options.get("sockets"):
+        keys["Sockets"] = {
+            SOCKETS_NAME: [parse_socket(spec) for spec in options["sockets"]]
+        }
+    if options.get("watch_paths"):
+        keys["WatchPaths"] = list(options["watch_paths"])
+    if options.get("queue_directories"):
+        keys["QueueDirectories"] = list(options["queue_directories"])
+    if options.get("path_state"):
+        keys["KeepAlive"] = dict(PathState=dict(options["path_state"]))
+    keys["RunAtLoad"] = not keys
+    return keys
+
+
+def apply(data, options):
+    # sets the activation keys of `options` in the plist `data`, returns
+    # whether the plist changed
+    keys = plist_keys(options)
+    changed = False
+    for key in PLIST_KEYS:
+        if key in keys and data.get(key) != keys[key]:
+            data[key] = keys[key]
+            changed = True
+        elif key not in keys and key in data:
+            del data[key]
+            changed = True
+    return changed
+
+
+def is_on_demand(data):
+    # whether a plist starts its service on demand rather than at load
+    if data.get("RunAtLoad", False):
+        return False
+    keep_alive = data.get("KeepAlive")
+    return bool(
+        data.get("Sockets")
+        or data.get("WatchPaths")
+        or data.get("QueueDirectories")
+        or (isinstance(keep_alive, dict) and keep_alive.get("PathState"))
+    )
+
+
+def describe(options):
+    rows = []
+    for name, value in options.items():
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        elif isinstance(value, dict):
+            value = ", ".join(
+                f"{path}={str(state).lower()}" for path, state in value.items()
+            )
+        rows.append((name, value))
+    return rows
@@ -0,0 +1,221 @@
+import subprocess
+import time
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+FIELDS = ("cpu_percent", "rss", "threads", "fds", "processes", "uptime")
+
+
+def read_proc():
+    # one pass over /proc; fds are only counted later for the pids that
+    # belong to a managed service
+    ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    with open("/proc/stat", "r") as f:
+        boot_time = next(
+            int(line.split()[1]) for line in f if line.startswith("btime")
+        )
+
+    table = dict()
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        fields = data[data.rfind(b")") + 2 :].split()
+        table[int(entry)] = dict(
+            ppid=int(fields[1]),
+            cpu=(int(fields[11]) + int(fields[12])) / ticks,
+            rss=int(fields[21]) * page_size,
+            threads=int(fields[17]),
+            started=boot_time + int(fields[19]) / ticks,
+        )
+    return table
+
+
+def read_psutil():
+    table = dict()
+    attrs = ["pid", "ppid", "cpu_times", "memory_info", "num_threads", "create_time"]
+    for proc in psutil.process_iter(attrs):
+        info = proc.info
+        cpu_times, memory = info["cpu_times"], info["memory_info"]
+        table[info["pid"]] = dict(
+            ppid=info["ppid"],
+            cpu=cpu_times.user + cpu_times.system if cpu_times else 0.0,
+            rss=memory.rss if memory else None,
+            threads=info["num_threads"],
+            started=info["create_time"],
+        )
+    return table
+
+
+def parse_duration(value):
+    # ps prints times as [[dd-]hh:]mm:ss[.ss]
+    days, _, value = value.rpartition("-")
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds + int(days or 0) * 86400
+
+
+def read_ps():
+    output = subprocess.run(
+        ["ps", "-A", "-o", "pid=,ppid=,rss=,time=,etime="],
+        capture_output=True,
+        text=True,
+    ).stdout
+    now = time.time()
+    table = dict()
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) != 5:
+            continue
+        table[int(fields[0])] = dict(
+            ppid=int(fields[1]),
+            cpu=parse_duration(fields[3]),
+            rss=int(fields[2]) * 1024,
+            threads=None,
+            started=now - parse_duration(fields[4]),
+        )
+    return table
+
+
+def read_processes():
+    if os.path.isdir("/proc/self/task"):
+        return read_proc()
+    elif psutil is not None:
+        return read_psutil()
+    return read_ps()
+
+
+def count_fds(pid):
+    try:
+        if os.path.isdir("/proc/self/fd"):
+            return len(os.listdir(f"/proc/{pid}/fd"))
+        elif psutil is not None:
+            return psutil.Process(pid).num_fds()
+    except Exception:
+        pass
+    return None
+
+
+def process_tree(table, children, pid):
+    tree = [pid]
+    for current in tree:
+        tree.extend(children.get(current, ()))
+    return [pid for pid in tree if pid in table]
+
+
+def read_totals(pids, fds=False):
+    # the cpu seconds used so far, rss and open files of each process and its
+    # children from a single read of the process table, fds are only counted
+    # when asked for
+    table = read_processes()
+    children = dict()
+    for pid, proc in table.items():
+        children.setdefault(proc["ppid"], []).append(pid)
+    totals = dict()
+    for pid in pids:
+        if pid not in table:
+            continue
+        tree = process_tree(table, children, pid)
+        totals[pid] = dict(
+            cpu=sum(table[p]["cpu"] for p in tree),
+            rss=add(table[p]["rss"] for p in tree),
+            fds=add(count_fds(p) for p in tree) if fds else None,
+        )
+    return totals
+
+
+def add(values):
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
+
+class Sampler:
+    def __init__(self):
+        self.previous = None
+        self.previous_time = None
+
+    def sample(self, pids):
+        table = read_processes()
+        now = time.monotonic()
+        children = dict()
+        for pid, proc in table.items():
+            children.setdefault(proc["ppid"], []).append(pid)
+
+        metrics = dict()
+        for pid in pids:
+            if pid not in table:
+                continue
+            tree = process_tree(table, children, pid)
+            cpu_percent = None
+            if self.previous is not None and now > self.previous_time:
+                used = sum(
+                    table[p]["cpu"] - self.previous.get(p, dict(cpu=0.0))["cpu"]
+                    for p in tree
+                )
+                cpu_percent = max(0.0, used) / (now - self.previous_time) * 100
+            metrics[pid] = dict(
+                cpu_percent=cpu_percent,
+                rss=add(table[p]["rss"] for p in tree),
+                threads=add(table[p]["threads"] for p in tree),
+                fds=add(count_fds(p) for p in tree),
+                processes=len(tree),
+                uptime=time.time() - table[pid]["started"],
+            )
+
+        self.previous = table
+        self.previous_time = now
+        return metrics
+
+
+def sample(pids, interval=0.5):
+    # cpu usage is measured over `interval` seconds
+    sampler = Sampler()
+    sampler.sample(pids)
+    time.sleep(interval)
+    return sampler.sample(pids)
+
+
+def format_bytes(size):
+    if size is None:
+        return "None"
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024:
+            return f"{size:.1f}{unit}" if unit != "B" else f"{size}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def format_uptime(seconds):
+    if seconds is None:
+        return "None"
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    clock = f"{hours:02}:{minutes:02}:{seconds:02}"
+    return f"{days}d {clock}" if days else clock
+
+
+def format_metrics(metrics):
+    if metrics is None:
+        return ["None"] * len(FIELDS)
+    cpu_percent = metrics["cpu_percent"]
+    return [
+        "None" if cpu_percent is None else f"{cpu_percent:.1f}",
+        format_bytes(metrics["rss"]),
+        str(metrics["threads"]),
+        str(metrics["fds"]),
+        str(metrics["processes"]),
+        format_uptime(metrics["uptime"]),
+    ]
@@ -0,0 +1,199 @@
+import contextlib
+import tracing
+import fcntl
+import json
+import os
+
+
+UPSERT = (
+    "INSERT INTO services (name, info) VALUES (?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET info = excluded.info"
+)
+
+# the sqlite user_version once services.json was imported
+IMPORTED_VERSION = 1
+
+
+class RegistryError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def file_lock(path, exclusive=True):
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def atomic_write(path, data, sync=False):
+    # writes str or bytes to a temporary file that is renamed over `path`, so
+    # readers see the old or the new file but never a partial one
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def atomic_write_json(path, data):
+    with tracing.span("registry write", path=path):
+        atomic_write(path, json.dumps(data, indent=4), sync=True)
+
+
+def copy_services(services):
+    return {name: dict(info) for name, info in services.items()}
+
+
+class JsonRegistry:
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._cache = None
+
+    def _read(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return dict()
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if self._cache is not None and self._cache[0] == key:
+            return self._cache[1]
+
+        with tracing.span("registry read", path=self.path), open(self.path, "r") as f:
+            try:
+                services = json.load(f)
+            except json.JSONDecodeError as e:
+                raise RegistryError(f"Could not parse {self.path}: {e}")
+        self._cache = (key, services)
+        return services
+
+    def all(self):
+        return copy_services(self._read())
+
+    def get(self, name):
+        info = self._read().get(name, None)
+        return None if info is None else dict(info)
+
+    def __contains__(self, name):
+        return name in self._read()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with file_lock(self.lock_path):
+            self._cache = None
+            services = self.all()
+            yield services
+            atomic_write_json(self.path, services)
+            self._cache = None
+
+    def update(self, name, info):
+        with self.transaction() as services:
+            services[name] = info
+
+    def delete(self, name):
+        with self.transaction() as services:
+            return services.pop(name, None)
+
+
+class SqliteRegistry:
+    def __init__(self, path, import_from=None):
+        import sqlite3
+
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS services "
+            "(name TEXT PRIMARY KEY, info TEXT NOT NULL)"
+        )
+        if import_from is not None:
+            self.import_json(import_from)
+
+    def import_json(self, path):
+        # services.json is only imported the first time the database is
+        # opened, so services that were removed since then stay removed
+        with file_lock(self.lock_path):
+            (version,) = self.conn.execute("PRAGMA user_version").fetchone()
+            if version >= IMPORTED_VERSION:
+                return
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM services").fetchone()
+            services = dict()
+            if not count and os.path.exists(path):
+                with open(path, "r") as f:
+                    services = json.load(f)
+            with self._write():
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO services (name, info) VALUES (?, ?)",
+                    [(name, json.dumps(info)) for name, info in services.items()],
+                )
+                self.conn.execute(f"PRAGMA user_version = {IMPORTED_VERSION}")
+
+    @contextlib.contextmanager
+    def _write(self):
+        with tracing.span("registry write", path=self.path):
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def all(self):
+        with tracing.span("registry read", path=self.path):
+            rows = self.conn.execute("SELECT name, info FROM services ORDER BY rowid")
+            return {name: json.loads(info) for name, info in rows}
+
+    def get(self, name):
+        with tracing.span("registry read", path=self.path, service=name):
+            row = self.conn.execute(
+                "SELECT info FROM services WHERE name = ?", (name,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._write():
+            rows = self.conn.execute("SELECT name, info FROM services ORDER BY rowid")
+            before = {name: info for name, info in rows}
+            services = {name: json.loads(info) for name, info in before.items()}
+            yield services
+            for name in before.keys() - services.keys():
+                self.conn.execute("DELETE FROM services WHERE name = ?", (name,))
+            for name, info in services.items():
+                encoded = json.dumps(info)
+                if before.get(name) != encoded:
+                    self.conn.execute(UPSERT, (name, encoded))
+
+    def update(self, name, info):
+        with self._write():
+            self.conn.execute(UPSERT, (name, json.dumps(info)))
+
+    def delete(self, name):
+        with self._write():
+            info = self.get(name)
+            self.conn.execute("DELETE FROM services WHERE name = ?", (name,))
+        return info
+
+
+def open_registry(backend, json_path, sqlite_path):
+    if backend == "json":
+        return JsonRegistry(json_path)
+    elif backend == "sqlite":
+        return SqliteRegistry(sqlite_path, import_from=json_path)
+    raise RegistryError(f"Unknown registry backend {backend}")
@@ -0,0 +1,74 @@
+import registry
+import tracing
+import json
+import os
+
+
+class ServiceIndex:
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        self.entries = dict()
+        try:
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def lookup(self, service, config_file, domain, launchd_domain, mainfile=None):
+        try:
+            st = os.stat(config_file)
+            key = [st.st_mtime_ns, st.st_size]
+        except FileNotFoundError:
+            key = None
+
+        entry = self.entries.get(service, None)
+        if (
+            entry is not None
+            and entry["key"] == key
+            and entry["domain"] == domain
+            and entry["target"] == f'{launchd_domain}/{entry["label"]}'
+            and (mainfile is None or entry["mainfile"] == mainfile)
+        ):
+            return entry
+
+        if key is None:
+            label = f"{domain}.{service}"
+        else:
+            import plistlib
+
+            with tracing.span("plist read", path=config_file):
+                with open(config_file, "rb") as f:
+                    label = plistlib.load(f).get("Label", None)
+
+        if mainfile is None and entry is not None:
+            mainfile = entry["mainfile"]
+
+        entry = dict(
+            key=key,
+            domain=domain,
+            label=label,
+            target=f"{launchd_domain}/{label}",
+            mainfile=mainfile,
+            config_file=config_file if key is not None else None,
+            output_file=(
+                os.path.join(os.path.dirname(mainfile), ".output/stdout")
+                if mainfile
+                else None
+            ),
+        )
+        self.entries[service] = entry
+        self.dirty = True
+        return entry
+
+    def discard(self, service):
+        if self.entries.pop(service, None) is not None:
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with tracing.span("index write", path=self.path):
+            registry.atomic_write(self.path, json.dumps(self.entries))
+        self.dirty = False
@@ -1,25 +1,169 @@
 #!/Library/Frameworks/Python.framework/Versions/3.11/bin/python3
-import subprocess
+import shutil
+import json
 import sys
 import os
 
 
+CACHE_VERSION = 1
+# interpreters for programs without a shebang line, None means the
+# interpreter the launcher itself runs on
+INTERPRETERS = {
+    ".py": None,
+    ".sh": "sh",
+    ".bash": "bash",
+    ".zsh": "zsh",
+    ".js": "node",
+    ".mjs": "node",
+    ".rb": "ruby",
+    ".pl": "perl",
+}
+
+
 def get_file(filename):
     return os.path.join(os.path.dirname(__file__), filename)
 
 
+def read_shebang(program):
+    with open(program, "rb") as f:
+        line = f.readline(256)
+    if not line.startswith(b"#!"):
+        return None
+    return line[2:].decode().split()
+
+
+def resolve_command(program, path):
+    shebang = read_shebang(program)
+    if shebang:
+        # resolve `#!/usr/bin/env name` here instead of exec'ing env
+        if os.path.basename(shebang[0]) == "env" and len(shebang) > 1:
+            shebang = shebang[1:]
+        interpreter, *args = shebang
+    else:
+        extension = os.path.splitext(program)[1].lower()
+        if extension not in INTERPRETERS:
+            if os.access(program, os.X_OK):
+                return [program]
+            raise RuntimeError(f"Don't know how to run {program}")
+        interpreter, args = INTERPRETERS[extension], []
+        if interpreter is None:
+            return [sys.executable, program]
+
+    if not os.path.isabs(interpreter):
+        resolved = shutil.which(interpreter, path=path)
+        if resolved is None:
+            raise RuntimeError(f"{interpreter} was not found in PATH")
+        interpreter = resolved
+    return [interpreter, *args, program]
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "r") as f:
+            data = json.load(f)
+        if data.get("version") == CACHE_VERSION:
+            return data
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return dict(version=CACHE_VERSION, programs={})
+
+
+def save_cache(cache_path, cache):
+    # only needed when the cache missed, so the import stays off the fast path
+    import registry
+
+    try:
+        registry.atomic_write(cache_path, json.dumps(cache))
+    except OSError:
+        pass
+
+
+def get_command(program, path):
+    # the resolved command is cached per program and reused as long as the
+    # program file and the PATH from env.txt are unchanged
+    st = os.stat(program)
+    key = [st.st_mtime_ns, st.st_size, path]
+    cache_path = get_file(".services/launcher.json")
+    cache = load_cache(cache_path)
+    entry = cache["programs"].get(program)
+    if entry is not None and entry["key"] == key:
+        return entry["command"]
+
+    command = resolve_command(program, path)
+    cache["programs"][program] = dict(key=key, command=command)
+    save_cache(cache_path, cache)
+    return command
+
+
+def launchd_sockets():
+    import ctypes
+    import on_demand
+
+    libc = ctypes.CDLL(None)
+    if not hasattr(libc, "launch_activate_socket"):
+        return []
+    fds = ctypes.POINTER(ctypes.c_int)()
+    count = ctypes.c_size_t()
+    code = libc.launch_activate_socket(
+        on_demand.SOCKETS_NAME.encode(), ctypes.byref(fds), ctypes.byref(count)
+    )
+    if code != 0:
+        return []
+    received = [fds[index] for index in range(count.value)]
+    libc.free(fds)
+    return received
+
+
+def activate_sockets():
+    # on-demand services get their sockets the way systemd passes them, as
+    # LISTEN_FDS descriptors starting at 3, whether they come from the
+    # native backend or from launchd
+    fds = os.environ.pop("SERVICE_LISTEN_FDS", None)
+    if fds is not None:
+        fds = [int(fd) for fd in fds.split(",") if fd]
+    elif sys.platform == "darwin":
+        fds = launchd_sockets()
+    if not fds:
+        return
+
+    import fcntl
+
+    # moved above the target range first so that no socket is overwritten
+    # before it is moved
+    moved = [fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, 3 + len(fds)) for fd in fds]
+    for fd in fds:
+        os.close(fd)
+    for index, fd in enumerate(moved):
+        os.dup2(fd, 3 + index)
+        os.close(fd)
+    os.environ["LISTEN_FDS"] = str(len(fds))
+    # the launcher execs the program in place, so it keeps this pid
+    os.environ["LISTEN_PID"] = str(os.getpid())
+
+
 def main():
-    print("fff")
     sys.argv.pop(0)
-    path = " ".join(sys.argv)
+    program = " ".join(sys.argv)
 
     with open(get_file("env.txt"), "r") as f:
-        PATH = f.read()
+        path = f.read().strip()
+    os.environ["PATH"] = path
 
-    os.environ["PATH"] = PATH
-    cmd = [sys.executable, "/Users/kareem/Documents/dev/Python/Apps/run/main.py", path]
+    # the legacy mode hands the program to a runner script instead of
+    # picking the interpreter here
+    runner = os.environ.get("SERVICE_LAUNCHER_RUNNER")
+    if runner:
+        command = [sys.executable, runner, program]
+    else:
+        try:
+            command = get_command(program, path)
+        except (OSError, RuntimeError) as e:
+            sys.exit(f"service_launcher: {e}")
 
-    subprocess.run(cmd)
+    activate_sockets()
+    # replace the launcher so no idle parent process is left behind
+    sys.stdout.flush()
+    os.execv(command[0], command)
 
 
 if __name__ == "__main__":
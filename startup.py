@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 import main as lib
-import json
+import executor
+import argparse
+import socket
+import time
+import re
 import os
 
 
@@ -12,17 +16,146 @@ class Force:
     force = True
 
 
+DEFAULT_READY_TIMEOUT = 30.0
+READY_POLL_INTERVAL = 0.2
+
+
+def port_open(host, port):
+    try:
+        with socket.create_connection((host, port), timeout=READY_POLL_INTERVAL):
+            return True
+    except OSError:
+        return False
+
+
+def log_matches(path, pattern, state):
+    # only read what was appended since the last poll
+    try:
+        with open(path, "r", errors="replace") as f:
+            f.seek(state["offset"])
+            data = state["tail"] + f.read()
+            state["offset"] = f.tell()
+    except FileNotFoundError:
+        return False
+    lines = data.split("\n")
+    state["tail"] = lines.pop()
+    return any(pattern.search(line) for line in lines + [state["tail"]])
+
+
+def check_ready(probe, state):
+    if "port" in probe:
+        return port_open(probe.get("host", "127.0.0.1"), probe["port"])
+    elif "file" in probe:
+        return os.path.exists(probe["file"])
+    elif "log" in probe:
+        return log_matches(state["path"], state["pattern"], state)
+    raise ValueError(f"Unknown readiness probe {probe}")
+
+
+def wait_ready(service, info, log_offset):
+    probe = info.get("ready", None)
+    if not probe:
+        return True
+
+    timeout = probe.get("timeout", DEFAULT_READY_TIMEOUT)
+    state = dict(offset=log_offset, tail="")
+    if "log" in probe:
+        state["pattern"] = re.compile(probe["log"])
+        state["path"] = lib.get_service_metadata(service, info["mainfile"])[
+            "output_file"
+        ]
+
+    deadline = time.monotonic() + timeout
+    while not check_ready(probe, state):
+        if time.monotonic() >= deadline:
+            lib.logger.error(f"Service did not become ready within {timeout}s")
+            return False
+        time.sleep(READY_POLL_INTERVAL)
+    return True
+
+
+def boot_set(services):
+    names = [name for name, info in services.items() if info.get("startup") is True]
+    pending = list(names)
+    while pending:
+        for dep in services.get(pending.pop(), {}).get("requires", []):
+            if dep in services and dep not in names:
+                names.append(dep)
+                pending.append(dep)
+    return names
+
+
+def boot(services, jobs, stagger):
+    snapshot = lib.get_status_snapshot()
+    names = boot_set(services)
+    ready_times = dict()
+
+    def start_one(service):
+        info = services[service]
+        info["name"] = service
+        missing = [dep for dep in info.get("requires", []) if dep not in services]
+        if missing:
+            lib.logger.error(f"Requires unknown service {missing[0]}")
+            return 1
+
+        outpath = lib.get_service_metadata(service, info["mainfile"])["output_file"]
+        try:
+            log_offset = os.path.getsize(outpath)
+        except OSError:
+            log_offset = 0
+
+        start = time.monotonic()
+        code = lib.start_service(info, Force, snapshot)
+        if code not in (0, None):
+            return code
+        if not wait_ready(service, info, log_offset):
+            return 1
+        ready_times[service] = time.monotonic() - start
+        return code
+
+    return executor.run_graph(
+        start_one,
+        names,
+        {name: services[name].get("after", []) for name in names},
+        {name: services[name].get("requires", []) for name in names},
+        jobs,
+        lib.logger,
+        stagger,
+    ), ready_times
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Starts all startup services")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="How many services to start at once",
+        type=int,
+        default=lib.get_setting("boot_jobs"),
+    )
+    parser.add_argument(
+        "--stagger",
+        help="Minimum number of seconds between two service launches",
+        type=float,
+        default=lib.get_setting("boot_stagger"),
+    )
+    return parser.parse_args()
+
+
 def main():
+    opts = parse_args()
     print("Loading startup services")
-    with open(get_file("services.json"), "r") as f:
-        services = json.load(f)
-    for service, info in services.items():
-        if info.get("startup", False) is True:
-            info["name"] = service
-            lib.start_service(info, Force)
+    start = time.monotonic()
+    results, ready_times = boot(lib.get_registry().all(), opts.jobs, opts.stagger)
+    for result in results:
+        started = "-" if result.started is None else f"+{result.started:.2f}s"
+        ready = ready_times.get(result.name, None)
+        ready = "-" if ready is None else f"{ready:.2f}s"
+        print(f"{result.name}: {result.state} started {started} ready in {ready}")
 
-    print("Loaded startup services")
+    print(f"Loaded startup services in {time.monotonic() - start:.2f}s")
+    return 1 if any(result.state == "failed" for result in results) else 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
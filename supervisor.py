@@ -0,0 +1,96 @@
+import contextlib
+import registry
+import random
+import json
+
+
+POLICIES = ("never", "on-failure", "always")
+# restarts are rate limited per this many seconds
+RATE_PERIOD = 60
+
+
+def new_state():
+    return dict(
+        attempts=0,
+        restarts_total=0,
+        failures=[],
+        restarts=[],
+        next_restart=None,
+        last_restart=None,
+        last_exit=None,
+        parked=False,
+        held=False,
+    )
+
+
+def load_states(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+@contextlib.contextmanager
+def transaction(path):
+    with registry.file_lock(f"{path}.lock"):
+        states = load_states(path)
+        yield states
+        registry.atomic_write_json(path, states)
+
+
+def backoff_delay(policy, attempts):
+    delay = min(policy["max_backoff"], policy["backoff"] * 2**attempts)
+    # jitter keeps services that crashed together from restarting together
+    return delay * (1 - policy["jitter"] * random.random())
+
+
+def plan(policy, state, status, retcode, now):
+    # decides what to do about one service, returns "restart", "park" or None
+    if policy["policy"] == "never" or state["held"] or state["parked"]:
+        return None
+    if status is True:
+        # a service that stayed up for a whole window is healthy again
+        last_restart = state["last_restart"]
+        if last_restart is not None and now - last_restart >= policy["window"]:
+            state["attempts"] = 0
+        return None
+    if status is None:
+        return None
+
+    if state["next_restart"] is None:
+        # an exit code of None is unknown, it is neither a failure nor a
+        # clean exit
+        failed = retcode is not None and retcode != 0
+        state["last_exit"] = retcode
+        if not failed and policy["policy"] == "on-failure":
+            return None
+        state["failures"] = [
+            failure for failure in state["failures"] if now - failure < policy["window"]
+        ]
+        # under "always" a clean or unknown exit is restarted with backoff,
+        # but only failures count towards parking the service
+        if failed:
+            state["failures"].append(now)
+        if len(state["failures"]) >= policy["max_failures"]:
+            state["parked"] = True
+            return "park"
+
+        delay = backoff_delay(policy, state["attempts"])
+        recent = [
+            restart for restart in state["restarts"] if now - restart < RATE_PERIOD
+        ]
+        if len(recent) >= policy["max_rate"]:
+            delay = max(delay, recent[-policy["max_rate"]] + RATE_PERIOD - now)
+        state["next_restart"] = now + delay
+
+    if now < state["next_restart"]:
+        return None
+    state["attempts"] += 1
+    state["restarts_total"] = state.get("restarts_total", 0) + 1
+    state["next_restart"] = None
+    state["last_restart"] = now
+    state["restarts"] = [
+        restart for restart in state["restarts"] if now - restart < RATE_PERIOD
+    ] + [now]
+    return "restart"
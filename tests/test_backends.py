@@ -0,0 +1,184 @@
+import backends
+import plistlib
+import logging
+import socket
+import pytest
+import signal
+import time
+import sys
+import os
+
+
+logger = logging.getLogger("test")
+
+
+def write_plist(path, code, **keys):
+    data = dict(
+        Label=os.path.basename(path),
+        ProgramArguments=[sys.executable, "-c", code],
+        WorkingDirectory=os.path.dirname(path),
+        StandardOutPath="out.log",
+    )
+    data.update(keys)
+    with open(path, "wb") as f:
+        plistlib.dump(data, f)
+    return str(path)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_parse_launchctl_list():
+    output = "PID\tStatus\tLabel\n123\t0\tcom.a\n-\t-9\tcom.b\n-\t-\tcom.c\nbad\n"
+    assert backends.parse_launchctl_list(output) == {
+        "com.a": (123, 0),
+        "com.b": (None, -9),
+        "com.c": (None, None),
+    }
+
+
+def test_open_backend(tmp_path):
+    backend = backends.open_backend("native", "gui/501", str(tmp_path), logger)
+    assert isinstance(backend, backends.NativeBackend)
+    with pytest.raises(backends.BackendError):
+        backends.open_backend("systemd", "gui/501", str(tmp_path), logger)
+
+
+def test_native_lifecycle(tmp_path):
+    backend = backends.NativeBackend(str(tmp_path / "jobs"), logger)
+    config = write_plist(
+        tmp_path / "app.plist", "import time; print('up', flush=True); time.sleep(30)"
+    )
+    assert backend.start("app") == 113
+    assert backend.load("app", config) == 0
+    assert backend.load("app", config) == 5
+    assert backend.snapshot() == dict(app=(None, None))
+
+    assert backend.start("app") == 0
+    pid, retcode = backend.snapshot()["app"]
+    assert pid is not None and retcode is None
+    assert wait_for(lambda: (tmp_path / "out.log").read_text() == "up\n")
+
+    # starting a running service restarts it
+    assert backend.start("app") == 0
+    restarted = backend.snapshot()["app"][0]
+    assert restarted not in (None, pid)
+
+    assert backend.stop("app") == 0
+    # the monitor of the service records its exit code
+    assert wait_for(lambda: backend.snapshot() == dict(app=(None, -signal.SIGTERM)))
+    assert backend.stop("app") == 0
+    assert backend.kill("app") == 3
+
+    assert backend.unload("app", config) == 0
+    assert backend.unload("app", config) == 3
+    assert backend.snapshot() == dict()
+
+
+def test_exit_code_of_a_service_started_elsewhere(tmp_path):
+    # the process that started the service is gone by the time it exits
+    state_dir = str(tmp_path / "jobs")
+    config = write_plist(
+        tmp_path / "app.plist", "import sys, time; time.sleep(0.2); sys.exit(3)"
+    )
+    backend = backends.NativeBackend(state_dir, logger)
+    assert backend.load("app", config) == 0
+    assert backend.start("app") == 0
+    del backend
+
+    other = backends.NativeBackend(state_dir, logger)
+    assert other.snapshot()["app"][0] is not None
+    assert wait_for(lambda: other.snapshot() == dict(app=(None, 3)))
+
+
+def test_start_reports_errors(tmp_path):
+    config = write_plist(
+        tmp_path / "app.plist", "pass", ProgramArguments=[str(tmp_path / "missing")]
+    )
+    backend = backends.NativeBackend(str(tmp_path / "jobs"), logger)
+    assert backend.load("app", config) == 0
+    assert backend.start("app") == 1
+    assert backend.snapshot() == dict(app=(None, None))
+
+
+def test_process_setup(tmp_path):
+    assert backends.process_setup(dict()) is None
+    code = (
+        "import os, resource; "
+        "print(os.getpriority(os.PRIO_PROCESS, 0), "
+        "*resource.getrlimit(resource.RLIMIT_NOFILE))"
+    )
+    config = write_plist(
+        tmp_path / "app.plist",
+        code,
+        RunAtLoad=True,
+        Nice=5,
+        SoftResourceLimits=dict(NumberOfFiles=64),
+        HardResourceLimits=dict(NumberOfFiles=128, Unknown=1),
+    )
+    backend = backends.NativeBackend(str(tmp_path / "jobs"), logger)
+    backend.load("app", config)
+    assert wait_for(lambda: backend.snapshot()["app"] == (None, 0))
+    # lowering the nice value of the test run would need privileges
+    nice = max(os.getpriority(os.PRIO_PROCESS, 0), 5)
+    assert (tmp_path / "out.log").read_text().split() == [str(nice), "64", "128"]
+
+
+def test_open_listeners(tmp_path):
+    path = str(tmp_path / "app.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    # a socket left behind by an earlier run is replaced
+    listeners = backends.open_listeners(
+        dict(Sockets=dict(Listeners=dict(SockPathName=path)))
+    )
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.close()
+    finally:
+        for sock in listeners:
+            sock.close()
+
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        spec = dict(SockServiceName=str(port), SockNodeName="127.0.0.1")
+        with pytest.raises(OSError):
+            backends.open_listeners(dict(Sockets=dict(Listeners=[spec])))
+
+
+def test_activator_starts_service_on_connection(tmp_path):
+    path = str(tmp_path / "app.sock")
+    code = (
+        "import os, socket; "
+        "sock = socket.socket(fileno=int(os.environ['SERVICE_LISTEN_FDS'])); "
+        "conn, _ = sock.accept(); conn.sendall(b'hello'); conn.close()"
+    )
+    config = write_plist(
+        tmp_path / "app.plist",
+        code,
+        Sockets=dict(Listeners=[dict(SockPathName=path)]),
+        RunAtLoad=False,
+    )
+    backend = backends.NativeBackend(str(tmp_path / "jobs"), logger)
+    assert backend.load("app", config) == 0
+    job = backend.read_job("app")
+    assert backend.has_activator(job)
+    assert job["pid"] is None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(10)
+            client.connect(path)
+            assert client.recv(5) == b"hello"
+    finally:
+        backend.unload("app", config)
+    assert wait_for(lambda: backends.process_start_time(job["activator"]) is None)
@@ -0,0 +1,114 @@
+import daemon_client
+import threading
+import argparse
+import logging
+import socket
+import daemon
+import struct
+import json
+import os
+
+
+class Index:
+    def __init__(self):
+        self.saves = 0
+
+    def save(self):
+        self.saves += 1
+
+
+class Lib:
+    # the parts of main.py the daemon runs commands with
+    def __init__(self):
+        self.logger = logging.getLogger("test daemon")
+        self.index = Index()
+        self.traced = []
+        self.commands = dict(hello=self.hello, fail=self.fail, status=self.hello)
+
+    def parse_args(self, argv):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("command", choices=list(self.commands))
+        parser.add_argument("--watch", type=float)
+        return parser.parse_args(argv), parser
+
+    def hello(self, opts, parser):
+        greeting = os.environ.get("GREETING", "hello")
+        print(f"{greeting} from {os.path.basename(os.getcwd())}")
+        self.logger.error("to stderr")
+        return 4
+
+    def fail(self, opts, parser):
+        raise RuntimeError("broken")
+
+    def finish_trace(self, opts):
+        self.traced.append(opts.command)
+
+    def get_index(self):
+        return self.index
+
+
+def request(path, argv, cwd, env=None):
+    # the client side of daemon_client.forward, collecting the output
+    output = {daemon_client.STDOUT: b"", daemon_client.STDERR: b""}
+    request = dict(argv=argv, cwd=cwd, env=env or dict(PATH=os.environ["PATH"]))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        while True:
+            header = daemon_client.recv_exact(sock, daemon_client.FRAME.size)
+            channel, size = daemon_client.FRAME.unpack(header)
+            data = daemon_client.recv_exact(sock, size)
+            if channel == daemon_client.EXIT:
+                code = struct.unpack("!i", data)[0]
+                stdout = output[daemon_client.STDOUT].decode()
+                return code, stdout, output[daemon_client.STDERR].decode()
+            output[channel] += data
+
+
+def test_daemon_runs_commands(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    workdir = tmp_path / "project"
+    workdir.mkdir()
+    lib = Lib()
+    server = daemon.Daemon(path, lib)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    cwd = os.getcwd()
+    try:
+        assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+        code, stdout, stderr = request(path, ["hello"], str(workdir))
+        assert (code, stdout, stderr) == (4, "hello from project\n", "to stderr\n")
+        # the working directory and streams of the daemon are restored
+        assert os.getcwd() == cwd
+        assert lib.logger.handlers == []
+
+        # the command sees the environment of the client
+        env = dict(PATH=os.environ["PATH"], GREETING="hi")
+        code, stdout, _ = request(path, ["hello"], str(workdir), env)
+        assert stdout == "hi from project\n"
+        assert "GREETING" not in os.environ
+
+        code, stdout, stderr = request(path, ["fail"], str(workdir))
+        assert code == 1
+        assert "RuntimeError: broken" in stderr
+
+        code, stdout, stderr = request(path, ["status", "--wat", "1"], str(workdir))
+        assert code == 2
+        assert "has to run without the daemon" in stderr
+        assert lib.traced == ["hello", "hello", "fail", "status"]
+        assert lib.index.saves == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_remove_stale_socket(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    assert daemon.remove_stale_socket(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(path)
+        listener.listen()
+        assert not daemon.remove_stale_socket(path)
+    # nothing listens on it any more
+    assert daemon.remove_stale_socket(path)
+    assert not os.path.exists(path)
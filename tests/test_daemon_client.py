@@ -0,0 +1,80 @@
+import daemon_client
+import argparse
+import struct
+import socket
+import pytest
+
+
+def namespace(command, **options):
+    return argparse.Namespace(command=command, **options)
+
+
+def test_direct_commands():
+    for command in daemon_client.DIRECT_COMMANDS:
+        assert daemon_client.runs_in_client(namespace(command))
+    assert not daemon_client.runs_in_client(namespace("status", watch=None))
+    assert not daemon_client.runs_in_client(namespace("stop", wait=False))
+
+
+def test_no_daemon_env(monkeypatch):
+    monkeypatch.setenv("SERVICE_NO_DAEMON", "1")
+    assert not daemon_client.should_forward(namespace("status", watch=None))
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["status", "--watch"],
+        ["status", "--watch=2"],
+        ["status", "-w2"],
+        ["status", "-w", "2"],
+        ["status", "--wat", "2"],
+        ["status", "--changes-only"],
+        ["status", "--chang"],
+        ["stop", "x", "--wait"],
+        ["stop", "x", "--wai"],
+        ["logs", "x", "--watch"],
+        ["logs", "x", "--wa"],
+        ["wait", "x"],
+        ["top"],
+    ],
+)
+def test_parsed_forms_run_in_client(argv, monkeypatch):
+    # the real parser needs the CLI dependencies
+    pytest.importorskip("zono")
+    monkeypatch.delenv("SERVICE_NO_DAEMON", raising=False)
+    import main
+
+    opts, _ = main.parse_args(argv)
+    assert not daemon_client.should_forward(opts)
+
+
+@pytest.mark.parametrize("argv", [["status"], ["status", "--json"], ["stop", "x"]])
+def test_other_commands_are_forwarded(argv, monkeypatch):
+    pytest.importorskip("zono")
+    monkeypatch.delenv("SERVICE_NO_DAEMON", raising=False)
+    import main
+
+    opts, _ = main.parse_args(argv)
+    assert daemon_client.should_forward(opts)
+
+
+def test_frames_round_trip():
+    left, right = socket.socketpair()
+    with left, right:
+        stream = daemon_client.frame_stream(left, daemon_client.STDERR)
+        stream.write("héllo\n")
+        daemon_client.send_frame(left, daemon_client.EXIT, struct.pack("!i", 3))
+
+        channel, size = daemon_client.FRAME.unpack(
+            daemon_client.recv_exact(right, daemon_client.FRAME.size)
+        )
+        assert channel == daemon_client.STDERR
+        assert daemon_client.recv_exact(right, size) == "héllo\n".encode()
+        channel, size = daemon_client.FRAME.unpack(
+            daemon_client.recv_exact(right, daemon_client.FRAME.size)
+        )
+        assert channel == daemon_client.EXIT
+        assert struct.unpack("!i", daemon_client.recv_exact(right, size)) == (3,)
+        left.close()
+        assert daemon_client.recv_exact(right, 1) is None
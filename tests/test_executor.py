@@ -0,0 +1,109 @@
+import threading
+import executor
+import logging
+import time
+
+
+def make_logger():
+    logger = logging.getLogger(f"test-executor-{time.monotonic_ns()}")
+    logger.propagate = False
+    records = []
+
+    class Collect(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    logger.addHandler(Collect())
+    return logger, records
+
+
+def test_run_concurrently_keeps_order_and_groups_logs():
+    logger, records = make_logger()
+
+    def func(name):
+        logger.error(f"first {name}")
+        time.sleep(0.01)
+        logger.error(f"second {name}")
+        return 0 if name != "b" else 1
+
+    results = executor.run_concurrently(func, ["a", "b", "c"], 3, logger)
+    assert [result.name for result in results] == ["a", "b", "c"]
+    assert [result.state for result in results] == ["ok", "failed", "ok"]
+    # the records of one task are written together, prefixed with its name
+    for name in "abc":
+        index = records.index(f"{name}: first {name}")
+        assert records[index + 1] == f"{name}: second {name}"
+
+
+def test_exceptions_become_failed_results():
+    logger, records = make_logger()
+
+    def func(name):
+        raise RuntimeError("boom")
+
+    (result,) = executor.run_concurrently(func, ["a"], 1, logger)
+    assert result.state == "failed"
+    assert isinstance(result.error, RuntimeError)
+    assert records == ["a: boom"]
+
+
+def test_run_graph_waits_for_dependencies():
+    logger, _ = make_logger()
+    finished = []
+    lock = threading.Lock()
+
+    def func(name):
+        time.sleep(0.01)
+        with lock:
+            finished.append(name)
+        return 0
+
+    after = dict(app=["db", "cache"], worker=["app"])
+    results = executor.run_graph(
+        func, ["worker", "app", "db", "cache"], after, dict(), 4, logger
+    )
+    assert [result.state for result in results] == ["ok"] * 4
+    assert finished.index("app") > max(finished.index("db"), finished.index("cache"))
+    assert finished[-1] == "worker"
+
+
+def test_run_graph_skips_when_a_requirement_failed():
+    logger, _ = make_logger()
+    ran = []
+
+    def func(name):
+        ran.append(name)
+        return 1 if name == "db" else 0
+
+    results = executor.run_graph(
+        func, ["db", "app", "other"], dict(), dict(app=["db"]), 2, logger
+    )
+    assert [result.state for result in results] == ["failed", "failed", "ok"]
+    assert results[1].error == "required service db failed"
+    assert "app" not in ran
+
+
+def test_run_graph_reports_cycles():
+    logger, _ = make_logger()
+    results = executor.run_graph(
+        lambda name: 0, ["a", "b"], dict(a=["b"], b=["a"]), dict(), 2, logger
+    )
+    assert [result.error for result in results] == ["dependency cycle"] * 2
+
+
+def test_run_graph_staggers_launches():
+    logger, _ = make_logger()
+    results = executor.run_graph(
+        lambda name: 0, ["a", "b", "c"], dict(), dict(), 3, logger, stagger=0.05
+    )
+    starts = sorted(result.started for result in results)
+    assert starts[2] - starts[0] >= 0.09
+
+
+def test_in_order_adds_skipped():
+    results = [executor.Result("b", 0)]
+    ordered = executor.in_order(results, ["a"], ["a", "b", "c"])
+    assert [(result.name, result.state) for result in ordered] == [
+        ("a", "skipped"),
+        ("b", "ok"),
+    ]
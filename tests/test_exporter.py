@@ -0,0 +1,128 @@
+import urllib.request
+import urllib.error
+import threading
+import exporter
+import socket
+import pytest
+
+
+FAMILIES = [
+    (
+        "service_restarts_total",
+        "counter",
+        "Restarts",
+        [(dict(service='a"b\\c'), 3)],
+    ),
+    ("service_up", "gauge", "Whether the service runs", [(dict(service="x"), 1)]),
+]
+
+
+def test_escape():
+    assert exporter.escape('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_render_openmetrics():
+    text = exporter.render(FAMILIES)
+    assert text.splitlines() == [
+        "# HELP service_restarts Restarts",
+        "# TYPE service_restarts counter",
+        'service_restarts_total{service="a\\"b\\\\c"} 3',
+        "# HELP service_up Whether the service runs",
+        "# TYPE service_up gauge",
+        'service_up{service="x"} 1',
+        "# EOF",
+    ]
+
+
+def test_render_prometheus():
+    lines = exporter.render(FAMILIES, openmetrics=False).splitlines()
+    assert lines[0] == "# HELP service_restarts_total Restarts"
+    assert lines[-1] == 'service_up{service="x"} 1'
+
+
+def test_parse_address():
+    assert exporter.parse_address("9100") == ("127.0.0.1", 9100)
+    assert exporter.parse_address(":9100") == ("127.0.0.1", 9100)
+    assert exporter.parse_address("0.0.0.0:9100") == ("0.0.0.0", 9100)
+    assert exporter.parse_address("[::1]:9100") == ("::1", 9100)
+    assert exporter.parse_address("[::]:9100") == ("::", 9100)
+    assert exporter.format_url("::1", 9100) == "http://[::1]:9100/metrics"
+    with pytest.raises(ValueError):
+        exporter.parse_address("::1:9100")
+    with pytest.raises(ValueError):
+        exporter.parse_address("localhost:http")
+
+
+def test_state_and_textfile(tmp_path):
+    path = str(tmp_path / "state.json")
+    assert exporter.load_state(path) == dict()
+    exporter.save_state(path, dict(a=dict(restarts=2)))
+    assert exporter.load_state(path) == dict(a=dict(restarts=2))
+    with open(path, "w") as f:
+        f.write("{")
+    assert exporter.load_state(path) == dict()
+
+    textfile = tmp_path / "services.prom"
+    exporter.write_textfile(str(textfile), "service_up 1\n")
+    assert textfile.read_text() == "service_up 1\n"
+    # no temporary files are left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "services.prom",
+        "state.json",
+    ]
+
+
+def test_collector_caches_within_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(exporter.time, "monotonic", lambda: now[0])
+    calls = []
+    collector = exporter.Collector(lambda: calls.append(1) or len(calls), 5)
+    assert collector.get() == 1
+    now[0] += 4
+    assert collector.get() == 1
+    now[0] += 1
+    assert collector.get() == 2
+
+
+def test_server():
+    collector = exporter.Collector(lambda: FAMILIES, 5)
+    server = exporter.create_server(collector, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        request = urllib.request.Request(
+            f"{url}/metrics", headers=dict(Accept="application/openmetrics-text")
+        )
+        with urllib.request.urlopen(request) as response:
+            assert response.headers["Content-Type"].startswith(
+                "application/openmetrics-text"
+            )
+            assert response.read().decode() == exporter.render(FAMILIES)
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/other")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_server_on_ipv6():
+    if not socket.has_ipv6:
+        pytest.skip("no IPv6 support")
+    collector = exporter.Collector(lambda: FAMILIES, 5)
+    try:
+        server = exporter.create_server(collector, "::1", 0)
+    except OSError:
+        pytest.skip("no IPv6 loopback")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = exporter.format_url("::1", server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode().endswith('service_up{service="x"} 1\n')
+    finally:
+        server.shutdown()
+        server.server_close()
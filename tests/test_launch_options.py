@@ -0,0 +1,63 @@
+import launch_options
+import pytest
+
+
+def test_parse_size():
+    assert launch_options.parse_size("512M") == 512 * 1024**2
+    assert launch_options.parse_size("1.5kb") == 1536
+    assert launch_options.parse_size("2G") == 2 * 1024**3
+    assert launch_options.parse_size("100") == 100
+    assert launch_options.parse_size(100) == 100
+    with pytest.raises(ValueError):
+        launch_options.parse_size("lots")
+
+
+def test_validate():
+    options = launch_options.validate(
+        dict(
+            process_type="Background",
+            nice=10,
+            soft_limits=dict(open_files=1024, resident_set="512M"),
+            hard_limits=dict(open_files=4096),
+        )
+    )
+    assert options["soft_limits"] == dict(open_files=1024, resident_set=512 * 1024**2)
+    for options in (
+        [],
+        dict(unknown=1),
+        dict(process_type="Fast"),
+        dict(low_priority_io=1),
+        dict(nice=21),
+        dict(nice=True),
+        dict(throttle_interval=-1),
+        dict(soft_limits=dict(open_files=-1)),
+        dict(soft_limits=dict(open_files="1K")),
+        dict(soft_limits=dict(stack="big")),
+        dict(hard_limits=dict(threads=1)),
+        dict(soft_limits=dict(open_files=10), hard_limits=dict(open_files=5)),
+    ):
+        with pytest.raises(ValueError):
+            launch_options.validate(options)
+
+
+def test_plist_keys():
+    keys = launch_options.plist_keys(
+        dict(low_priority_io=True, hard_limits=dict(open_files=10, core=0))
+    )
+    assert keys == dict(
+        LowPriorityIO=True, HardResourceLimits=dict(NumberOfFiles=10, Core=0)
+    )
+
+
+def test_apply_sets_and_clears_keys():
+    data = dict(Label="app", Nice=5, ThrottleInterval=10)
+    assert launch_options.apply(data, dict(nice=5, process_type="Standard"))
+    assert data == dict(Label="app", Nice=5, ProcessType="Standard")
+    assert not launch_options.apply(data, dict(nice=5, process_type="Standard"))
+    assert launch_options.apply(data, dict())
+    assert data == dict(Label="app")
+
+
+def test_describe():
+    rows = launch_options.describe(dict(nice=1, soft_limits=dict(open_files=8)))
+    assert rows == [("nice", 1), ("soft_limits.open_files", 8)]
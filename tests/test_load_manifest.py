@@ -0,0 +1,54 @@
+import pytest
+import json
+import os
+
+# main.py needs the CLI dependencies
+pytest.importorskip("zono")
+import main  # noqa: E402
+
+
+def write_manifest(tmp_path, manifest):
+    path = tmp_path / "services.json"
+    path.write_text(json.dumps(manifest))
+    return str(path)
+
+
+def test_manifest_list_of_files_and_objects(tmp_path):
+    path = write_manifest(
+        tmp_path, ["a/main.py", {"file": "b/main.py", "name": "bee", "startup": True}]
+    )
+    assert main.expand_targets(path) == [
+        dict(path=os.path.join(tmp_path, "a/main.py")),
+        dict(path=os.path.join(tmp_path, "b/main.py"), name="bee", startup=True),
+    ]
+
+
+def test_manifest_mapping_names_every_entry(tmp_path):
+    path = write_manifest(
+        tmp_path, {"a": "a/main.py", "b": {"path": "b/main.py", "name": "other"}}
+    )
+    assert main.expand_targets(path) == [
+        dict(path=os.path.join(tmp_path, "a/main.py"), name="a"),
+        dict(path=os.path.join(tmp_path, "b/main.py"), name="b"),
+    ]
+
+
+def test_broken_manifest_entries_fail_on_their_own(tmp_path):
+    path = write_manifest(tmp_path, [{"name": "nofile"}, 5, "a/main.py"])
+    broken, number, entry = main.expand_targets(path)
+    assert broken["error"] == number["error"] == "A manifest entry needs a file"
+    assert broken["name"] == "nofile"
+    assert entry == dict(path=os.path.join(tmp_path, "a/main.py"))
+
+    path = write_manifest(tmp_path, "a/main.py")
+    (entry,) = main.expand_targets(path)
+    assert "error" in entry
+
+
+def test_plan_load_checks_the_restart_policy(tmp_path):
+    script = tmp_path / "main.py"
+    script.write_text("pass\n")
+    name, service_info, plist = main.plan_load(str(script), "app", "on-failure")
+    assert service_info["restart"] == dict(policy="on-failure")
+    with pytest.raises(ValueError, match="Invalid restart policy sometimes"):
+        main.plan_load(str(script), "app", "sometimes")
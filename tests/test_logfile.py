@@ -0,0 +1,89 @@
+import logfile
+import gzip
+import json
+import io
+
+
+def write_lines(path, count, start=0):
+    with open(path, "ab") as f:
+        for number in range(start, start + count):
+            f.write(f"line {number}\n".encode())
+
+
+def read_log(path, **kwargs):
+    out = io.BytesIO()
+    logfile.write_log(str(path), out, **kwargs)
+    return out.getvalue().decode().splitlines()
+
+
+def test_tail_and_head_offsets(tmp_path, monkeypatch):
+    # a small chunk size makes the search cross chunk boundaries
+    monkeypatch.setattr(logfile, "CHUNK_SIZE", 7)
+    path = tmp_path / "log"
+    write_lines(path, 20)
+    with open(path, "rb") as f:
+        f.seek(logfile.tail_offset(f, 3))
+        assert f.read().decode().splitlines() == ["line 17", "line 18", "line 19"]
+        end = logfile.head_offset(f, 2)
+        f.seek(0)
+        assert f.read(end) == b"line 0\nline 1\n"
+        assert logfile.tail_offset(f, 100) == 0
+        assert logfile.tail_offset(f, 0) == path.stat().st_size
+
+
+def test_tail_without_trailing_newline(tmp_path):
+    path = tmp_path / "log"
+    path.write_bytes(b"a\nb\nc")
+    assert read_log(path, tail=2) == ["b", "c"]
+
+
+def test_start_offset(tmp_path):
+    path = tmp_path / "log"
+    write_lines(path, 5)
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        assert logfile.start_offset(f) == size
+        assert logfile.start_offset(f, since_bytes=7) == size - 7
+        assert logfile.start_offset(f, since_bytes=10**6) == 0
+
+
+def test_write_log_head_tail_and_json(tmp_path):
+    path = tmp_path / "log"
+    write_lines(path, 10)
+    assert read_log(path) == [f"line {n}" for n in range(10)]
+    assert read_log(path, head=2) == ["line 0", "line 1"]
+    assert read_log(path, tail=2) == ["line 8", "line 9"]
+    assert [json.loads(line) for line in read_log(path, tail=1, as_json=True)] == [
+        "line 9"
+    ]
+
+
+def test_archives_are_read_in_order(tmp_path):
+    path = tmp_path / "stdout"
+    with gzip.open(tmp_path / "stdout.20240101-000000.gz", "wb") as f:
+        f.write(b"line 0\nline 1\n")
+    (tmp_path / "stdout.20240102-000000").write_bytes(b"line 2\n")
+    (tmp_path / "stdout.unrelated").write_bytes(b"ignored\n")
+    write_lines(path, 2, start=3)
+
+    archives = logfile.list_archives(str(path))
+    assert [a.rsplit("/", 1)[1] for a in archives] == [
+        "stdout.20240101-000000.gz",
+        "stdout.20240102-000000",
+    ]
+    expected = [f"line {n}" for n in range(5)]
+    assert read_log(path, archives=archives) == expected
+    assert read_log(path, head=3, archives=archives) == expected[:3]
+    # the tail reaches back into the archives when the log is too short
+    assert read_log(path, tail=4, archives=archives) == expected[1:]
+    assert read_log(path, tail=4, as_json=True, archives=archives) == [
+        json.dumps(line) for line in expected[1:]
+    ]
+
+
+def test_count_lines(tmp_path):
+    path = tmp_path / "log"
+    path.write_bytes(b"a\nb\nc")
+    with open(path, "rb") as f:
+        assert logfile.count_lines(f, 5) == 3
+        assert logfile.count_lines(f, 4) == 2
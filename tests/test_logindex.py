@@ -0,0 +1,84 @@
+import datetime
+import logindex
+import re
+
+
+def timestamp(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def test_line_timestamp():
+    assert logindex.line_timestamp(b"2024-05-01 10:00:00 started\n") == timestamp(
+        "2024-05-01T10:00:00"
+    )
+    assert logindex.line_timestamp(b"[2024-05-01T10:00:00.5Z] x") == timestamp(
+        "2024-05-01T10:00:00.500000+00:00"
+    )
+    assert logindex.line_timestamp(b"2024-05-01T10:00:00+02:00 x") == timestamp(
+        "2024-05-01T10:00:00+02:00"
+    )
+    assert logindex.line_timestamp(b"no time here") is None
+    assert logindex.line_timestamp(b"2024-13-01 10:00:00 bad month") is None
+
+
+def test_parse_time():
+    assert logindex.parse_time("90s", now=1000.0) == 910.0
+    assert logindex.parse_time("2h", now=10000.0) == 2800.0
+    assert logindex.parse_time("1700000000") == 1700000000.0
+    assert logindex.parse_time("2024-05-01T10:00:00") == timestamp(
+        "2024-05-01T10:00:00"
+    )
+
+
+def write_log(path, start, count):
+    with open(path, "ab") as f:
+        for minute in range(start, start + count):
+            f.write(f"2024-05-01 10:{minute:02d}:00 event {minute}\n".encode())
+            f.write(b"  continuation without a timestamp\n")
+
+
+def events(lines):
+    return [line.split()[3].decode() for line in lines if b"event" in line]
+
+
+def test_search_by_time_and_pattern(tmp_path, monkeypatch):
+    monkeypatch.setattr(logindex, "INDEX_STRIDE", 64)
+    path = str(tmp_path / "stdout")
+    write_log(path, 0, 30)
+    since = timestamp("2024-05-01T10:10:00")
+    until = timestamp("2024-05-01T10:12:00")
+    lines = list(logindex.search(path, since=since, until=until))
+    assert events(lines) == ["10", "11", "12"]
+    # lines without a timestamp belong to the line before them
+    assert len(lines) == 6
+
+    lines = logindex.search(path, pattern=re.compile(rb"event 2\d"))
+    assert events(lines) == [str(minute) for minute in range(20, 30)]
+
+
+def test_index_is_saved_and_extended(tmp_path, monkeypatch):
+    monkeypatch.setattr(logindex, "INDEX_STRIDE", 64)
+    path = str(tmp_path / "stdout")
+    write_log(path, 0, 10)
+    index = logindex.LogIndex(path)
+    index.update()
+    end = index.end
+    assert logindex.LogIndex(path).end == end
+
+    write_log(path, 10, 5)
+    index = logindex.LogIndex(path)
+    index.update()
+    assert index.end > end
+    assert index.last_ts == timestamp("2024-05-01T10:14:00")
+
+
+def test_truncated_log_is_indexed_again(tmp_path):
+    path = str(tmp_path / "stdout")
+    write_log(path, 0, 10)
+    logindex.LogIndex(path).update()
+    open(path, "w").close()
+    write_log(path, 30, 1)
+    index = logindex.LogIndex(path)
+    index.update()
+    assert index.first_ts == timestamp("2024-05-01T10:30:00")
+    assert events(logindex.search(path)) == ["30"]
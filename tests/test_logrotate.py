@@ -0,0 +1,84 @@
+import logrotate
+import logfile
+import gzip
+import time
+import os
+
+
+def test_should_rotate(tmp_path):
+    path = str(tmp_path / "stdout")
+    assert not logrotate.should_rotate(path, max_bytes=1)
+    open(path, "w").close()
+    assert not logrotate.should_rotate(path, max_bytes=1)
+    with open(path, "w") as f:
+        f.write("12345")
+    assert logrotate.should_rotate(path, max_bytes=5)
+    assert not logrotate.should_rotate(path, max_bytes=6)
+
+    # the first check starts the age from now
+    assert not logrotate.should_rotate(path, max_age=60)
+    assert logrotate.should_rotate(path, max_age=60, now=time.time() + 61)
+
+
+def test_rotate_copies_and_truncates(tmp_path):
+    path = str(tmp_path / "stdout")
+    with open(path, "w") as f:
+        f.write("line 1\nline 2\n")
+    archive = logrotate.rotate(path, "gzip", keep=5)
+    assert archive.endswith(".gz")
+    assert os.path.getsize(path) == 0
+    with gzip.open(archive, "rb") as f:
+        assert f.read() == b"line 1\nline 2\n"
+    assert logfile.list_archives(path) == [archive]
+    assert os.path.exists(logrotate.state_path(path))
+
+
+def test_archive_names_do_not_collide(tmp_path):
+    path = str(tmp_path / "stdout")
+    first = logrotate.archive_path(path, "none", now=0)
+    open(first, "w").close()
+    second = logrotate.archive_path(path, "none", now=0)
+    assert second == first + "-1"
+
+
+def test_prune_keeps_the_newest(tmp_path):
+    path = str(tmp_path / "stdout")
+    for day in range(1, 5):
+        open(f"{path}.2024010{day}-000000.gz", "w").close()
+    logrotate.prune(path, keep=2)
+    assert [os.path.basename(a) for a in logfile.list_archives(path)] == [
+        "stdout.20240103-000000.gz",
+        "stdout.20240104-000000.gz",
+    ]
+
+
+def test_archives_of_the_same_second_stay_in_order(tmp_path):
+    path = str(tmp_path / "stdout")
+    for text in ("first\n", "second\n", "third\n"):
+        with open(path, "w") as f:
+            f.write(text)
+        logrotate.rotate(path, "gzip", keep=5)
+    contents = []
+    for archive in logfile.list_archives(path):
+        with gzip.open(archive, "rb") as f:
+            contents.append(f.read())
+    assert contents == [b"first\n", b"second\n", b"third\n"]
+
+    logrotate.prune(path, keep=1)
+    (archive,) = logfile.list_archives(path)
+    with gzip.open(archive, "rb") as f:
+        assert f.read() == b"third\n"
+
+
+def test_empty_log_is_not_rotated(tmp_path):
+    path = str(tmp_path / "stdout")
+    assert logrotate.rotate(path) is None
+    open(path, "w").close()
+    assert logrotate.rotate(path) is None
+    assert logfile.list_archives(path) == []
+
+
+def test_last_rotation_does_not_create_the_state(tmp_path):
+    path = str(tmp_path / "stdout")
+    assert logrotate.last_rotation(path) is None
+    assert not os.path.exists(logrotate.state_path(path))
@@ -0,0 +1,67 @@
+import on_demand
+import pytest
+
+
+def test_parse_socket():
+    assert on_demand.parse_socket("8080") == dict(
+        SockServiceName="8080", SockType="stream"
+    )
+    assert on_demand.parse_socket("127.0.0.1:8080") == dict(
+        SockServiceName="8080", SockType="stream", SockNodeName="127.0.0.1"
+    )
+    assert on_demand.parse_socket("[::1]:8080")["SockNodeName"] == "::1"
+    assert on_demand.parse_socket("/tmp/app.sock") == dict(
+        SockPathName="/tmp/app.sock"
+    )
+    for spec in ("localhost", "localhost:0", "localhost:65536", "app.sock"):
+        with pytest.raises(ValueError):
+            on_demand.parse_socket(spec)
+
+
+def test_validate():
+    options = dict(sockets=["8080"], idle_timeout=300)
+    assert on_demand.validate(options) == options
+    assert on_demand.validate(dict()) == dict()
+    for options in (
+        [],
+        dict(sockets="8080"),
+        dict(sockets=["nope"]),
+        dict(watch_paths=["relative/path"]),
+        dict(path_state={"/tmp/flag": "yes"}),
+        dict(watch_paths=["/tmp"], idle_timeout=True),
+        dict(watch_paths=["/tmp"], idle_timeout=-1),
+        dict(idle_timeout=300),
+        dict(unknown=1),
+    ):
+        with pytest.raises(ValueError):
+            on_demand.validate(options)
+
+
+def test_plist_keys():
+    keys = on_demand.plist_keys(
+        dict(sockets=["8080"], watch_paths=["/tmp/a"], path_state={"/tmp/b": True})
+    )
+    assert keys == dict(
+        Sockets=dict(Listeners=[dict(SockServiceName="8080", SockType="stream")]),
+        WatchPaths=["/tmp/a"],
+        KeepAlive=dict(PathState={"/tmp/b": True}),
+        RunAtLoad=False,
+    )
+    assert on_demand.plist_keys(dict()) == dict(RunAtLoad=True)
+
+
+def test_apply_sets_and_clears_keys():
+    data = dict(Label="app", RunAtLoad=True, KeepAlive=True)
+    assert on_demand.apply(data, dict(queue_directories=["/tmp/q"]))
+    assert data == dict(Label="app", RunAtLoad=False, QueueDirectories=["/tmp/q"])
+    assert not on_demand.apply(data, dict(queue_directories=["/tmp/q"]))
+    assert on_demand.apply(data, dict())
+    assert data == dict(Label="app", RunAtLoad=True)
+
+
+def test_is_on_demand():
+    assert on_demand.is_on_demand(dict(WatchPaths=["/tmp"]))
+    assert on_demand.is_on_demand(dict(KeepAlive=dict(PathState={"/tmp/a": True})))
+    assert not on_demand.is_on_demand(dict(KeepAlive=True))
+    assert not on_demand.is_on_demand(dict(WatchPaths=["/tmp"], RunAtLoad=True))
+    assert not on_demand.is_on_demand(dict())
@@ -0,0 +1,68 @@
+import subprocess
+import procstats
+import time
+import sys
+import os
+
+
+def test_process_tree():
+    table = {1: dict(), 2: dict(), 3: dict(), 5: dict()}
+    children = {1: [2, 4], 2: [3], 5: [6]}
+    assert procstats.process_tree(table, children, 1) == [1, 2, 3]
+    assert procstats.process_tree(table, children, 5) == [5]
+
+
+def test_read_totals_includes_children():
+    child = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import subprocess, sys, time; "
+            "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(5)']); "
+            "time.sleep(5)",
+        ]
+    )
+    try:
+        # waits for the grandchild to start
+        for _ in range(100):
+            table = procstats.read_processes()
+            if any(proc["ppid"] == child.pid for proc in table.values()):
+                break
+            time.sleep(0.05)
+        totals = procstats.read_totals([child.pid, os.getpid(), -1], fds=True)
+        assert set(totals) == {child.pid, os.getpid()}
+        own = procstats.read_totals([child.pid])[child.pid]
+        assert own["fds"] is None
+        assert own["rss"] > 0
+        # the grandchild adds to the rss of the child
+        assert own["rss"] > table[child.pid]["rss"]
+        assert totals[os.getpid()]["fds"] > 0
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_sampler():
+    sampler = procstats.Sampler()
+    first = sampler.sample([os.getpid()])[os.getpid()]
+    assert first["cpu_percent"] is None
+    assert first["processes"] >= 1
+    second = sampler.sample([os.getpid()])[os.getpid()]
+    assert second["cpu_percent"] >= 0
+    assert set(second) == set(procstats.FIELDS)
+
+
+def test_parse_duration():
+    assert procstats.parse_duration("01:02") == 62
+    assert procstats.parse_duration("01:00:00.50") == 3600.5
+    assert procstats.parse_duration("2-00:00:01") == 2 * 86400 + 1
+
+
+def test_formatting():
+    assert procstats.format_bytes(None) == "None"
+    assert procstats.format_bytes(512) == "512B"
+    assert procstats.format_bytes(1536) == "1.5K"
+    assert procstats.format_bytes(3 * 1024**4) == "3.0T"
+    assert procstats.format_uptime(59) == "00:00:59"
+    assert procstats.format_uptime(90061) == "1d 01:01:01"
+    assert procstats.format_metrics(None) == ["None"] * len(procstats.FIELDS)
@@ -0,0 +1,113 @@
+import registry
+import tracing
+import pytest
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def services(request, tmp_path):
+    reg = registry.open_registry(
+        request.param, str(tmp_path / "services.json"), str(tmp_path / "services.db")
+    )
+    yield reg
+    if request.param == "sqlite":
+        reg.conn.close()
+
+
+def test_get_update_delete(services):
+    assert services.get("web") is None
+    services.update("web", dict(mainfile="/srv/web/main.py", startup=True))
+    assert services.get("web") == dict(mainfile="/srv/web/main.py", startup=True)
+    assert "web" in services
+    assert services.delete("web") == dict(mainfile="/srv/web/main.py", startup=True)
+    assert services.get("web") is None
+    assert "web" not in services
+    assert services.delete("web") is None
+
+
+def test_get_while_tracing(services):
+    services.update("web", dict(mainfile="/srv/web/main.py"))
+    tracing.enable()
+    try:
+        assert services.get("web") == dict(mainfile="/srv/web/main.py")
+    finally:
+        spans = tracing.disable()
+    assert any(name == "registry read" for name, *_ in spans)
+
+
+def test_transaction_keeps_order_and_removes(services):
+    with services.transaction() as current:
+        current["b"] = dict(mainfile="/b")
+        current["a"] = dict(mainfile="/a")
+    with services.transaction() as current:
+        del current["b"]
+        current["c"] = dict(mainfile="/c")
+    assert list(services.all()) == ["a", "c"]
+
+
+def test_failed_transaction_is_not_written(services):
+    services.update("a", dict(mainfile="/a"))
+    with pytest.raises(RuntimeError):
+        with services.transaction() as current:
+            current["b"] = dict(mainfile="/b")
+            raise RuntimeError
+    assert list(services.all()) == ["a"]
+
+
+def test_all_returns_copies(services):
+    services.update("a", dict(mainfile="/a"))
+    services.all()["a"]["mainfile"] = "/changed"
+    assert services.get("a") == dict(mainfile="/a")
+
+
+def test_json_parse_error(tmp_path):
+    path = tmp_path / "services.json"
+    path.write_text("{")
+    with pytest.raises(registry.RegistryError):
+        registry.JsonRegistry(str(path)).all()
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(registry.RegistryError):
+        registry.open_registry("yaml", str(tmp_path / "a"), str(tmp_path / "b"))
+
+
+def test_sqlite_imports_json_once(tmp_path):
+    json_path = tmp_path / "services.json"
+    db_path = str(tmp_path / "services.db")
+    registry.JsonRegistry(str(json_path)).update("web", dict(mainfile="/web"))
+
+    services = registry.SqliteRegistry(db_path, import_from=str(json_path))
+    assert services.get("web") == dict(mainfile="/web")
+    with services.transaction() as current:
+        del current["web"]
+    services.conn.close()
+
+    # the last service was removed, the stale services.json is not read again
+    services = registry.SqliteRegistry(db_path, import_from=str(json_path))
+    assert services.all() == dict()
+    services.conn.close()
+
+
+def test_sqlite_without_json_is_marked_imported(tmp_path):
+    json_path = tmp_path / "services.json"
+    db_path = str(tmp_path / "services.db")
+    registry.SqliteRegistry(db_path, import_from=str(json_path)).conn.close()
+    registry.JsonRegistry(str(json_path)).update("web", dict(mainfile="/web"))
+    services = registry.SqliteRegistry(db_path, import_from=str(json_path))
+    assert services.all() == dict()
+    services.conn.close()
+
+
+def test_atomic_write_text_and_bytes(tmp_path):
+    path = tmp_path / "file"
+    registry.atomic_write(str(path), "text")
+    assert path.read_text() == "text"
+    registry.atomic_write(str(path), b"\x00bytes", sync=True)
+    assert path.read_bytes() == b"\x00bytes"
+    assert [item.name for item in tmp_path.iterdir()] == ["file"]
+
+
+def test_atomic_write_leaves_no_temporary_file(tmp_path):
+    with pytest.raises(TypeError):
+        registry.atomic_write(str(tmp_path / "file"), 1)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,62 @@
+import service_index
+import plistlib
+
+
+def write_plist(path, label):
+    with open(path, "wb") as f:
+        plistlib.dump(dict(Label=label), f)
+
+
+def test_lookup_reads_the_plist_once(tmp_path):
+    config = str(tmp_path / "web.plist")
+    write_plist(config, "com.example.web")
+    index = service_index.ServiceIndex(str(tmp_path / "index"))
+    entry = index.lookup("web", config, "com.example", "gui/501", "/srv/web/main.py")
+    assert entry["label"] == "com.example.web"
+    assert entry["target"] == "gui/501/com.example.web"
+    assert entry["config_file"] == config
+    assert entry["output_file"] == "/srv/web/.output/stdout"
+
+    # the cached entry is used while the plist is unchanged
+    assert index.lookup("web", config, "com.example", "gui/501") is entry
+    # and dropped when the launchd domain changed
+    assert index.lookup("web", config, "com.example", "user/501") is not entry
+
+
+def test_changed_plist_is_read_again(tmp_path):
+    config = str(tmp_path / "web.plist")
+    write_plist(config, "com.example.web")
+    index = service_index.ServiceIndex(str(tmp_path / "index"))
+    index.lookup("web", config, "com.example", "gui/501", "/srv/web/main.py")
+    write_plist(config, "com.example.renamed-web")
+    entry = index.lookup("web", config, "com.example", "gui/501")
+    assert entry["label"] == "com.example.renamed-web"
+    # the mainfile is kept from the earlier lookup
+    assert entry["mainfile"] == "/srv/web/main.py"
+
+
+def test_missing_plist_uses_the_domain(tmp_path):
+    index = service_index.ServiceIndex(str(tmp_path / "index"))
+    entry = index.lookup("web", str(tmp_path / "web.plist"), "com.example", "gui/501")
+    assert entry["label"] == "com.example.web"
+    assert entry["config_file"] is None
+    assert entry["output_file"] is None
+
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / ".services" / "index")
+    index = service_index.ServiceIndex(path)
+    entry = index.lookup("web", str(tmp_path / "missing"), "com.example", "gui/501")
+    index.save()
+    assert not index.dirty
+    assert service_index.ServiceIndex(path).entries == dict(web=entry)
+
+    index.discard("web")
+    index.save()
+    assert service_index.ServiceIndex(path).entries == dict()
+
+
+def test_corrupt_index_is_ignored(tmp_path):
+    path = tmp_path / "index"
+    path.write_text("{")
+    assert service_index.ServiceIndex(str(path)).entries == dict()
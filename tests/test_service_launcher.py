@@ -0,0 +1,81 @@
+import service_launcher
+import pytest
+import shutil
+import sys
+import os
+
+
+def write_program(path, text, mode=0o644):
+    path.write_text(text)
+    path.chmod(mode)
+    return str(path)
+
+
+def test_read_shebang(tmp_path):
+    program = write_program(tmp_path / "a", "#!/usr/bin/env python3 -u\nprint()\n")
+    assert service_launcher.read_shebang(program) == ["/usr/bin/env", "python3", "-u"]
+    program = write_program(tmp_path / "b", "print()\n")
+    assert service_launcher.read_shebang(program) is None
+
+
+def test_resolve_command(tmp_path):
+    path = os.path.dirname(shutil.which("sh"))
+    program = write_program(tmp_path / "run", "#!/usr/bin/env sh\necho\n")
+    assert service_launcher.resolve_command(program, path) == [
+        shutil.which("sh", path=path),
+        program,
+    ]
+    program = write_program(tmp_path / "run", "#!/bin/sh -e\necho\n")
+    assert service_launcher.resolve_command(program, path) == ["/bin/sh", "-e", program]
+
+    program = write_program(tmp_path / "main.py", "print()\n")
+    assert service_launcher.resolve_command(program, path) == [sys.executable, program]
+    program = write_program(tmp_path / "job.sh", "echo\n")
+    assert service_launcher.resolve_command(program, path)[1:] == [program]
+
+    program = write_program(tmp_path / "binary", "", mode=0o755)
+    assert service_launcher.resolve_command(program, path) == [program]
+    program = write_program(tmp_path / "data.txt", "")
+    with pytest.raises(RuntimeError):
+        service_launcher.resolve_command(program, path)
+    program = write_program(tmp_path / "app.rb", "#!/usr/bin/env no-such-ruby\n")
+    with pytest.raises(RuntimeError):
+        service_launcher.resolve_command(program, path)
+
+
+def test_command_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(service_launcher, "get_file", lambda name: str(tmp_path / name))
+    os.makedirs(tmp_path / ".services")
+    cache_path = str(tmp_path / ".services" / "launcher.json")
+    program = write_program(tmp_path / "main.py", "print()\n")
+
+    calls = []
+    resolve = service_launcher.resolve_command
+
+    def counting(*args):
+        calls.append(args)
+        return resolve(*args)
+
+    monkeypatch.setattr(service_launcher, "resolve_command", counting)
+    command = service_launcher.get_command(program, "/bin")
+    assert service_launcher.get_command(program, "/bin") == command
+    assert len(calls) == 1
+    assert service_launcher.load_cache(cache_path)["programs"][program]["command"] == (
+        command
+    )
+
+    # a different PATH or a changed program is resolved again
+    service_launcher.get_command(program, "/usr/bin")
+    write_program(tmp_path / "main.py", "#!/bin/sh\n")
+    assert service_launcher.get_command(program, "/usr/bin") == ["/bin/sh", program]
+    assert len(calls) == 3
+
+
+def test_load_cache_ignores_other_versions(tmp_path):
+    cache_path = str(tmp_path / "launcher.json")
+    empty = dict(version=service_launcher.CACHE_VERSION, programs={})
+    assert service_launcher.load_cache(cache_path) == empty
+    (tmp_path / "launcher.json").write_text('{"version": 0, "programs": {"a": 1}}')
+    assert service_launcher.load_cache(cache_path) == empty
+    (tmp_path / "launcher.json").write_text("{")
+    assert service_launcher.load_cache(cache_path) == empty
@@ -0,0 +1,53 @@
+import argparse
+import pytest
+
+# main.py needs the CLI dependencies
+pytest.importorskip("zono")
+import main  # noqa: E402
+
+
+def test_split_filters():
+    filters = [("status", ["running"]), ("name", ["web-*"]), ("startup", ["true"])]
+    assert main.split_filters(filters) == (
+        [("name", ["web-*"]), ("startup", ["true"])],
+        [("status", ["running"])],
+    )
+
+
+def test_registry_filters_do_not_need_a_status():
+    registry_filters, _ = main.split_filters([("name", ["web-*"])])
+    assert main.service_matches("web-1", dict(), None, registry_filters)
+    assert not main.service_matches("db", dict(), None, registry_filters)
+
+
+def test_status_filters():
+    filters = [("status", ["running", "missing"])]
+    assert main.service_matches("web", dict(), True, filters)
+    assert main.service_matches("web", dict(), None, filters)
+    assert not main.service_matches("web", dict(), False, filters)
+
+
+def test_idle_on_demand_service():
+    service_info = dict(on_demand=dict(sockets=["8080"]))
+    assert main.service_matches("web", service_info, False, [("status", ["idle"])])
+    assert not main.service_matches(
+        "web", service_info, False, [("status", ["stopped"])]
+    )
+
+
+def test_startup_filter():
+    filters = [("startup", ["false"])]
+    assert main.service_matches("web", dict(), None, filters)
+    assert not main.service_matches("web", dict(startup=True), None, filters)
+
+
+def test_filter_help_lists_every_choice():
+    assert main.join_choices(["a"]) == "a"
+    assert main.join_choices(["a", "b", "c"]) == "a, b or c"
+    subparsers = argparse.ArgumentParser().add_subparsers()
+    main.create_status_parser(subparsers)
+    text = " ".join(subparsers.choices["status"].format_help().split())
+    for key, choices in main.STATUS_FILTERS.items():
+        assert key in text
+        for choice in choices or []:
+            assert choice in text
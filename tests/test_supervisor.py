@@ -0,0 +1,113 @@
+import supervisor
+import pytest
+
+
+def policy(name="always", **overrides):
+    return dict(
+        dict(
+            policy=name,
+            backoff=1.0,
+            max_backoff=300.0,
+            jitter=0.0,
+            max_failures=3,
+            window=600.0,
+            max_rate=100,
+        ),
+        **overrides,
+    )
+
+
+def run_exits(rules, retcode, exits):
+    # the service exits right after every restart, returns the last action
+    state = supervisor.new_state()
+    now = 1000.0
+    action = None
+    for _ in range(exits):
+        action = supervisor.plan(rules, state, False, retcode, now)
+        if action is None and state["next_restart"] is not None:
+            now = state["next_restart"]
+            action = supervisor.plan(rules, state, False, retcode, now)
+        if action == "park":
+            break
+        now += 1
+    return action, state
+
+
+def test_never_does_nothing():
+    state = supervisor.new_state()
+    assert supervisor.plan(policy("never"), state, False, 1, 0.0) is None
+
+
+def test_on_failure_ignores_clean_exit():
+    state = supervisor.new_state()
+    assert supervisor.plan(policy("on-failure"), state, False, 0, 0.0) is None
+    assert state["failures"] == []
+
+
+def test_unknown_exit_is_not_a_failure():
+    state = supervisor.new_state()
+    assert supervisor.plan(policy("on-failure"), state, False, None, 0.0) is None
+    assert state["next_restart"] is None
+    action, state = run_exits(policy(), None, 10)
+    assert action == "restart"
+    assert not state["parked"]
+    assert state["failures"] == []
+
+
+def test_backoff_before_restart():
+    state = supervisor.new_state()
+    assert supervisor.plan(policy(), state, False, 1, 100.0) is None
+    assert state["next_restart"] == 101.0
+    assert supervisor.plan(policy(), state, False, 1, 100.5) is None
+    assert supervisor.plan(policy(), state, False, 1, 101.0) == "restart"
+    assert state["attempts"] == 1
+    # the second wait is twice as long
+    supervisor.plan(policy(), state, False, 1, 110.0)
+    assert state["next_restart"] == 112.0
+
+
+def test_failures_park_the_service():
+    action, state = run_exits(policy(), 1, 10)
+    assert action == "park"
+    assert state["parked"]
+    assert len(state["failures"]) == 3
+    assert supervisor.plan(policy(), state, False, 1, 1e9) is None
+
+
+def test_always_does_not_park_clean_exits():
+    action, state = run_exits(policy(), 0, 10)
+    assert action == "restart"
+    assert not state["parked"]
+    assert state["failures"] == []
+    assert state["restarts_total"] == 10
+
+
+def test_held_service_is_not_restarted():
+    state = supervisor.new_state()
+    state["held"] = True
+    assert supervisor.plan(policy(), state, False, 1, 0.0) is None
+
+
+def test_running_for_a_window_resets_attempts():
+    state = supervisor.new_state()
+    state.update(attempts=4, last_restart=0.0)
+    supervisor.plan(policy(), state, True, None, 10.0)
+    assert state["attempts"] == 4
+    supervisor.plan(policy(), state, True, None, 600.0)
+    assert state["attempts"] == 0
+
+
+def test_rate_limit_delays_restarts():
+    rules = policy(backoff=0.0, max_backoff=0.0, max_rate=2, max_failures=100)
+    state = supervisor.new_state()
+    assert supervisor.plan(rules, state, False, 1, 0.0) == "restart"
+    assert supervisor.plan(rules, state, False, 1, 1.0) == "restart"
+    assert supervisor.plan(rules, state, False, 1, 2.0) is None
+    assert state["next_restart"] == pytest.approx(supervisor.RATE_PERIOD)
+
+
+def test_transaction_round_trip(tmp_path):
+    path = str(tmp_path / "state.json")
+    with supervisor.transaction(path) as states:
+        states["web"] = supervisor.new_state()
+    assert supervisor.load_states(path) == dict(web=supervisor.new_state())
@@ -0,0 +1,53 @@
+import tracing
+import json
+import io
+
+
+def test_span_is_free_while_disabled():
+    assert not tracing.enabled()
+    assert tracing.span("read", path="x") is tracing.NULL_SPAN
+    with tracing.span("read") as args:
+        assert args == dict()
+
+
+def test_spans_are_recorded():
+    tracing.enable()
+    try:
+        with tracing.span("registry read", name="app", path="x") as args:
+            args["cached"] = True
+        with tracing.span("registry read"):
+            pass
+    finally:
+        spans = tracing.disable()
+    assert not tracing.enabled()
+    assert [span[0] for span in spans] == ["registry read", "registry read"]
+    assert spans[0][4] == dict(name="app", path="x", cached=True)
+    assert tracing.disable() == []
+
+
+def test_summarize_orders_by_total():
+    spans = [
+        ("a", 0.0, 0.1, 1, dict()),
+        ("b", 0.0, 0.5, 1, dict()),
+        ("a", 0.0, 0.3, 1, dict()),
+    ]
+    assert tracing.summarize(spans) == [("b", 1, 0.5, 0.5), ("a", 2, 0.4, 0.3)]
+    assert tracing.percentile([4, 1, 3, 2], 0.5) == 2
+
+    out = io.StringIO()
+    tracing.write_summary(spans, out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].split() == ["operation", "count", "total", "p95"]
+    assert lines[1].split() == ["b", "1", "500.00ms", "500.00ms"]
+
+
+def test_chrome_trace(tmp_path):
+    path = tmp_path / "trace.json"
+    spans = [("plist read", 1.5, 0.25, 7, dict(path=tmp_path))]
+    tracing.write_chrome_trace(spans, str(path), start=1.0)
+    event = json.loads(path.read_text())["traceEvents"][0]
+    assert event["cat"] == "plist"
+    assert event["ts"] == 500000.0
+    assert event["dur"] == 250000.0
+    assert event["tid"] == 7
+    assert event["args"] == dict(path=str(tmp_path))
@@ -0,0 +1,55 @@
+import subprocess
+import waiter
+import pytest
+import sys
+
+
+def test_wait_returns_exited_pid():
+    exit_waiter = waiter.ExitWaiter()
+    if not exit_waiter.supported():
+        pytest.skip("no kqueue or pidfd support")
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.2)"])
+    try:
+        assert exit_waiter.add(process.pid)
+        assert exit_waiter.add(process.pid)
+        assert exit_waiter.wait(timeout=0.01) == []
+        assert exit_waiter.wait(timeout=10) == [process.pid]
+        assert not exit_waiter.watched
+        # an exited pid is not watched again
+        assert not exit_waiter.add(process.pid)
+    finally:
+        process.wait()
+        exit_waiter.close()
+
+
+def test_add_missing_pid():
+    exit_waiter = waiter.ExitWaiter()
+    if not exit_waiter.supported():
+        pytest.skip("no kqueue or pidfd support")
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    assert not exit_waiter.add(process.pid)
+    assert process.pid in exit_waiter.exited
+    exit_waiter.close()
+
+
+def test_wait_without_pids_sleeps(monkeypatch):
+    exit_waiter = waiter.ExitWaiter()
+    slept = []
+    monkeypatch.setattr(waiter.time, "sleep", slept.append)
+    assert exit_waiter.wait(timeout=0.1) == []
+    assert exit_waiter.wait() == []
+    assert slept == [0.1, waiter.POLL_MAX]
+    exit_waiter.close()
+
+
+def test_reached():
+    assert waiter.reached("running", (True, 1, 0), None, set())
+    assert not waiter.reached("running", (False, None, 0), None, set())
+    assert waiter.reached("stopped", (None, None, None), None, set())
+    assert not waiter.reached("stopped", (True, 1, 0), None, set())
+    # exited waits for the process that ran when the wait started
+    assert waiter.reached("exited", (False, None, 0), None, set())
+    assert not waiter.reached("exited", (True, 1, 0), 1, set())
+    assert waiter.reached("exited", (True, 1, 0), 1, {1})
+    assert waiter.reached("exited", (True, 2, 0), 1, set())
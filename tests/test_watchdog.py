@@ -0,0 +1,86 @@
+import watchdog
+import pytest
+import json
+
+
+def test_validate():
+    rules = watchdog.validate(dict(max_rss="1K", max_cpu_pct=50))
+    assert rules == dict(max_rss=1024, max_cpu_pct=50, cpu_window=60.0, action="warn")
+    assert watchdog.validate(dict()) == dict()
+    for rules in (
+        [],
+        dict(max_rss="huge"),
+        dict(max_rss=0),
+        dict(max_open_files=1.5),
+        dict(max_cpu_pct=True),
+        dict(max_cpu_pct=50, cpu_window=0),
+        dict(max_cpu_pct=50, action="kill"),
+        dict(action="stop"),
+        dict(unknown=1),
+    ):
+        with pytest.raises(ValueError):
+            watchdog.validate(rules)
+
+
+def test_cpu_percent_needs_a_whole_window():
+    assert watchdog.cpu_percent([[0, 0.0], [5, 1.0]], 10) is None
+    assert watchdog.cpu_percent([[0, 0.0], [5, 1.0], [10, 5.0]], 10) == 50.0
+    # the newest sample that is a whole window old is the base
+    assert watchdog.cpu_percent([[0, 0.0], [2, 4.0], [12, 9.0]], 10) == 50.0
+
+
+def test_check_reports_a_limit_once():
+    rules = watchdog.validate(dict(max_rss=100, max_cpu_pct=50, cpu_window=10))
+    state = watchdog.new_state(1)
+    totals = dict(rss=50, cpu=0.0, fds=3)
+    assert watchdog.check(rules, state, totals, now=0) == []
+
+    totals = dict(rss=200, cpu=8.0, fds=3)
+    assert watchdog.check(rules, state, totals, now=10) == [
+        ("max_rss", 200),
+        ("max_cpu_pct", 80.0),
+    ]
+    assert state["over"] == ["max_rss", "max_cpu_pct"]
+
+    totals = dict(rss=300, cpu=9.0, fds=3)
+    assert watchdog.check(rules, state, totals, now=20) == []
+    assert state["over"] == ["max_rss"]
+    # samples older than the base are dropped
+    assert state["samples"] == [[10, 8.0], [20, 9.0]]
+
+    totals = dict(rss=50, cpu=9.0, fds=3)
+    assert watchdog.check(rules, state, totals, now=30) == []
+    totals = dict(rss=200, cpu=9.0, fds=3)
+    assert watchdog.check(rules, state, totals, now=40) == [("max_rss", 200)]
+
+
+def test_audit_rotates_and_reads_both_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(watchdog, "AUDIT_MAX_BYTES", 100)
+    path = str(tmp_path / "watchdog.log")
+    for index in range(6):
+        service = "app" if index % 2 == 0 else "other"
+        watchdog.audit(path, dict(service=service, index=index))
+    with open(path, "a") as f:
+        f.write("not json\n")
+
+    assert (tmp_path / "watchdog.log.1").exists()
+    records = watchdog.read_audit(path, "app", 10)
+    assert [record["index"] for record in records] == [0, 2, 4]
+    assert watchdog.read_audit(path, "app", 2) == records[1:]
+    assert watchdog.read_audit(path, "app", 0) == []
+    assert watchdog.read_audit(str(tmp_path / "missing"), "app", 5) == []
+    with open(f"{path}.1") as f:
+        assert [json.loads(line)["index"] for line in f] == [0, 1, 2, 3]
+
+
+def test_describe_record():
+    record = dict(
+        time=0,
+        limit="max_cpu_pct",
+        value=91.25,
+        max=90,
+        action="restart",
+        result="restarted",
+    )
+    text = watchdog.describe_record(record)
+    assert text.endswith("max_cpu_pct 91.2% > 90.0%, restart (restarted)")
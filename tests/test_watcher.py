@@ -0,0 +1,58 @@
+import watcher
+import io
+
+
+def test_transition():
+    running, stopped = (True, 10, 0), (False, None, 0)
+    assert watcher.transition(running, running) is None
+    assert watcher.transition(None, running) == "added"
+    assert watcher.transition(running, None) == "removed"
+    assert watcher.transition((None, None, None), running) == "started"
+    assert watcher.transition((None, None, None), stopped) == "loaded"
+    assert watcher.transition(running, (None, None, None)) == "unloaded"
+    assert watcher.transition(stopped, running) == "started"
+    assert watcher.transition(running, (False, None, 1)) == "stopped"
+    assert watcher.transition(running, (True, 11, 0)) == "restarted"
+    assert watcher.transition(stopped, (False, None, 1)) == "exited"
+
+
+def test_diff():
+    previous = dict(a=(True, 1, 0), b=(False, None, 0), c=(True, 3, 0))
+    current = dict(a=(True, 1, 0), b=(True, 2, 0), d=(False, None, 0))
+    assert sorted(watcher.diff(previous, current)) == [
+        ("b", "started"),
+        ("c", "removed"),
+        ("d", "added"),
+    ]
+
+
+def test_event_record():
+    record = watcher.event_record("a", "removed", (True, 1, 0), None, 1.23456)
+    assert record == dict(
+        time=1.235,
+        service="a",
+        event="removed",
+        status=None,
+        pid=None,
+        return_code=None,
+        previous=dict(status=True, pid=1, return_code=0),
+    )
+
+
+def test_screen_redraws_changed_lines():
+    out = io.StringIO()
+    screen = watcher.Screen(out)
+    screen.draw(["a", "b"])
+    assert out.getvalue().endswith("\033[H\033[Ja\nb\n")
+
+    out.seek(0)
+    out.truncate()
+    screen.draw(["a", "c"])
+    assert out.getvalue() == "\033[2;1Hc\033[K\033[3;1H"
+
+    out.seek(0)
+    out.truncate()
+    screen.draw(["a"])
+    assert out.getvalue().endswith("\033[H\033[Ja\n")
+    screen.close()
+    assert out.getvalue().endswith("\033[?25h")
@@ -0,0 +1,111 @@
+import threading
+import math
+import time
+import json
+import os
+
+
+_trace = dict(spans=None, start=0.0)
+
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.args
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        spans = _trace["spans"]
+        if spans is not None:
+            spans.append(
+                (self.name, self.start, duration, threading.get_ident(), self.args)
+            )
+
+
+class NullSpan:
+    def __enter__(self):
+        return dict()
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def enable():
+    _trace["spans"] = []
+    _trace["start"] = time.perf_counter()
+
+
+def disable():
+    spans = _trace["spans"] or []
+    _trace["spans"] = None
+    return spans
+
+
+def enabled():
+    return _trace["spans"] is not None
+
+
+def span(name, /, **args):
+    # while tracing is disabled this costs one dict lookup, `name` is
+    # positional only so that a span can also record a name argument
+    if _trace["spans"] is None:
+        return NULL_SPAN
+    return Span(name, args)
+
+
+def percentile(durations, fraction):
+    ordered = sorted(durations)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(spans):
+    operations = dict()
+    for name, _, duration, _, _ in spans:
+        operations.setdefault(name, []).append(duration)
+    return [
+        (name, len(durations), sum(durations), percentile(durations, 0.95))
+        for name, durations in sorted(
+            operations.items(), key=lambda item: sum(item[1]), reverse=True
+        )
+    ]
+
+
+def write_summary(spans, out):
+    width = max([len(name) for name, *_ in spans] + [len("operation")]) + 2
+    out.write(f"{'operation':<{width}}{'count':>7}{'total':>12}{'p95':>12}\n")
+    for name, count, total, p95 in summarize(spans):
+        out.write(
+            f"{name:<{width}}{count:>7}{total * 1000:>10.2f}ms{p95 * 1000:>10.2f}ms\n"
+        )
+    out.flush()
+
+
+def write_chrome_trace(spans, path, start=None):
+    # complete ("X") events in the Chrome trace event format, which can be
+    # loaded in chrome://tracing or Perfetto
+    start = _trace["start"] if start is None else start
+    pid = os.getpid()
+    events = [
+        dict(
+            name=name,
+            cat=name.split()[0],
+            ph="X",
+            ts=round((begin - start) * 1e6, 3),
+            dur=round(duration * 1e6, 3),
+            pid=pid,
+            tid=tid,
+            args=args,
+        )
+        for name, begin, duration, tid, args in spans
+    ]
+    with open(path, "w") as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f, default=str)
@@ -0,0 +1,95 @@
+import select
+import time
+import os
+
+
+# bounds of the adaptive interval used when there is nothing to wait on
+POLL_MIN = 0.05
+POLL_MAX = 1.0
+
+
+class ExitWaiter:
+    # waits for processes to exit with kernel events, kqueue on macOS and
+    # the BSDs and pidfds on Linux. Pids come from a status snapshot, so a
+    # pid that was reused between the snapshot and `add` is watched in
+    # place of the service, callers take a new snapshot after every event
+    def __init__(self):
+        self.kqueue = None
+        self.poll = None
+        if hasattr(select, "kqueue"):
+            self.kqueue = select.kqueue()
+        elif hasattr(os, "pidfd_open") and hasattr(select, "poll"):
+            self.poll = select.poll()
+        self.fds = dict()
+        self.watched = set()
+        self.exited = set()
+
+    def supported(self):
+        return self.kqueue is not None or self.poll is not None
+
+    def add(self, pid):
+        # returns whether an exit event will arrive for the process
+        if pid in self.watched:
+            return True
+        if pid in self.exited:
+            return False
+        try:
+            if self.kqueue is not None:
+                event = select.kevent(
+                    pid,
+                    filter=select.KQ_FILTER_PROC,
+                    flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                    fflags=select.KQ_NOTE_EXIT,
+                )
+                self.kqueue.control([event], 0, 0)
+            elif self.poll is not None:
+                fd = os.pidfd_open(pid)
+                self.fds[fd] = pid
+                self.poll.register(fd, select.POLLIN)
+            else:
+                return False
+        except ProcessLookupError:
+            self.exited.add(pid)
+            return False
+        except OSError:
+            return False
+        self.watched.add(pid)
+        return True
+
+    def wait(self, timeout=None):
+        # blocks until a watched process exits or the timeout passes and
+        # returns the pids that exited
+        if not self.watched:
+            time.sleep(POLL_MAX if timeout is None else timeout)
+            return []
+        if self.kqueue is not None:
+            events = self.kqueue.control(None, len(self.watched), timeout)
+            pids = [event.ident for event in events]
+        else:
+            pids = []
+            for fd, _ in self.poll.poll(None if timeout is None else timeout * 1000):
+                self.poll.unregister(fd)
+                os.close(fd)
+                pids.append(self.fds.pop(fd))
+        for pid in pids:
+            self.watched.discard(pid)
+            self.exited.add(pid)
+        return pids
+
+    def close(self):
+        if self.kqueue is not None:
+            self.kqueue.close()
+        for fd in self.fds:
+            os.close(fd)
+        self.fds.clear()
+
+
+def reached(condition, status, initial_pid, exited):
+    # `exited` waits for the process that ran when the wait started, even if
+    # the service was restarted since
+    stat, pid, _ = status
+    if condition == "running":
+        return stat is True
+    elif condition == "stopped":
+        return stat is not True
+    return initial_pid is None or initial_pid in exited or pid != initial_pid
@@ -0,0 +1,159 @@
+import launch_options
+import json
+import time
+import os
+
+
+# Per service resource limits, set in the registry as a "watchdog" entry, for
+# example "watchdog": {"max_rss": "512M", "max_cpu_pct": 90, "cpu_window": 60,
+# "action": "restart"}. Limits cover the whole process tree of the service
+LIMITS = ("max_rss", "max_cpu_pct", "max_open_files")
+KEYS = (*LIMITS, "cpu_window", "action")
+ACTIONS = ("warn", "restart", "stop")
+# seconds max_cpu_pct is averaged over unless the entry sets cpu_window
+CPU_WINDOW = 60.0
+# the audit log is moved to <path>.1 once it is this big
+AUDIT_MAX_BYTES = 1024 * 1024
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate(rules):
+    # fills in cpu_window and action, max_rss comes back in bytes
+    if not isinstance(rules, dict):
+        raise ValueError("watchdog has to be a mapping")
+    if not rules:
+        return dict()
+    validated = dict()
+    for name, value in rules.items():
+        if name not in KEYS:
+            raise ValueError(
+                f"Unknown watchdog option {name}, expected one of {', '.join(KEYS)}"
+            )
+        if name == "max_rss":
+            try:
+                value = launch_options.parse_size(value)
+            except ValueError:
+                raise ValueError(f"Invalid size {value} for max_rss") from None
+            if not launch_options.is_int(value) or value <= 0:
+                raise ValueError("max_rss has to be a positive size")
+        elif name == "max_open_files" and (
+            not launch_options.is_int(value) or value <= 0
+        ):
+            raise ValueError("max_open_files has to be a positive integer")
+        elif name in ("max_cpu_pct", "cpu_window") and (
+            not is_number(value) or value <= 0
+        ):
+            raise ValueError(f"{name} has to be a positive number")
+        elif name == "action" and value not in ACTIONS:
+            raise ValueError(
+                f"Invalid watchdog action {value}, expected one of {', '.join(ACTIONS)}"
+            )
+        validated[name] = value
+    if not any(limit in validated for limit in LIMITS):
+        raise ValueError("watchdog needs max_rss, max_cpu_pct or max_open_files")
+    validated.setdefault("cpu_window", CPU_WINDOW)
+    validated.setdefault("action", "warn")
+    return validated
+
+
+def new_state(pid):
+    return dict(pid=pid, samples=[], over=[])
+
+
+def cpu_percent(samples, window):
+    # the average over the last `window` seconds, or None until the samples
+    # cover a whole window
+    now, cpu = samples[-1]
+    base = None
+    for sample in samples:
+        if now - sample[0] >= window:
+            base = sample
+    if base is None:
+        return None
+    return max(0.0, cpu - base[1]) / (now - base[0]) * 100
+
+
+def check(rules, state, totals, now):
+    # records a sample of the service in `state` and returns the limits it
+    # went over since the last check as (limit, value) pairs, a limit that
+    # stays exceeded is only reported once
+    samples = state["samples"] + [[now, totals["cpu"]]]
+    window = rules["cpu_window"]
+    values = dict(
+        max_rss=totals["rss"],
+        max_cpu_pct=cpu_percent(samples, window),
+        max_open_files=totals["fds"],
+    )
+    # the newest sample that is a whole window old is kept as the base
+    start = 0
+    for index, sample in enumerate(samples):
+        if now - sample[0] >= window:
+            start = index
+    state["samples"] = samples[start:]
+
+    over = [
+        limit
+        for limit in LIMITS
+        if limit in rules and values[limit] is not None and values[limit] > rules[limit]
+    ]
+    new = [(limit, values[limit]) for limit in over if limit not in state["over"]]
+    state["over"] = over
+    return new
+
+
+def audit(path, record):
+    try:
+        if os.path.getsize(path) >= AUDIT_MAX_BYTES:
+            os.replace(path, f"{path}.1")
+    except FileNotFoundError:
+        pass
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def read_audit(path, service, count):
+    # the last `count` records of a service, oldest first
+    records = []
+    for name in (f"{path}.1", path):
+        try:
+            with open(name, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("service") == service:
+                        records.append(record)
+        except FileNotFoundError:
+            continue
+    return records[-count:] if count else []
+
+
+def format_value(limit, value):
+    if limit == "max_rss":
+        import procstats
+
+        return procstats.format_bytes(value)
+    elif limit == "max_cpu_pct":
+        return f"{value:.1f}%"
+    return str(value)
+
+
+def describe(rules):
+    return [
+        (name, format_value(name, value) if name in LIMITS else value)
+        for name, value in rules.items()
+    ]
+
+
+def describe_record(record):
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["time"]))
+    limit = record["limit"]
+    value = format_value(limit, record["value"])
+    return (
+        f"{when} {limit} {value} > {format_value(limit, record['max'])}, "
+        f"{record['action']} ({record['result']})"
+    )
@@ -0,0 +1,75 @@
+import shutil
+
+
+def transition(previous, current):
+    # statuses are (status, pid, return code) tuples as returned by
+    # service_status, or None when the service is not in the registry
+    if previous == current:
+        return None
+    if previous is None:
+        return "added"
+    if current is None:
+        return "removed"
+    was_running, running = previous[0], current[0]
+    if was_running is None:
+        return "started" if running else "loaded"
+    if running is None:
+        return "unloaded"
+    if not was_running and running:
+        return "started"
+    if was_running and not running:
+        return "stopped"
+    if running:
+        return "restarted"
+    # stopped before and after, but it ran and exited in between
+    return "exited"
+
+
+def diff(previous, current):
+    events = []
+    for service in {**previous, **current}:
+        event = transition(previous.get(service), current.get(service))
+        if event is not None:
+            events.append((service, event))
+    return events
+
+
+def event_record(service, event, previous, current, now):
+    def describe(status):
+        if status is None:
+            return None
+        stat, pid, retcode = status
+        return dict(status=stat, pid=pid, return_code=retcode)
+
+    return dict(
+        time=round(now, 3),
+        service=service,
+        event=event,
+        **(describe(current) or dict(status=None, pid=None, return_code=None)),
+        previous=describe(previous),
+    )
+
+
+class Screen:
+    # redraws only the lines that changed since the last frame, and the
+    # whole screen when the number of lines changed or does not fit
+    def __init__(self, out):
+        self.out = out
+        self.lines = None
+
+    def draw(self, lines):
+        height = shutil.get_terminal_size().lines
+        if self.lines is None or len(lines) != len(self.lines) or len(lines) >= height:
+            self.out.write("\033[?25l\033[H\033[J" + "\n".join(lines) + "\n")
+        else:
+            for row, (old, new) in enumerate(zip(self.lines, lines)):
+                if old != new:
+                    self.out.write(f"\033[{row + 1};1H{new}\033[K")
+            self.out.write(f"\033[{len(lines) + 1};1H")
+        self.out.flush()
+        self.lines = lines
+
+    def close(self):
+        # shows the cursor again
+        self.out.write("\033[?25h")
+        self.out.flush()